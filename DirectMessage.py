@@ -1,5 +1,6 @@
 import discord
 from discord.ext import commands
+from Webhooks import send_as
 
 class DirectMessage(commands.Cog):
     def __init__(self, bot):
@@ -13,9 +14,7 @@ class DirectMessage(commands.Cog):
     #Send a message as someone else#
     @commands.command()
     async def quote(self, ctx, member: discord.Member, *, message: commands.clean_content()):
-        webhook = await ctx.channel.create_webhook(name=member.display_name)
-        await webhook.send(message, avatar_url=member.avatar_url_as(format='png'))
-        await webhook.delete()
+        await send_as(self.bot, ctx.channel, message, member)
         try:
             await ctx.message.delete()
         except (discord.Forbidden, discord.HTTPException):
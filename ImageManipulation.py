@@ -1,9 +1,14 @@
 import discord
-import requests
+import aiohttp
+import asyncio
+import hashlib
 import random
 import io
-from PIL import Image
+import warnings
 from typing import Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from discord.ext import commands
 from utils.global_utils import bright_color, last_image, is_image
 from config import WAIFU2X_KEY
@@ -11,34 +16,320 @@ from config import WAIFU2X_KEY
 API_URL = 'https://api.deepai.org/api/waifu2x'
 HEADERS = {'api-key': WAIFU2X_KEY}
 
+# deepai is slow, only let a few requests through at once and give up on hung ones
+UPSCALE_CONCURRENCY = 2
+UPSCALE_RETRIES = 3
+UPSCALE_TIMEOUT = aiohttp.ClientTimeout(total=90, sock_connect=10)
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+# Number of upscaled image urls to remember
+UPSCALE_CACHE_SIZE = 256
+
+# Image worker processes and how many jobs can be running or waiting for one
+IMAGE_WORKERS = 2
+IMAGE_QUEUE_SIZE = 8
+IMAGE_JOB_TIMEOUT = 20
+MAX_DOWNLOAD_BYTES = 8 * 1024 * 1024
+# Anything bigger than this is refused before being decoded
+MAX_IMAGE_PIXELS = 40_000_000
+# and anything bigger than this is scaled down before being worked on
+MAX_IMAGE_SIZE = (2048, 2048)
+
+# Images remembered per channel, and image urls remembered overall
+RECENT_IMAGES = 10
+IMAGE_INFO_CACHE_SIZE = 2048
+IMAGE_TYPES = {'png': 'image/png',
+               'jpg': 'image/jpeg',
+               'jpeg': 'image/jpeg',
+               'gif': 'image/gif'}
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class ImagePoolFull(Exception):
+    pass
+
+
+class UnreadableImage(Exception):
+    pass
+
+
+def init_image_worker():
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    # PIL only warns between MAX_IMAGE_PIXELS and twice that, refuse those too
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+
+def open_image(content):
+    from PIL import Image
+    img = Image.open(io.BytesIO(content))
+    # For JPEGs this makes the decoder downscale for us, which is much cheaper than resizing after
+    img.draft('RGB', MAX_IMAGE_SIZE)
+    if img.width > MAX_IMAGE_SIZE[0] or img.height > MAX_IMAGE_SIZE[1]:
+        img.thumbnail(MAX_IMAGE_SIZE)
+    return img
+
 
 def make_more_jpeg(content,amount):
-    img = Image.open(content)
-    buffer = io.BytesIO()
-    img.convert('RGB').save(buffer, "jpeg", quality=int(amount))
-    buffer.seek(0)
-    return buffer
+    """Runs in an image worker, takes and returns raw bytes.
+    PIL's errors are raised as ImageTooLarge or UnreadableImage so the cog doesn't have to import PIL for them"""
+    from PIL import Image
+    try:
+        img = open_image(content)
+        buffer = io.BytesIO()
+        img.convert('RGB').save(buffer, "jpeg", quality=amount)
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise ImageTooLarge from None
+    except (OSError, ValueError):
+        raise UnreadableImage from None
+    return buffer.getvalue()
+
+
+class ImageWorkerPool:
+    """Runs PIL work in separate processes so it can't hold up the event loop or the GIL"""
+    def __init__(self, loop):
+        self.loop = loop
+        self.executor = self.new_executor()
+        self.jobs = set()  # futures of the current executor, never more than there are workers
+        self.idle = asyncio.Semaphore(IMAGE_WORKERS)
+        self.waiting = 0  # jobs waiting for a worker
+
+    @staticmethod
+    def new_executor():
+        return ProcessPoolExecutor(max_workers=IMAGE_WORKERS, initializer=init_image_worker)
+
+    @property
+    def full(self):
+        return self.waiting + len(self.jobs) >= IMAGE_QUEUE_SIZE
+
+    async def run(self, func, *args):
+        if self.full:
+            raise ImagePoolFull
+        # Jobs queue here instead of inside the executor, so the timeout only starts once a worker has the job
+        self.waiting += 1
+        try:
+            await self.idle.acquire()
+        finally:
+            self.waiting -= 1
+        jobs = self.jobs
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.idle.release()
+            raise
+        jobs.add(future)
+
+        def done(f):
+            jobs.discard(f)
+            self.idle.release()
+        # Only free the worker once it's actually done, not when we stop waiting for it
+        future.add_done_callback(lambda f: self.loop.call_soon_threadsafe(done, f))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future, loop=self.loop), timeout=IMAGE_JOB_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Unless another overrunning job already had the executor replaced
+            if jobs is self.jobs:
+                self.recycle()
+            raise
+
+    def recycle(self):
+        """Replaces the executor and kills its workers. A hung job would otherwise keep its worker forever,
+        jobs that were running alongside it fail with BrokenProcessPool"""
+        old = self.executor
+        self.executor = self.new_executor()
+        self.jobs = set()
+        # There's no public way to stop a job that is already running
+        for process in list((getattr(old, '_processes', None) or {}).values()):
+            process.terminate()
+        old.shutdown(wait=False)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
 
 class ImageManipulation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.upscale_limiter = asyncio.Semaphore(UPSCALE_CONCURRENCY)
+        self.upscaled = OrderedDict()  # sha256 of source image: upscaled url
+        self.pool = ImageWorkerPool(bot.loop)
+        self.recent_images = {}  # channel_id: deque of (message_id, url)
+        self.image_info = OrderedDict()  # url: (content type, size in bytes)
+        self.checked_urls = OrderedDict()  # (url, gif): result of is_image
+
+    def cog_unload(self):
+        self.pool.close()
+
+    def remember_image(self, url, content_type, size):
+        self.image_info[url] = (content_type, size)
+        self.image_info.move_to_end(url)
+        if len(self.image_info) > IMAGE_INFO_CACHE_SIZE:
+            self.image_info.popitem(last=False)
+
+    def images_in(self, message):
+        for attachment in message.attachments:
+            if attachment.height is None:
+                continue  # Not an image
+            content_type = IMAGE_TYPES.get(attachment.filename.rsplit('.', 1)[-1].lower())
+            if content_type is not None:
+                self.remember_image(attachment.url, content_type, attachment.size)
+                yield attachment.url
+        yield from self.embed_images(message.embeds)
+
+    @staticmethod
+    def embed_images(embeds):
+        for embed in embeds:
+            if embed.type == 'image' and embed.url:
+                yield embed.url
+            elif embed.image and embed.image.url:
+                yield embed.image.url
+
+    def add_recent(self, message, urls):
+        recent = self.recent_images.setdefault(message.channel.id, deque(maxlen=RECENT_IMAGES))
+        recent.extend((message.id, url) for url in urls)
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        urls = list(self.images_in(message))
+        if urls:
+            self.add_recent(message, urls)
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before, after):
+        # Links only get their embeds after being sent. The attachments were already seen in on_message
+        seen = set(self.embed_images(before.embeds))
+        urls = [url for url in self.embed_images(after.embeds) if url not in seen]
+        if urls:
+            self.add_recent(after, urls)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        recent = self.recent_images.get(payload.channel_id)
+        if recent and any(message_id == payload.message_id for message_id, _ in recent):
+            self.recent_images[payload.channel_id] = deque(((mid, url) for mid, url in recent if mid != payload.message_id),
+                                                           maxlen=RECENT_IMAGES)
+
+    async def find_last_image(self, ctx):
+        """Same as last_image but answers from the images we saw being sent when possible"""
+        recent = self.recent_images.get(ctx.channel.id)
+        if recent:
+            return recent[-1][1]
+        return await last_image(ctx)
+
+    async def check_image(self, ctx, url, gif=False):
+        """Same as is_image but remembers the result, and knows sent attachments are images"""
+        info = self.image_info.get(url)
+        if info is not None:
+            return gif or info[0] != 'image/gif'
+        key = (url, gif)
+        if key not in self.checked_urls:
+            self.checked_urls[key] = await is_image(ctx, url, gif=gif)
+            if len(self.checked_urls) > IMAGE_INFO_CACHE_SIZE:
+                self.checked_urls.popitem(last=False)
+        return self.checked_urls[key]
+
+    async def download_image(self, url, limit=MAX_DOWNLOAD_BYTES):
+        """Streams the image into memory, stopping as soon as it goes over `limit` bytes"""
+        info = self.image_info.get(url)
+        if info is not None and info[1] > limit:
+            raise ImageTooLarge
+        async with self.bot.session.get(url, timeout=DOWNLOAD_TIMEOUT) as resp:
+            if resp.status >= 400:
+                return None
+            if resp.content_length is not None and resp.content_length > limit:
+                raise ImageTooLarge
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > limit:
+                    raise ImageTooLarge
+            return bytes(data)
+
+    async def send_more_jpeg(self, ctx, url, amount):
+        """Downloads, jpegs and sends the image. Shared with needsmorejpeg"""
+        try:
+            amount = int(amount)
+        except ValueError:
+            amount = 0
+        if not 1 <= amount <= 100:
+            return await ctx.send('The amount has to be a number from 1 to 100')
+
+        try:
+            data = await self.download_image(url)
+        except ImageTooLarge:
+            return await ctx.send(f'That image is too big! (max {MAX_DOWNLOAD_BYTES // (1024 * 1024)}MB)')
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            data = None
+        if data is None:
+            return await ctx.send('Could not download the image')
+
+        try:
+            jpeg = await self.pool.run(make_more_jpeg, data, amount)
+        except ImagePoolFull:
+            return await ctx.send('I am busy with too many images right now, try again in a bit')
+        except asyncio.TimeoutError:
+            return await ctx.send('That image took too long to process')
+        except BrokenProcessPool:
+            return await ctx.send('Image processing had to be restarted, please try again')
+        except ImageTooLarge:
+            return await ctx.send('That image is too big!')
+        except UnreadableImage:
+            return await ctx.send('Unable to read that image')
+        # BytesIO shares the bytes' buffer until written to, so this does not copy the result
+        await ctx.send(file=discord.File(io.BytesIO(jpeg), filename='more_jpeg.jpg'))
+
+    async def request_upscale(self, data):
+        """Sends the image to deepai, retrying with backoff if it is rate limited or having issues.
+        Returns the upscaled image's url or None if it failed"""
+        async with self.upscale_limiter:
+            for attempt in range(UPSCALE_RETRIES):
+                if attempt:
+                    await asyncio.sleep(2 ** attempt + random.random())
+                form = aiohttp.FormData()
+                form.add_field('image', data, filename='image')
+                try:
+                    async with self.bot.session.post(API_URL, data=form, headers=HEADERS, timeout=UPSCALE_TIMEOUT) as resp:
+                        if resp.status == 429 or resp.status >= 500:
+                            continue
+                        if resp.status >= 400:
+                            return None
+                        js = await resp.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    continue
+                return js.get('output_url')
 
     @commands.command(pass_context=True)
     async def upscale(self, ctx, url=None):
-        url = url or await last_image(ctx)
+        url = url or await self.find_last_image(ctx)
         if url is None:
             return await ctx.send('Unable to find an image')
-        if not await is_image(ctx, url):
+        if not await self.check_image(ctx, url):
             return await ctx.send('That is not a valid image url')
-        data = {
-            'image': url
-        }
-
-        r = requests.post(API_URL,data=data,headers=HEADERS)
-        upscaled_image = r.json()
-        img_url = upscaled_image['output_url']
-        if img_url is None:
-            return await ctx.send('Failed')
+
+        async with ctx.typing():
+            try:
+                data = await self.download_image(url)
+            except ImageTooLarge:
+                return await ctx.send('That image is too big!')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                data = None
+            if data is None:
+                return await ctx.send('Could not download the image')
+
+            key = hashlib.sha256(data).hexdigest()
+            img_url = self.upscaled.get(key)
+            if img_url is None:
+                img_url = await self.request_upscale(data)
+                if img_url is None:
+                    return await ctx.send('Failed')
+                self.upscaled[key] = img_url
+                if len(self.upscaled) > UPSCALE_CACHE_SIZE:
+                    self.upscaled.popitem(last=False)
+            else:
+                self.upscaled.move_to_end(key)
+
         e = discord.Embed(colour=bright_color())
         e.set_image(url=img_url)
         e.set_author(name='Upscaled Image', url=img_url)
@@ -46,7 +337,7 @@ class ImageManipulation(commands.Cog):
 
     @commands.command(hidden=True)
     async def lastimage(self, ctx):
-        url = await last_image(ctx)
+        url = await self.find_last_image(ctx)
         if url is None:
             return await ctx.send('Unable to find an image')
         e = discord.Embed(colour=bright_color())
@@ -55,15 +346,12 @@ class ImageManipulation(commands.Cog):
 
     @commands.command(pass_context=True)
     async def jpg(self, ctx,amount, url=None):
-        url = url or await last_image(ctx)
+        url = url or await self.find_last_image(ctx)
         if url is None:
             return await ctx.send('Unable to find an image')
-        if not await is_image(ctx, url):
+        if not await self.check_image(ctx, url):
             return await ctx.send('That is not a valid image url')
-        async with self.bot.session.get(url) as resp:
-            data = io.BytesIO(await resp.read())
-        jpeg = make_more_jpeg(data,amount)
-        await ctx.send(file=discord.File(jpeg, filename='more_jpeg.jpg'))
+        await self.send_more_jpeg(ctx, url, amount)
 
 def setup(bot):
-    bot.add_cog(ImageManipulation(bot))
\ No newline at end of file
+    bot.add_cog(ImageManipulation(bot))
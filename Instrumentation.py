@@ -0,0 +1,329 @@
+import discord
+from discord.ext import commands
+import io
+import time
+import asyncio
+import contextvars
+
+# Histogram buckets are log-linear like HdrHistogram: every power of two is split into 16 buckets,
+# so any recorded value is at most ~6% off. Values are in microseconds, up to about 2 minutes
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_VALUE_BITS = 27
+BUCKET_COUNT = (MAX_VALUE_BITS - SUB_BUCKET_BITS) * SUB_BUCKETS + 2 * SUB_BUCKETS
+# Bucket bounds shown in the export, in seconds
+EXPORT_BOUNDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The metric of the command/listener running in the current task, DB and REST time is added to it
+current_metric = contextvars.ContextVar('current_metric', default=None)
+# A dict that lives for one command or listener invocation, other cogs keep per invocation state in it
+current_invocation = contextvars.ContextVar('current_invocation', default=None)
+
+
+def bucket_index(value):
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return min((shift << SUB_BUCKET_BITS) + (value >> shift), BUCKET_COUNT - 1)
+
+
+def bucket_floor(index):
+    """Smallest value that lands in the bucket"""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return (index - (shift << SUB_BUCKET_BITS)) << shift
+
+
+class Histogram:
+    """Fixed size latency histogram. Only ever touched from the event loop so there is nothing to lock"""
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1_000_000)
+        self.counts[bucket_index(value)] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Returns the value (seconds) that `pct` percent of recorded values are at or below"""
+        if not self.total:
+            return 0
+        rank = self.total * pct / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bucket_floor(index + 1), self.max) / 1_000_000
+        return self.max / 1_000_000
+
+    def count_at_or_below(self, seconds):
+        limit = bucket_index(int(seconds * 1_000_000))
+        return sum(self.counts[:limit + 1])
+
+
+class Metric:
+    __slots__ = ('kind', 'name', 'histogram', 'errors', 'time', 'db_time', 'db_calls', 'rest_time', 'rest_calls')
+
+    def __init__(self, kind, name):
+        self.kind = kind  # 'command' or 'listener'
+        self.name = name
+        self.histogram = Histogram()
+        self.errors = 0
+        self.time = 0
+        self.db_time = 0
+        self.db_calls = 0
+        self.rest_time = 0
+        self.rest_calls = 0
+
+    @property
+    def count(self):
+        return self.histogram.total
+
+
+class ObservedConnection:
+    """A connection from `pool.acquire()`, queries made through it are observed like the pool's"""
+
+    def __init__(self, connection, pool):
+        self._connection = connection
+        self._observed = pool
+
+    def __getattr__(self, item):
+        attr = getattr(self._connection, item)
+        if item in ObservedPool.OBSERVED:
+            return self._observed.observe(item, attr)
+        return attr
+
+
+class _ObservedAcquire:
+    def __init__(self, acquire, pool):
+        self._acquire = acquire
+        self._observed = pool
+
+    async def __aenter__(self):
+        return ObservedConnection(await self._acquire.__aenter__(), self._observed)
+
+    async def __aexit__(self, *exc):
+        return await self._acquire.__aexit__(*exc)
+
+    def __await__(self):
+        return self._acquire.__await__()
+
+
+class ObservedPool:
+    """Wraps bot.pool and calls every observer with `(method, query, args, result, elapsed)` after each query.
+    result is None if the query failed. There is only one of these on bot.pool no matter how many cogs observe it,
+    use observe_pool and unobserve_pool instead of wrapping the pool again"""
+    OBSERVED = {'fetch', 'fetchrow', 'fetchval', 'execute', 'executemany'}
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.observers = []
+
+    def __getattr__(self, item):
+        attr = getattr(self._pool, item)
+        if item in self.OBSERVED:
+            return self.observe(item, attr)
+        return attr
+
+    def acquire(self, *args, **kwargs):
+        return _ObservedAcquire(self._pool.acquire(*args, **kwargs), self)
+
+    def observe(self, method, func):
+        async def wrapper(query, *args, **kwargs):
+            start = time.perf_counter()
+            result = None
+            try:
+                result = await func(query, *args, **kwargs)
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                for observer in self.observers:
+                    observer(method, query, args, result, elapsed)
+        return wrapper
+
+
+def observe_pool(bot, observer):
+    pool = getattr(bot, 'pool', None)
+    if pool is None:
+        return
+    if not isinstance(pool, ObservedPool):
+        pool = bot.pool = ObservedPool(pool)
+    pool.observers.append(observer)
+
+
+def unobserve_pool(bot, observer):
+    pool = getattr(bot, 'pool', None)
+    if isinstance(pool, ObservedPool):
+        if observer in pool.observers:
+            pool.observers.remove(observer)
+        if not pool.observers:
+            bot.pool = pool._pool
+
+
+class Instrumentation(commands.Cog, name='Instrumentation'):
+    """Always on timing of every command and every event listener.
+    Tracks count, errors and a latency histogram for each, plus how much of that time was spent
+    waiting on the database and on Discord's API"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.metrics = {}  # (kind, name): Metric
+        self.started = time.monotonic()
+        self._previous_hooks = (bot._before_invoke, bot._after_invoke)
+        bot.before_invoke(self.before_command)
+        bot.after_invoke(self.after_command)
+        # Every listener task goes through _run_event
+        bot._run_event = self.run_event
+        self._request = bot.http.request
+        bot.http.request = self.timed_request
+        observe_pool(bot, self.query_done)
+
+    def cog_unload(self):
+        self.bot._before_invoke, self.bot._after_invoke = self._previous_hooks
+        del self.bot._run_event
+        self.bot.http.request = self._request
+        unobserve_pool(self.bot, self.query_done)
+
+    async def cog_check(self, ctx):
+        if not await ctx.bot.is_owner(ctx.author):
+            raise commands.NotOwner('Only my owner can use this command.')
+        return True
+
+    def metric(self, kind, name):
+        metric = self.metrics.get((kind, name))
+        if metric is None:
+            metric = self.metrics[(kind, name)] = Metric(kind, name)
+        return metric
+
+    @staticmethod
+    def record(metric, elapsed, failed):
+        metric.histogram.record(elapsed)
+        metric.time += elapsed
+        if failed:
+            metric.errors += 1
+
+    async def run_event(self, coro, event_name, *args, **kwargs):
+        metric = self.metric('listener', getattr(coro, '__qualname__', event_name))
+        token = current_metric.set(metric)
+        invocation = current_invocation.set({})
+        start = time.perf_counter()
+        failed = True
+        try:
+            await coro(*args, **kwargs)
+            failed = False
+        except asyncio.CancelledError:
+            failed = False
+        except Exception:
+            # Same as Client._run_event
+            try:
+                await self.bot.on_error(event_name, *args, **kwargs)
+            except Exception:
+                pass
+        finally:
+            self.record(metric, time.perf_counter() - start, failed)
+            current_metric.reset(token)
+            current_invocation.reset(invocation)
+
+    @staticmethod
+    def query_done(method, query, args, result, elapsed):
+        metric = current_metric.get()
+        if metric is not None:
+            metric.db_time += elapsed
+            metric.db_calls += 1
+
+    async def timed_request(self, *args, **kwargs):
+        metric = current_metric.get()
+        if metric is None:
+            return await self._request(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await self._request(*args, **kwargs)
+        finally:
+            metric.rest_time += time.perf_counter() - start
+            metric.rest_calls += 1
+
+    async def before_command(self, ctx):
+        metric = self.metric('command', ctx.command.qualified_name)
+        ctx.instrument = (metric, current_metric.set(metric), current_invocation.set({}), time.perf_counter())
+        if self._previous_hooks[0] is not None:
+            await self._previous_hooks[0](ctx)
+
+    async def after_command(self, ctx):
+        if self._previous_hooks[1] is not None:
+            await self._previous_hooks[1](ctx)
+        metric, token, invocation, start = ctx.instrument
+        self.record(metric, time.perf_counter() - start, ctx.command_failed)
+        current_metric.reset(token)
+        current_invocation.reset(invocation)
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        # Failed before it got to run (checks, bad arguments), after_command never saw it
+        if ctx.command is not None and not hasattr(ctx, 'instrument'):
+            self.metric('command', ctx.command.qualified_name).errors += 1
+
+    def export(self):
+        """Prometheus text format"""
+        lines = []
+        for kind in ('command', 'listener'):
+            lines.append(f'# TYPE bot_{kind}_seconds histogram')
+            for metric in self.metrics.values():
+                if metric.kind != kind:
+                    continue
+                label = f'name="{metric.name}"'
+                for bound in EXPORT_BOUNDS:
+                    lines.append(f'bot_{kind}_seconds_bucket{{{label},le="{bound}"}} {metric.histogram.count_at_or_below(bound)}')
+                lines.append(f'bot_{kind}_seconds_bucket{{{label},le="+Inf"}} {metric.count}')
+                lines.append(f'bot_{kind}_seconds_sum{{{label}}} {metric.time:.6f}')
+                lines.append(f'bot_{kind}_seconds_count{{{label}}} {metric.count}')
+            for field in ('errors', 'db_seconds', 'db_calls', 'rest_seconds', 'rest_calls'):
+                lines.append(f'# TYPE bot_{kind}_{field}_total counter')
+                attr = field.replace('_seconds', '_time')
+                for metric in self.metrics.values():
+                    if metric.kind == kind:
+                        lines.append(f'bot_{kind}_{field}_total{{name="{metric.name}"}} {getattr(metric, attr)}')
+        return '\n'.join(lines) + '\n'
+
+    @commands.group(name='perf', invoke_without_command=True, hidden=True)
+    async def perf(self, ctx, kind: str = None, top: int = 15):
+        """Shows the slowest commands and listeners by total time spent
+        `kind` can be command or listener to only show those"""
+        metrics = [m for m in self.metrics.values() if kind is None or m.kind == kind.lower().rstrip('s')]
+        if not metrics:
+            return await ctx.send('Nothing recorded yet')
+        metrics.sort(key=lambda m: m.time, reverse=True)
+
+        def ms(seconds):
+            return f'{seconds * 1000:.1f}'
+
+        paginator = commands.Paginator(prefix='```', suffix='```')
+        paginator.add_line(f'{"Name":<36}{"Count":>8}{"Err":>5}{"p50":>8}{"p99":>8}{"Max":>8}{"DB/ea":>8}{"API/ea":>8}')
+        for m in metrics[:top]:
+            paginator.add_line(f'{m.name[:35]:<36}{m.count:>8}{m.errors:>5}{ms(m.histogram.percentile(50)):>8}'
+                               f'{ms(m.histogram.percentile(99)):>8}{ms(m.histogram.max / 1_000_000):>8}'
+                               f'{ms(m.db_time / m.count) if m.count else "-":>8}{ms(m.rest_time / m.count) if m.count else "-":>8}')
+        paginator.add_line(f'\nTimes in ms, recording for {(time.monotonic() - self.started) / 60:.0f} minutes')
+        for page in paginator.pages:
+            await ctx.send(page)
+
+    @perf.command(name='export')
+    async def perf_export(self, ctx):
+        """Uploads every metric in Prometheus' text format"""
+        await ctx.send(file=discord.File(io.BytesIO(self.export().encode()), filename='metrics.txt'))
+
+    @perf.command(name='reset')
+    async def perf_reset(self, ctx):
+        self.metrics.clear()
+        self.started = time.monotonic()
+        await ctx.send('Cleared all recorded timings')
+
+
+def setup(bot):
+    bot.add_cog(Instrumentation(bot))
@@ -1,13 +1,124 @@
 import discord
 from discord.ext import commands
+import time
+import asyncio
+import hashlib
 import datetime
-import googletrans
+from typing import Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from utils.global_utils import upload_hastebin, bright_color
 
+TRANSLATE_WORKERS = 4
+TRANSLATE_CACHE_SIZE = 1024
+TRANSLATE_CACHE_TTL = 3600
+# Stop asking google for a while after this many failures in a row
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+# Batch translations send lines in groups of up to this many characters, a few groups at a time
+BATCH_CHUNK_SIZE = 4000
+BATCH_CONCURRENCY = 3
+MAX_BATCH_MESSAGES = 100
+
+
+class TranslatorUnavailable(Exception):
+    pass
+
+
+class TranslationService:
+    """Translates on its own threads, caching results and sharing identical requests that are in flight.
+    The translator only needs a googletrans style `translate(text, dest=...)` so a fake one can be passed in"""
+
+    def __init__(self, loop, translator=None, *, workers=TRANSLATE_WORKERS):
+        self.loop = loop
+        self._translator = translator
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='translate')
+        self.cache = OrderedDict()  # (sha1 of text, dest): (expires at, result)
+        self.in_flight = {}  # (sha1 of text, dest): task
+        self.failures = 0
+        self.open_until = 0  # While the breaker is open requests are refused without asking google
+
+    @property
+    def translator(self):
+        # googletrans is slow to import, only pay for it once something needs translating
+        if self._translator is None:
+            import googletrans
+            self._translator = googletrans.Translator()
+        return self._translator
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def translate(self, text, dest='en'):
+        key = (hashlib.sha1(text.encode()).hexdigest(), dest)
+        now = time.monotonic()
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] > now:
+            self.cache.move_to_end(key)
+            return cached[1]
+
+        task = self.in_flight.get(key)
+        if task is None:
+            if now < self.open_until:
+                raise TranslatorUnavailable
+            task = self.in_flight[key] = self.loop.create_task(self._translate(key, text, dest))
+        # Shielded so one caller giving up does not cancel it for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def translate_lines(self, lines, dest='en'):
+        """Translates many lines using as few requests as possible.
+        Returns a dict of line: translated line"""
+        unique = list(dict.fromkeys(line for line in lines if line))
+        chunks = [[]]
+        size = 0
+        for line in unique:
+            if chunks[-1] and size + len(line) + 1 > BATCH_CHUNK_SIZE:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += len(line) + 1
+
+        limiter = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def limited(text):
+            async with limiter:
+                return (await self.translate(text, dest)).text
+
+        async def translate_chunk(chunk):
+            translated = (await limited('\n'.join(chunk))).split('\n')
+            if len(translated) != len(chunk):
+                # Lines got merged or split up, so we can't tell which is which. Do them one at a time instead
+                translated = await asyncio.gather(*[limited(line) for line in chunk])
+            return zip(chunk, translated)
+
+        results = await asyncio.gather(*[translate_chunk(chunk) for chunk in chunks if chunk])
+        return {line: translated for pairs in results for line, translated in pairs}
+
+    async def _translate(self, key, text, dest):
+        try:
+            result = await self.loop.run_in_executor(self.executor, lambda: self.translator.translate(text, dest=dest))
+        except Exception:
+            self.failures += 1
+            if self.failures >= BREAKER_THRESHOLD:
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN
+            raise
+        else:
+            self.failures = 0
+            self.cache[key] = (time.monotonic() + TRANSLATE_CACHE_TTL, result)
+            if len(self.cache) > TRANSLATE_CACHE_SIZE:
+                self.cache.popitem(last=False)
+            return result
+        finally:
+            del self.in_flight[key]
+
+
 class LanguageProcessing(commands.Cog, name='NLP'):
     def __init__(self, bot):
         self.bot = bot
-        self.translator = googletrans.Translator()
+        self.translation = TranslationService(bot.loop)
+
+    def cog_unload(self):
+        self.translation.close()
 
     @commands.command(pass_context=True)
     async def translate(self, ctx, *, text: commands.clean_content=None):
@@ -20,15 +131,17 @@ class LanguageProcessing(commands.Cog, name='NLP'):
                     break
             if text is None:
                 return await ctx.send('Unable to find text to translate!')
-        loop = self.bot.loop
         try:
-            res = await loop.run_in_executor(None, self.translator.translate, text)
+            res = await self.translation.translate(text)
+        except TranslatorUnavailable:
+            return await ctx.send('Google translate is having issues right now, please try again in a minute')
         except Exception as e:
             return await ctx.send(f'An error occurred: {e.__class__.__name__}: {e}')
 
+        from googletrans import LANGUAGES
         embed = discord.Embed(title='Translated', color=bright_color())
-        src = googletrans.LANGUAGES.get(res.src, '(auto-detected)').title()
-        dest = googletrans.LANGUAGES.get(res.dest, 'Unknown').title()
+        src = LANGUAGES.get(res.src, '(auto-detected)').title()
+        dest = LANGUAGES.get(res.dest, 'Unknown').title()
         original = res.origin if len(res.origin) < 1024 else f'[Text too long to send, uploaded instead]({await upload_hastebin(ctx, res.origin)})'
         translated = res.text if len(res.text) < 1024 else f'[Text too long to send, uploaded instead]({await upload_hastebin(ctx, res.text)})'
         embed.add_field(name=f'From {src}', value=original, inline=False)
@@ -37,5 +150,50 @@ class LanguageProcessing(commands.Cog, name='NLP'):
             embed.description = 'Text too long to send, uploaded instead'
         await ctx.send(embed=embed)
 
+    @commands.command(name='translatemany', aliases=['batchtranslate', 'tlmany'])
+    async def translate_many(self, ctx, start: Union[int, discord.Message] = 25, end: discord.Message = None):
+        """Translates a whole conversation to English using Google translate.
+        Give a number to translate that many of the last messages (max 100)
+        or a message ID/link to translate from that message until `end` or now
+
+        `Ex. %translatemany 30` translates the last 30 messages
+        `Ex. %translatemany <link> <link>` translates both of those messages and everything between them"""
+        if isinstance(start, int) and start > MAX_BATCH_MESSAGES:
+            try:
+                start = await ctx.channel.fetch_message(start)
+            except discord.HTTPException:
+                return await ctx.send('Unable to find that message in this channel')
+
+        if isinstance(start, int):
+            if start < 1:
+                return await ctx.send(f'Please enter a number between 1 and {MAX_BATCH_MESSAGES}')
+            messages = await ctx.channel.history(limit=start, before=ctx.message).flatten()
+            messages.reverse()
+        else:
+            before = discord.Object(id=end.id + 1) if end else ctx.message
+            messages = await start.channel.history(limit=MAX_BATCH_MESSAGES, after=discord.Object(id=start.id - 1),
+                                                   before=before, oldest_first=True).flatten()
+
+        messages = [message for message in messages if message.content]
+        if not messages:
+            return await ctx.send('Unable to find text to translate!')
+
+        async with ctx.typing():
+            lines = [line.strip() for message in messages for line in message.clean_content.split('\n')]
+            try:
+                translated = await self.translation.translate_lines(lines)
+            except TranslatorUnavailable:
+                return await ctx.send('Google translate is having issues right now, please try again in a minute')
+            except Exception as e:
+                return await ctx.send(f'An error occurred: {e.__class__.__name__}: {e}')
+
+        paginator = commands.Paginator(prefix='', suffix='')
+        paginator.add_line(f'Translated {len(messages)} message{"s" if len(messages) > 1 else ""}:')
+        for message in messages:
+            text = '\n'.join(translated.get(line.strip(), line) for line in message.clean_content.split('\n'))
+            paginator.add_line(f'**{discord.utils.escape_markdown(message.author.display_name)}**: {text}'[:1900])
+        for page in paginator.pages:
+            await ctx.send(page)
+
 def setup(bot):
-    bot.add_cog(LanguageProcessing(bot))
\ No newline at end of file
+    bot.add_cog(LanguageProcessing(bot))
@@ -0,0 +1,187 @@
+from discord.ext import commands
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+
+# How often the loop is checked, and how much lag history is kept (10 minutes)
+SAMPLE_INTERVAL = 0.25
+LAG_HISTORY = int(600 / SAMPLE_INTERVAL)
+# Default for how long a single callback has to hold the loop before its stack is captured
+SLOW_CALLBACK_THRESHOLD = 0.1
+MAX_FINDINGS = 50
+STACK_LIMIT = 30
+
+
+class SlowCallback:
+    __slots__ = ('when', 'duration', 'cog', 'command', 'stack')
+
+    def __init__(self, stack, cog, command):
+        self.when = time.time()
+        self.duration = None  # loop lag it caused, filled in once the loop gets going again
+        self.cog = cog
+        self.command = command
+        self.stack = stack
+
+
+class LoopMonitor(commands.Cog, name='LoopMonitor'):
+    """Measures how late the event loop runs its callbacks.
+    The slow callback detector is a thread that watches for the loop getting stuck, and when it does,
+    grabs the stack of the loop's thread to see what is blocking it"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.lag = deque(maxlen=LAG_HISTORY)  # (monotonic time, lag in seconds)
+        self.last_beat = time.monotonic()  # last tick of the watchdog's heartbeat
+        self.findings = deque(maxlen=MAX_FINDINGS)
+        self.pending = None  # SlowCallback captured during the current stall
+        self.threshold = SLOW_CALLBACK_THRESHOLD
+        self.watchdog = None
+        self.heartbeat_task = None
+        self.watchdog_stop = threading.Event()
+        self.loop_thread = threading.get_ident()
+        self.commands_by_code = {}  # code object of a command callback: qualified name
+        self.sampler = bot.loop.create_task(self.sample_lag())
+
+    def cog_unload(self):
+        self.sampler.cancel()
+        self.stop_watchdog()
+
+    async def cog_check(self, ctx):
+        if not await ctx.bot.is_owner(ctx.author):
+            raise commands.NotOwner('Only my owner can use this command.')
+        return True
+
+    async def sample_lag(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            now = time.monotonic()
+            self.lag.append((now, now - start - SAMPLE_INTERVAL))
+
+    def lag_stats(self, seconds):
+        cutoff = time.monotonic() - seconds
+        values = sorted(lag for when, lag in self.lag if when >= cutoff)
+        if not values:
+            return None
+        return values[len(values) // 2], values[min(len(values) - 1, int(len(values) * 0.99))], values[-1]
+
+    # Slow callback detection, everything below up to the commands runs in the watchdog thread
+
+    def start_watchdog(self):
+        self.stop_watchdog()
+        self.commands_by_code = {command.callback.__code__: command.qualified_name for command in self.bot.walk_commands()}
+        self.watchdog_stop = threading.Event()
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = self.bot.loop.create_task(self.heartbeat())
+        self.watchdog = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.watchdog.start()
+
+    def stop_watchdog(self):
+        if self.watchdog is not None:
+            self.watchdog_stop.set()
+            self.watchdog = None
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    async def heartbeat(self):
+        # Runs on the loop. The lag sampler only ticks every SAMPLE_INTERVAL, which would add up to that much to the
+        # threshold, so the watchdog goes by this instead. Ticking every quarter threshold, any callback holding
+        # the loop for the threshold is caught
+        while True:
+            interval = self.threshold / 4
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            now = self.last_beat = time.monotonic()
+            if self.pending is not None:
+                self.pending.duration = now - start - interval
+                self.pending = None
+
+    def watch(self):
+        stop = self.watchdog_stop
+        captured_beat = None
+        while not stop.wait(self.threshold / 4):
+            beat = self.last_beat
+            if time.monotonic() - beat > self.threshold and beat != captured_beat:
+                captured_beat = beat
+                self.capture()
+
+    def capture(self):
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+        cog, command = self.attribute(frame)
+        finding = SlowCallback(stack, cog, command)
+        self.pending = finding
+        self.findings.append(finding)
+
+    def attribute(self, frame):
+        """Finds the innermost cog module and command callback on the stack"""
+        modules = {type(cog).__module__: name for name, cog in self.bot.cogs.items()}
+        cog = command = None
+        while frame is not None:
+            if command is None:
+                command = self.commands_by_code.get(frame.f_code)
+            if cog is None:
+                cog = modules.get(frame.f_globals.get('__name__'))
+            if cog is not None and command is not None:
+                break
+            frame = frame.f_back
+        return cog, command
+
+    @commands.group(name='looplag', invoke_without_command=True, hidden=True)
+    async def looplag(self, ctx):
+        """Shows event loop lag and the most recent slow callbacks"""
+        lines = [f'Gateway latency: {self.bot.latency * 1000:.0f}ms']
+        for label, seconds in (('1m', 60), ('10m', 600)):
+            stats = self.lag_stats(seconds)
+            if stats:
+                p50, p99, worst = (value * 1000 for value in stats)
+                lines.append(f'Loop lag {label}: p50 {p50:.1f}ms | p99 {p99:.1f}ms | max {worst:.1f}ms')
+
+        watching = f'on, threshold {self.threshold * 1000:.0f}ms' if self.watchdog else 'off'
+        lines.append(f'\nSlow callback detector: {watching}')
+        for number, finding in enumerate(reversed(self.findings), start=1):
+            if number > 10:
+                break
+            duration = f'{finding.duration * 1000:.0f}ms lag' if finding.duration is not None else 'still blocked'
+            where = finding.stack[-1] if finding.stack else None
+            location = f'{where.filename.rsplit("/", 1)[-1]}:{where.lineno} in {where.name}' if where else 'unknown'
+            lines.append(f'`{number}` {duration} - {finding.cog or "no cog"}/{finding.command or "no command"} - {location} '
+                         f'({time.strftime("%H:%M:%S", time.gmtime(finding.when))} UTC)')
+        await ctx.send('\n'.join(lines))
+
+    @looplag.command(name='watch')
+    async def looplag_watch(self, ctx, threshold_ms: int = None):
+        """Starts capturing the stack of callbacks that hold the loop longer than the threshold"""
+        if threshold_ms is not None:
+            if threshold_ms < 10:
+                return await ctx.send('The threshold has to be at least 10ms')
+            self.threshold = threshold_ms / 1000
+        self.start_watchdog()
+        await ctx.send(f'Capturing callbacks that block the loop for over {self.threshold * 1000:.0f}ms')
+
+    @looplag.command(name='unwatch')
+    async def looplag_unwatch(self, ctx):
+        self.stop_watchdog()
+        await ctx.send('Stopped the slow callback detector')
+
+    @looplag.command(name='stack')
+    async def looplag_stack(self, ctx, number: int = 1):
+        """Shows the full stack of a slow callback, 1 is the most recent"""
+        if not 0 < number <= len(self.findings):
+            return await ctx.send('No slow callback with that number')
+        finding = self.findings[-number]
+        paginator = commands.Paginator(prefix='```py', suffix='```')
+        for line in ''.join(traceback.format_list(finding.stack)).splitlines():
+            paginator.add_line(line)
+        for page in paginator.pages:
+            await ctx.send(page)
+
+
+def setup(bot):
+    bot.add_cog(LoopMonitor(bot))
@@ -0,0 +1,170 @@
+from discord.ext import commands
+import sys
+import time
+
+from Instrumentation import observe_pool, unobserve_pool, current_invocation
+
+# The same statement this many times in one command or listener invocation is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = 10
+# Statements we keep stats for, anything past this is counted under "other"
+MAX_STATEMENTS = 500
+# Modules that wrap bot.pool, skipped when looking for where a query came from
+WRAPPER_MODULES = {__name__, 'Instrumentation'}
+
+
+class StatementStats:
+    __slots__ = ('calls', 'time', 'max', 'rows')
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0
+        self.max = 0
+        self.rows = 0
+
+
+class NPlusOne:
+    __slots__ = ('statement', 'origin', 'occurrences', 'worst')
+
+    def __init__(self, statement, origin):
+        self.statement = statement
+        self.origin = origin
+        self.occurrences = 0  # how many invocations went over the threshold
+        self.worst = 0  # most times the statement ran in one of those invocations
+
+
+def normalise(query):
+    return ' '.join(query.split())
+
+
+def affected_rows(status):
+    """Row count from a command status like 'UPDATE 3' or 'INSERT 0 1'"""
+    try:
+        return int(status.rsplit(' ', 1)[-1])
+    except (AttributeError, ValueError):
+        return 0
+
+
+class QueryProfiler(commands.Cog, name='Queries'):
+    """Profiles every statement that goes through bot.pool.
+
+    Cogs can name their statements by defining a module level `STATEMENTS = {name: query}`,
+    those show up by name here. asyncpg already prepares each statement once per connection
+    and reuses it, so keeping the text of a statement identical (one constant) is what keeps it prepared.
+
+    N+1 detection counts statements per command or listener invocation, which the Instrumentation cog tracks,
+    so it only works while that cog is loaded. Background loops are never counted"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.stats = {}  # normalised query: StatementStats
+        self.names = {}  # normalised query: statement name
+        self.n_plus_one = {}  # (normalised query, origin): NPlusOne
+        self.started = time.monotonic()
+        observe_pool(bot, self.record)
+
+    def cog_unload(self):
+        unobserve_pool(self.bot, self.record)
+
+    async def cog_check(self, ctx):
+        if not await ctx.bot.is_owner(ctx.author):
+            raise commands.NotOwner('Only my owner can use this command.')
+        return True
+
+    def refresh_names(self):
+        for cog in self.bot.cogs.values():
+            module = sys.modules.get(type(cog).__module__)
+            for name, query in getattr(module, 'STATEMENTS', {}).items():
+                self.names[normalise(query)] = name
+
+    def name_of(self, query):
+        return self.names.get(query) or query
+
+    def record(self, method, query, args, result, elapsed):
+        query = normalise(query)
+        stats = self.stats.get(query)
+        if stats is None:
+            if len(self.stats) >= MAX_STATEMENTS:
+                query = 'other'
+            stats = self.stats.setdefault(query, StatementStats())
+        stats.calls += 1
+        stats.time += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        if method == 'executemany':
+            stats.rows += len(args[0]) if args else 0
+        elif result is None:
+            pass
+        elif method == 'fetch':
+            stats.rows += len(result)
+        elif method == 'execute':
+            stats.rows += affected_rows(result)
+        else:
+            stats.rows += 1
+
+        invocation = current_invocation.get()
+        if invocation is None:
+            return
+        counts = invocation.setdefault('queries', {})  # normalised query: [count, NPlusOne or None]
+        entry = counts.get(query)
+        if entry is None:
+            entry = counts[query] = [0, None]
+        entry[0] += 1
+        if entry[0] == N_PLUS_ONE_THRESHOLD:
+            origin = self.caller()
+            flag = self.n_plus_one.get((query, origin))
+            if flag is None:
+                flag = self.n_plus_one[(query, origin)] = NPlusOne(query, origin)
+            flag.occurrences += 1
+            entry[1] = flag
+        if entry[1] is not None and entry[0] > entry[1].worst:
+            entry[1].worst = entry[0]
+
+    @staticmethod
+    def caller():
+        """First frame outside of the pool wrappers, which is the code making the query"""
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_globals.get('__name__') in WRAPPER_MODULES:
+            frame = frame.f_back
+        if frame is None:
+            return 'unknown'
+        return f'{frame.f_globals.get("__name__")}.{frame.f_code.co_name}:{frame.f_lineno}'
+
+    @commands.group(name='queries', invoke_without_command=True, hidden=True)
+    async def queries(self, ctx, top: int = 15):
+        """Shows the statements that took the most total time"""
+        if not self.stats:
+            return await ctx.send('No queries recorded yet')
+        self.refresh_names()
+        paginator = commands.Paginator(prefix='```', suffix='```')
+        paginator.add_line(f'{"Statement":<50}{"Calls":>8}{"Avg ms":>8}{"Max ms":>8}{"Total s":>9}{"Rows/c":>8}')
+        for query, stats in sorted(self.stats.items(), key=lambda item: item[1].time, reverse=True)[:top]:
+            paginator.add_line(f'{self.name_of(query)[:49]:<50}{stats.calls:>8}{stats.time / stats.calls * 1000:>8.2f}'
+                               f'{stats.max * 1000:>8.1f}{stats.time:>9.2f}{stats.rows / stats.calls:>8.1f}')
+        paginator.add_line(f'\n{sum(s.calls for s in self.stats.values())} queries over {(time.monotonic() - self.started) / 60:.0f} minutes, '
+                           f'{len(self.n_plus_one)} possible N+1 patterns (see {ctx.prefix}queries n+1)')
+        for page in paginator.pages:
+            await ctx.send(page)
+
+    @queries.command(name='n+1', aliases=['nplusone'])
+    async def queries_n_plus_one(self, ctx):
+        """Statements that ran over and over within a single command or event, usually a query in a loop"""
+        if not self.n_plus_one:
+            return await ctx.send('No N+1 patterns found')
+        self.refresh_names()
+        paginator = commands.Paginator(prefix='```', suffix='```')
+        for flag in sorted(self.n_plus_one.values(), key=lambda f: f.worst, reverse=True):
+            paginator.add_line(f'{flag.origin}: up to {flag.worst}x in one invocation ({flag.occurrences} times)')
+            paginator.add_line(f'    {self.name_of(flag.statement)[:150]}')
+        for page in paginator.pages:
+            await ctx.send(page)
+
+    @queries.command(name='reset')
+    async def queries_reset(self, ctx):
+        self.stats.clear()
+        self.n_plus_one.clear()
+        self.started = time.monotonic()
+        await ctx.send('Cleared all query stats')
+
+
+def setup(bot):
+    bot.add_cog(QueryProfiler(bot))
@@ -1,27 +1,180 @@
 import discord
-from discord.ext import commands
-import praw
+from discord.ext import commands, tasks
+import time
+import asyncio
+import aiohttp
+from collections import OrderedDict
 
-reddit = praw.Reddit(client_id='id',
-                     client_secret='secret',
-                     user_agent='windows 10: Meme Scraper (by /u/PotatoLord1207)')
+REDDIT_URL = 'https://www.reddit.com'
+USER_AGENT = 'windows 10: Meme Scraper (by /u/PotatoLord1207)'
+REDDIT_TIMEOUT = aiohttp.ClientTimeout(total=15)
+# Posts fetched per refill, and how old (seconds) a pool gets before it is fetched again from the top
+REFILL_SIZE = 100
+POOL_TTL = 300
+# Most vetted posts kept per subreddit, and how many unseen posts a channel can have left before a refill
+MAX_POOL = 300
+LOW_WATER = 6
+# Post ids remembered per channel so links are not repeated, and how many channels are tracked
+SERVED_HISTORY = 300
+MAX_TRACKED_CHANNELS = 1000
+# Subreddits requested at least this often (decaying every refill run) are kept warm in the background
+POPULAR_HITS = 3
+# Pools nobody asked for in this long are dropped
+POOL_EXPIRY = 3600
+
+
+class SubredditNotFound(Exception):
+    pass
+
+
+class RedditClient:
+    """Minimal async client for reddit's public json listings.
+    `base_url` can be pointed somewhere else, like a local stub server"""
+
+    def __init__(self, session, *, base_url=REDDIT_URL):
+        self.session = session
+        self.base_url = base_url
+
+    async def hot(self, subreddit, limit=REFILL_SIZE, after=None):
+        """Returns a page of hot posts and the cursor for the next page"""
+        url = f'{self.base_url}/r/{subreddit}/hot.json'
+        params = {'limit': limit, 'raw_json': 1}
+        if after:
+            params['after'] = after
+        # Reddit redirects to a search page for subreddits that don't exist
+        async with self.session.get(url, params=params, headers={'User-Agent': USER_AGENT},
+                                    timeout=REDDIT_TIMEOUT, allow_redirects=False) as resp:
+            if resp.status in (302, 403, 404):
+                raise SubredditNotFound(subreddit)
+            resp.raise_for_status()
+            js = await resp.json()
+        return [child['data'] for child in js['data']['children']], js['data']['after']
+
+
+class PostPool:
+    """Vetted posts of a subreddit, hottest first"""
+    __slots__ = ('posts', 'after', 'fetched_at', 'last_used', 'hits')
+
+    def __init__(self):
+        self.posts = OrderedDict()  # post id: url
+        self.after = None
+        self.fetched_at = time.monotonic()
+        self.last_used = self.fetched_at
+        self.hits = 0
+
+    def add(self, posts, after):
+        for post in posts:
+            if not post['over_18'] and not post['stickied']:
+                self.posts.setdefault(post['id'], post['url'])
+        while len(self.posts) > MAX_POOL:
+            self.posts.popitem(last=False)
+        self.after = after
+
+    @property
+    def stale(self):
+        return time.monotonic() - self.fetched_at > POOL_TTL
 
 
 class RedditIntegration(commands.Cog, name='Reddit'):
     def __init__(self, bot):
         self.bot = bot
+        self.reddit = RedditClient(bot.session)
+        self.pools = {}  # subreddit: PostPool
+        self.refilling = {}  # subreddit: task
+        self.served = OrderedDict()  # channel id: OrderedDict of post ids already sent there
+        self.refill_pools.start()
+
+    def cog_unload(self):
+        self.refill_pools.cancel()
+        for task in self.refilling.values():
+            task.cancel()
+
+    async def _refill(self, subreddit):
+        try:
+            old = self.pools.get(subreddit)
+            if old is not None and not old.stale and old.after:
+                # Still fresh, keep going down the listing
+                posts, after = await self.reddit.hot(subreddit, after=old.after)
+                old.add(posts, after)
+                return old
+
+            posts, after = await self.reddit.hot(subreddit)
+            pool = PostPool()
+            if old is not None:
+                pool.last_used, pool.hits = old.last_used, old.hits
+            pool.add(posts, after)
+            self.pools[subreddit] = pool
+            return pool
+        finally:
+            del self.refilling[subreddit]
+
+    def refill(self, subreddit):
+        """Starts refilling the pool, or returns the refill that is already running for it"""
+        task = self.refilling.get(subreddit)
+        if task is None:
+            task = self.refilling[subreddit] = self.bot.loop.create_task(self._refill(subreddit))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    def served_in(self, channel_id):
+        served = self.served.get(channel_id)
+        if served is None:
+            served = self.served[channel_id] = OrderedDict()
+            if len(self.served) > MAX_TRACKED_CHANNELS:
+                self.served.popitem(last=False)
+        else:
+            self.served.move_to_end(channel_id)
+        return served
+
+    async def get_posts(self, subreddit, channel_id, amount=3):
+        """Returns up to `amount` post urls that haven't been sent in the channel yet.
+        Only waits on reddit the first time a subreddit is asked for, the pool is refilled in the background"""
+        subreddit = subreddit.lower()
+        pool = self.pools.get(subreddit)
+        if pool is None:
+            pool = await asyncio.shield(self.refill(subreddit))
+        pool.last_used = time.monotonic()
+        pool.hits += 1
+
+        served = self.served_in(channel_id)
+        unseen = [(post_id, url) for post_id, url in pool.posts.items() if post_id not in served]
+        picked = unseen[:amount]
+        for post_id, _ in picked:
+            served[post_id] = None
+        while len(served) > SERVED_HISTORY:
+            served.popitem(last=False)
+
+        if pool.stale or len(unseen) - len(picked) < LOW_WATER:
+            self.refill(subreddit)
+        return [url for _, url in picked]
+
+    @tasks.loop(minutes=2)
+    async def refill_pools(self):
+        now = time.monotonic()
+        for subreddit, pool in list(self.pools.items()):
+            if now - pool.last_used > POOL_EXPIRY:
+                del self.pools[subreddit]
+                continue
+            if pool.hits >= POPULAR_HITS and pool.stale:
+                self.refill(subreddit)
+            pool.hits //= 2
 
     @commands.command(name='redditmeme')
     async def meme(self, ctx,subreddit_raw: str = None):
         if subreddit_raw:
+            try:
+                urls = await self.get_posts(subreddit_raw, ctx.channel.id)
+            except SubredditNotFound:
+                return await ctx.send('Unable to find that subreddit')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return await ctx.send('Unable to reach reddit right now, please try again later')
+
             embed = discord.Embed(title="some title if you want", description=f'some description if you want',
                               colour=discord.Colour(0x0AFA02))
-            embed_list = '' 
-            for submission in reddit.subreddit(subreddit_raw).hot(limit=3):
-                if not submission.over_18 and not submission.stickied: #put them together
-                    embed_list += f'{submission.url} \n\n' #new line at end of string
-            print(embed_list)
-            embed.add_field(name='urls', value=embed_list)
+            embed_list = ''
+            for url in urls:
+                embed_list += f'{url} \n\n' #new line at end of string
+            embed.add_field(name='urls', value=embed_list or 'No new posts found, try again later')
             await ctx.send(embed=embed)
 
         else:
@@ -6,6 +6,26 @@ from utils.converters import Member, CaseInsensitiveMember
 from utils.global_utils import confirm_prompt
 from utils.time import human_timedelta, FutureTime, ShortTime
 
+# Statements used in more than one place, one copy of the text means one prepared statement per connection
+# and the Queries cog reports them under these names
+STATEMENTS = {
+    'mod.config': '''SELECT *
+                     FROM guild_mod_config
+                     WHERE id = $1''',
+    'mod.mute_role': '''SELECT mute_role
+                        FROM guild_mod_config
+                        WHERE id = $1''',
+    'mod.add_muted': '''UPDATE guild_mod_config
+                        SET muted = array_append(muted, $2)
+                        WHERE id = $1;''',
+    'mod.remove_muted': '''UPDATE guild_mod_config
+                           SET muted = array_remove(muted, $2)
+                           WHERE id = $1;''',
+    'mod.clear_mute_role': '''UPDATE guild_mod_config
+                              SET mute_role = NULL
+                              WHERE id = $1''',
+}
+
 #check functions
 
 def can_manage_messages():
@@ -85,10 +105,7 @@ class ServerModeration(commands.Cog, name='Mod'):
         self.bot = bot
 
     async def get_mod_config(self, id):
-        query = '''SELECT *
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        return await self.bot.pool.fetchrow(query, id)
+        return await self.bot.pool.fetchrow(STATEMENTS['mod.config'], id)
 
     @commands.command(name='delmsg', hidden=True)
     @commands.bot_has_permissions(manage_messages=True)
@@ -293,10 +310,7 @@ class ServerModeration(commands.Cog, name='Mod'):
     @commands.guild_only()
     async def create_mute_role(self, ctx):
         """Creates a role name 'Muted' and denies Send Message permission to all text channels"""
-        query = '''SELECT mute_role
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        config = await self.bot.pool.fetchrow(query, ctx.guild.id)
+        config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], ctx.guild.id)
         if config is not None and ctx.guild.get_role(config.get('mute_role')) is not None:
             role = ctx.guild.get_role(config.get('mute_role'))
             return await ctx.send(f'`{role}` is already set as your mute role!\n'
@@ -326,10 +340,7 @@ class ServerModeration(commands.Cog, name='Mod'):
         Denies Send Message permissions to all text channels.
         Useful if permissions failed to set on role creation, when new channels were created or role was manually created
         """
-        query = '''SELECT mute_role
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        config = await self.bot.pool.fetchrow(query, ctx.guild.id)
+        config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], ctx.guild.id)
 
         if config is None or ctx.guild.get_role(config.get('mute_role')) is None:
             return await ctx.send(f'Unable to find mute role, please use {ctx.prefix}createmute to create the role with the appropriate permissions\n'
@@ -348,10 +359,7 @@ class ServerModeration(commands.Cog, name='Mod'):
     @can_mute()
     @commands.guild_only()
     async def mute(self, ctx, member: CaseInsensitiveMember, *, reason=None):
-        query = '''SELECT mute_role
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        config = await self.bot.pool.fetchrow(query, ctx.guild.id)
+        config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], ctx.guild.id)
 
         if config is None or ctx.guild.get_role(config.get('mute_role')) is None:
             return await ctx.send(f'Unable to find mute role!\n'
@@ -375,20 +383,14 @@ class ServerModeration(commands.Cog, name='Mod'):
             await ctx.send('\U0001f44e')
         else:
             await ctx.send('\U0001f44d')
-            add_query = '''UPDATE guild_mod_config
-                           SET muted = array_append(muted, $2)
-                           WHERE id = $1;'''
-            await self.bot.pool.execute(add_query, ctx.guild.id, member.id)
+            await self.bot.pool.execute(STATEMENTS['mod.add_muted'], ctx.guild.id, member.id)
 
     @commands.command()
     @commands.bot_has_permissions(manage_roles=True)
     @can_mute()
     @commands.guild_only()
     async def unmute(self, ctx, member: CaseInsensitiveMember, *, reason=None):
-        query = '''SELECT mute_role
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        config = await self.bot.pool.fetchrow(query, ctx.guild.id)
+        config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], ctx.guild.id)
 
         if config is None or ctx.guild.get_role(config.get('mute_role')) is None:
             return await ctx.send(f'Unable to find mute role!\n'
@@ -417,10 +419,7 @@ class ServerModeration(commands.Cog, name='Mod'):
             await ctx.send('\U0001f44e')
         else:
             await ctx.send('\U0001f44d')
-            remove_query = '''UPDATE guild_mod_config
-                           SET muted = array_remove(muted, $2)
-                           WHERE id = $1;'''
-            await self.bot.pool.execute(remove_query, ctx.guild.id, member.id)
+            await self.bot.pool.execute(STATEMENTS['mod.remove_muted'], ctx.guild.id, member.id)
 
     @commands.command()
     @commands.bot_has_permissions(manage_roles=True)
@@ -435,10 +434,7 @@ class ServerModeration(commands.Cog, name='Mod'):
 
         Note: Times are in UTC.
         """
-        query = '''SELECT mute_role
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        config = await self.bot.pool.fetchrow(query, ctx.guild.id)
+        config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], ctx.guild.id)
 
         if config is None or ctx.guild.get_role(config.get('mute_role')) is None:
             return await ctx.send(f'Unable to find mute role!\n'
@@ -472,10 +468,7 @@ class ServerModeration(commands.Cog, name='Mod'):
 
         The duration must be in a short time form, e.g. 4h
         """
-        query = '''SELECT mute_role
-                   FROM guild_mod_config
-                   WHERE id = $1'''
-        config = await self.bot.pool.fetchrow(query, ctx.guild.id)
+        config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], ctx.guild.id)
 
         if config is None or ctx.guild.get_role(config.get('mute_role')) is None:
             return await ctx.send(f'Unable to find mute role!\n'
@@ -506,10 +499,7 @@ class ServerModeration(commands.Cog, name='Mod'):
             member = guild.get_member(timer['user'])
             if member is None:
                 return
-            query = '''SELECT mute_role
-                       FROM guild_mod_config
-                       WHERE id = $1'''
-            config = await self.bot.pool.fetchrow(query, guild.id)
+            config = await self.bot.pool.fetchrow(STATEMENTS['mod.mute_role'], guild.id)
             if config is None or guild.get_role(config.get('mute_role')) is None:
                 return
             role = guild.get_role(config.get('mute_role'))
@@ -521,10 +511,7 @@ class ServerModeration(commands.Cog, name='Mod'):
         except:
             pass
         finally:
-            remove_query = '''UPDATE guild_mod_config
-                           SET muted = array_remove(muted, $2)
-                           WHERE id = $1;'''
-            await self.bot.pool.execute(remove_query, guild.id, timer['user'])
+            await self.bot.pool.execute(STATEMENTS['mod.remove_muted'], guild.id, timer['user'])
 
     @commands.command(hidden=True)
     @commands.bot_has_guild_permissions(move_members=True)
@@ -691,10 +678,7 @@ class ServerModeration(commands.Cog, name='Mod'):
         if config is None or config.get('mute_role') != role.id:
             return
 
-        query = '''UPDATE guild_mod_config
-                   SET mute_role = NULL
-                   WHERE id = $1'''
-        await self.bot.pool.execute(query, role.guild.id)
+        await self.bot.pool.execute(STATEMENTS['mod.clear_mute_role'], role.guild.id)
 
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
@@ -714,14 +698,10 @@ class ServerModeration(commands.Cog, name='Mod'):
 
         if has:
             # added mute role
-            query = '''UPDATE guild_mod_config
-                       SET muted = array_append(muted, $2)
-                       WHERE id = $1;'''
+            query = STATEMENTS['mod.add_muted']
         else:
             # removed mute role
-            query = '''UPDATE guild_mod_config
-                       SET muted = array_remove(muted, $2)
-                       WHERE id = $1;'''
+            query = STATEMENTS['mod.remove_muted']
         await self.bot.pool.execute(query, before.guild.id, before.id)
 
 
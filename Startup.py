@@ -0,0 +1,158 @@
+"""Startup timings for each extension.
+
+The launcher has to load extensions through load_extensions for import and init times to be recorded,
+with Startup first so PROCESS_START is taken as early as possible:
+
+    from Startup import load_extensions
+    load_extensions(bot, ['Startup', 'ServerModeration', 'broken.tracker', ...])
+
+Extensions loaded with plain bot.load_extension still work, they just don't show up in the report.
+Cogs start their startup database work with startup_task so the report shows how long that took too,
+and seed data they used to hard-code with migrate_once"""
+from discord.ext import commands
+import time
+import asyncio
+import importlib
+import traceback
+
+# Load this extension first so this is as close to process start as possible
+PROCESS_START = time.monotonic()
+
+
+class ExtensionTiming:
+    __slots__ = ('import_time', 'init_time', 'loaded_at', 'ready_at', 'first_use')
+
+    def __init__(self, import_time, init_time):
+        self.import_time = import_time
+        self.init_time = init_time
+        self.loaded_at = time.monotonic() - PROCESS_START
+        self.ready_at = None  # seconds after process start that the bot was ready with this loaded
+        self.first_use = None  # how long the first command of this extension took, including lazy imports
+
+
+def startup_task(bot, coro):
+    """Runs a cog's startup work (loading caches, backfilling tables) as a task and records how long it took
+    under the cog's extension. Use it instead of bot.loop.create_task in a cog's __init__"""
+    extension = coro.cr_frame.f_globals['__name__']
+    work = getattr(bot, 'startup_work', None)
+    if work is None:
+        work = bot.startup_work = {}  # extension name: seconds spent in startup tasks, not counting waiting for ready
+
+    async def timed():
+        # Waiting for the gateway isn't this cog's doing
+        try:
+            await bot.wait_until_ready()
+        except asyncio.CancelledError:
+            coro.close()
+            raise
+        start = time.perf_counter()
+        try:
+            await coro
+        finally:
+            work[extension] = work.get(extension, 0) + time.perf_counter() - start
+    return bot.loop.create_task(timed())
+
+
+async def migrate_once(bot, name, query, *args):
+    """Runs `query` the first time it's called with this name on this database, and never again after that,
+    so data seeded this way can be removed for good. Applied names are kept in applied_migrations (name, applied_at)"""
+    mark = '''INSERT INTO applied_migrations (name, applied_at)
+              VALUES ($1, now() at time zone 'utc')
+              ON CONFLICT (name) DO NOTHING
+              RETURNING name;'''
+    async with bot.pool.acquire() as con:
+        async with con.transaction():
+            if await con.fetchval(mark, name) is not None:
+                await con.execute(query, *args)
+
+
+def load_extensions(bot, extensions):
+    """Loads the extensions, timing the import and the setup (cog __init__) of each separately.
+    Meant to replace the launcher's bot.load_extension loop"""
+    if not hasattr(bot, 'startup_timings'):
+        bot.startup_timings = {}  # extension name: ExtensionTiming
+    for extension in extensions:
+        start = time.perf_counter()
+        try:
+            # load_extension reuses the module from sys.modules, so what it takes after this is setup()
+            importlib.import_module(extension)
+            imported = time.perf_counter()
+            bot.load_extension(extension)
+        except Exception:
+            traceback.print_exc()
+            continue
+        timing = bot.startup_timings[extension] = ExtensionTiming(imported - start, time.perf_counter() - imported)
+        if bot.is_ready():
+            timing.ready_at = timing.loaded_at
+
+
+class Startup(commands.Cog, name='Startup'):
+    def __init__(self, bot):
+        self.bot = bot
+        if not hasattr(bot, 'startup_timings'):
+            bot.startup_timings = {}
+        if bot.is_ready():
+            self.mark_ready()
+
+    def mark_ready(self):
+        now = time.monotonic() - PROCESS_START
+        for timing in self.bot.startup_timings.values():
+            if timing.ready_at is None:
+                timing.ready_at = now
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.mark_ready()
+
+    def timing_for(self, ctx):
+        if ctx.cog is None:
+            return None
+        timing = self.bot.startup_timings.get(type(ctx.cog).__module__)
+        if timing is None or timing.first_use is not None:
+            return None
+        return timing
+
+    @commands.Cog.listener()
+    async def on_command(self, ctx):
+        if self.timing_for(ctx) is not None:
+            ctx.startup_started = time.perf_counter()
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        timing = self.timing_for(ctx)
+        if timing is not None and hasattr(ctx, 'startup_started'):
+            timing.first_use = time.perf_counter() - ctx.startup_started
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        await self.on_command_completion(ctx)
+
+    @commands.command(name='startup', hidden=True)
+    @commands.is_owner()
+    async def startup_report(self, ctx):
+        """Shows how long each extension took to import, set up, get ready, do its startup work and run its first command"""
+        if not self.bot.startup_timings:
+            return await ctx.send('No startup timings, extensions were not loaded through load_extensions')
+
+        def ms(seconds):
+            return '-' if seconds is None else f'{seconds * 1000:.0f}ms'
+
+        def s(seconds):
+            return '-' if seconds is None else f'{seconds:.1f}s'
+
+        paginator = commands.Paginator(prefix='```', suffix='```')
+        work = getattr(self.bot, 'startup_work', {})
+        paginator.add_line(f'{"Extension":<28}{"Import":>9}{"Init":>9}{"Loaded":>9}{"Ready":>9}{"Work":>9}{"1st use":>9}')
+        timings = sorted(self.bot.startup_timings.items(), key=lambda item: item[1].import_time + item[1].init_time, reverse=True)
+        for extension, timing in timings:
+            paginator.add_line(f'{extension:<28}{ms(timing.import_time):>9}{ms(timing.init_time):>9}'
+                               f'{s(timing.loaded_at):>9}{s(timing.ready_at):>9}{ms(work.get(extension)):>9}'
+                               f'{ms(timing.first_use):>9}')
+        total = sum(timing.import_time + timing.init_time for timing in self.bot.startup_timings.values())
+        paginator.add_line(f'\nTotal import + init: {total * 1000:.0f}ms')
+        for page in paginator.pages:
+            await ctx.send(page)
+
+
+def setup(bot):
+    bot.add_cog(Startup(bot))
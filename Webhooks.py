@@ -0,0 +1,99 @@
+import discord
+from discord.ext import commands
+
+import asyncio
+
+# Name of the webhook the bot creates in each channel, reused for every message sent through it
+WEBHOOK_NAME = 'botcogs'
+
+
+def rewind(file):
+    """A copy of a sent discord.File that can be sent again, sending reads it to the end and undoes its close stub"""
+    file.reset()
+    return discord.File(file.fp, filename=file.filename, spoiler=file.spoiler)
+
+
+async def send_as(bot, channel, content, member):
+    """Sends `content` in the channel with the member's name and avatar.
+    Goes through the Webhooks cog when it's loaded, otherwise makes a webhook just for this message"""
+    avatar_url = member.avatar_url_as(format='png')
+    webhooks = bot.get_cog('Webhooks')
+    if webhooks is not None:
+        return await webhooks.send(channel, content, username=member.display_name, avatar_url=avatar_url)
+    webhook = await channel.create_webhook(name=member.display_name)
+    try:
+        await webhook.send(content, avatar_url=avatar_url)
+    finally:
+        await webhook.delete()
+
+
+class Webhooks(commands.Cog, name='Webhooks'):
+    """One bot owned webhook per channel, created the first time it's needed and reused after that.
+    The name and avatar are set per message, so quoting someone is a single API call"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.webhooks = {}  # channel id: discord.Webhook
+        self.fetching = {}  # channel id: task, so concurrent sends to a new channel only create one webhook
+
+    async def get_webhook(self, channel):
+        webhook = self.webhooks.get(channel.id)
+        if webhook is not None:
+            return webhook
+        task = self.fetching.get(channel.id)
+        if task is None:
+            task = self.fetching[channel.id] = self.bot.loop.create_task(self.find_or_create(channel))
+            task.add_done_callback(lambda _: self.fetching.pop(channel.id, None))
+        # Shielded so one caller being cancelled doesn't cancel the lookup for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def find_or_create(self, channel):
+        for webhook in await channel.webhooks():
+            if webhook.name == WEBHOOK_NAME and webhook.token is not None and webhook.user == self.bot.user:
+                break
+        else:
+            webhook = await channel.create_webhook(name=WEBHOOK_NAME, reason='Used to send quotes and logs')
+        self.webhooks[channel.id] = webhook
+        return webhook
+
+    async def send(self, channel, content=None, *, username, avatar_url=None, **kwargs):
+        """Sends as `username` through the channel's webhook. Takes the same arguments as discord.Webhook.send,
+        files have to be made from file objects rather than paths so they can be sent again if the webhook was deleted"""
+        webhook = await self.get_webhook(channel)
+        try:
+            return await webhook.send(content, username=username, avatar_url=avatar_url, **kwargs)
+        except discord.NotFound:
+            # Someone deleted it, make a new one. The first try read the files to the end, so they're rewound
+            self.webhooks.pop(channel.id, None)
+            webhook = await self.get_webhook(channel)
+            if kwargs.get('file') is not None:
+                kwargs['file'] = rewind(kwargs['file'])
+            if kwargs.get('files') is not None:
+                kwargs['files'] = [rewind(file) for file in kwargs['files']]
+            return await webhook.send(content, username=username, avatar_url=avatar_url, **kwargs)
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel):
+        # Fires for any webhook change in the channel, including the bot creating its own, so only forget ours if it's gone
+        webhook = self.webhooks.get(channel.id)
+        if webhook is None or channel.id in self.fetching:
+            return
+        try:
+            current = await channel.webhooks()
+        except discord.HTTPException:
+            current = []
+        if all(w.id != webhook.id for w in current) and self.webhooks.get(channel.id) is webhook:
+            del self.webhooks[channel.id]
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.webhooks.pop(channel.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        for channel in guild.text_channels:
+            self.webhooks.pop(channel.id, None)
+
+
+def setup(bot):
+    bot.add_cog(Webhooks(bot))
@@ -0,0 +1,81 @@
+"""Compares EmojiCog's emoji index against the scans over every guild's emojis it replaced,
+for emoji find, nitro and allemojis, and times keeping it up to date on an emoji update.
+
+    python -m benchmarks.emoji_index --guilds 2000 --emojis 50
+"""
+import argparse
+import random
+import string
+import timeit
+from types import SimpleNamespace
+
+from broken.emoji import EmojiIndex
+
+
+def make_guilds(count, per_guild, seed=0):
+    rng = random.Random(seed)
+    guilds = []
+    emoji_id = 0
+    for guild_id in range(count):
+        emojis = []
+        for _ in range(per_guild):
+            emoji_id += 1
+            name = ''.join(rng.choices(string.ascii_letters, k=rng.randint(4, 16)))
+            emojis.append(SimpleNamespace(id=emoji_id, name=name, guild_id=guild_id, require_colons=True,
+                                          animated=rng.random() < 0.2))
+        guilds.append(SimpleNamespace(id=guild_id, name=f'Guild {guild_id}', emojis=emojis))
+    return guilds
+
+
+def scan_find(guilds, name):
+    name = name.lower()
+    return [emoji for guild in guilds for emoji in guild.emojis if name in emoji.name.lower() and emoji.require_colons]
+
+
+def scan_exact(guilds, name):
+    name = name.lower()
+    return [emoji for guild in guilds for emoji in guild.emojis if emoji.name.lower() == name and emoji.require_colons]
+
+
+def scan_all(guilds, _):
+    """What allemojis did, sorting every guild and its emojis on each call"""
+    return [sorted([emoji for emoji in guild.emojis if emoji.require_colons], key=lambda e: e.name)
+            for guild in sorted(guilds, key=lambda g: g.name)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emoji index vs scanning every guild')
+    parser.add_argument('--guilds', type=int, default=2000)
+    parser.add_argument('--emojis', type=int, default=50, help='emojis per guild')
+    parser.add_argument('--number', type=int, default=20, help='lookups per measurement')
+    args = parser.parse_args()
+
+    guilds = make_guilds(args.guilds, args.emojis)
+    index = EmojiIndex()
+    build = timeit.timeit(lambda: index.rebuild(guilds), number=1)
+    print(f'{len(index)} emojis in {args.guilds} guilds, index built in {build * 1000:.1f}ms')
+
+    sample = guilds[len(guilds) // 2].emojis[0].name
+    by_name = sorted(guilds, key=lambda g: g.name)
+    queries = {'find (substring)': (scan_find, index.search, sample[1:4]),
+               'nitro (exact)': (scan_exact, index.exact, sample),
+               'allemojis': (scan_all, lambda _: [index.guild(guild.id) for guild in by_name], None)}
+    for label, (scan, indexed, query) in queries.items():
+        if label == 'allemojis':
+            assert [[e.id for e in emojis] for emojis in scan(guilds, query)] == \
+                   [[e.id for e in emojis] for emojis in indexed(query)]
+        else:
+            assert sorted(e.id for e in scan(guilds, query)) == sorted(e.id for e in indexed(query))
+        scan_time = timeit.timeit(lambda: scan(guilds, query), number=args.number) / args.number
+        index_time = timeit.timeit(lambda: indexed(query), number=args.number) / args.number
+        print(f'{label:<18} scan {scan_time * 1000:>9.3f}ms  index {index_time * 1000:>9.3f}ms  '
+              f'({scan_time / index_time:.0f}x)')
+
+    # What on_guild_emojis_update costs, reindexing one guild
+    guild = guilds[len(guilds) // 2]
+    update = timeit.timeit(lambda: index.add_guild(guild), number=args.number) / args.number
+    print(f'{"emoji update":<18} reindexing one guild {update * 1000:.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
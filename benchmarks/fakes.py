@@ -0,0 +1,412 @@
+"""Stand-ins for the gateway, Discord's REST API, bot.session and bot.pool so cogs can be run offline.
+
+Events are fed through discord.py's own gateway parsers, so listeners get real Guild/Member/Message objects.
+Everything a listener does against the pool, the REST API or bot.session is counted against that listener"""
+import asyncio
+import contextvars
+import itertools
+import random
+import re
+import time
+from datetime import datetime
+
+import aiohttp
+import discord
+from aiohttp import web
+from discord.ext import commands
+
+# The listener stats of whatever listener task is currently running
+current_listener = contextvars.ContextVar('current_listener', default=None)
+
+EPOCH = datetime(2020, 1, 1).isoformat()
+_snowflakes = itertools.count(700000000000000000)
+
+
+def snowflake():
+    return next(_snowflakes)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class ListenerStats:
+    __slots__ = ('name', 'event', 'timings', 'errors', 'db_calls', 'db_time', 'rest_calls', 'http_calls')
+
+    def __init__(self, name, event):
+        self.name = name
+        self.event = event
+        self.timings = []
+        self.errors = 0
+        self.db_calls = 0
+        self.db_time = 0
+        self.rest_calls = 0
+        self.http_calls = 0
+
+
+class Stats:
+    def __init__(self):
+        self.listeners = {}  # (listener name, event): ListenerStats
+        self.queries = {}  # normalised query: [count, total seconds]
+        self.routes = {}  # (method, path): count
+        self.events = 0
+
+    def listener(self, name, event):
+        stats = self.listeners.get((name, event))
+        if stats is None:
+            stats = self.listeners[(name, event)] = ListenerStats(name, event)
+        return stats
+
+    def clear(self):
+        self.__init__()
+
+
+class FakeRecord:
+    """Behaves like an asyncpg Record: indexable by name or position, iterating gives the values"""
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = dict(data)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self._data.values())[key]
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data.values())
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return self._data.values()
+
+    def items(self):
+        return self._data.items()
+
+    def __repr__(self):
+        return f'<FakeRecord {self._data!r}>'
+
+
+class FakePool:
+    """In-process stand-in for an asyncpg pool.
+    Every query waits `latency` seconds and is recorded. Results come from handlers added with `respond`,
+    anything without a handler gets an empty result"""
+
+    def __init__(self, stats, latency=0.0):
+        self.stats = stats
+        self.latency = latency
+        self.handlers = []  # (compiled pattern, result or callable(query, *args))
+
+    def respond(self, pattern, result):
+        self.handlers.append((re.compile(pattern, re.I | re.S), result))
+
+    def _result(self, query, args, default):
+        for pattern, result in self.handlers:
+            if pattern.search(query):
+                return result(query, *args) if callable(result) else result
+        return default
+
+    async def _run(self, query, args, default):
+        start = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+        result = self._result(query, args, default)
+        elapsed = time.perf_counter() - start
+
+        key = ' '.join(query.split())
+        entry = self.stats.queries.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        listener = current_listener.get()
+        if listener is not None:
+            listener.db_calls += 1
+            listener.db_time += elapsed
+        return result
+
+    async def fetch(self, query, *args, timeout=None):
+        rows = await self._run(query, args, [])
+        return [row if isinstance(row, FakeRecord) else FakeRecord(row) for row in rows]
+
+    async def fetchrow(self, query, *args, timeout=None):
+        row = await self._run(query, args, None)
+        if isinstance(row, list):
+            row = row[0] if row else None
+        return row if row is None or isinstance(row, FakeRecord) else FakeRecord(row)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        row = await self.fetchrow(query, *args)
+        return None if row is None else row[column]
+
+    async def execute(self, query, *args, timeout=None):
+        return await self._run(query, args, 'EXECUTE 1')
+
+    async def executemany(self, query, args, *, timeout=None):
+        # One round trip, like asyncpg
+        await self._run(query, (), None)
+
+    def acquire(self):
+        return _FakeConnection(self)
+
+    async def close(self):
+        pass
+
+
+class _FakeConnection:
+    """What `async with pool.acquire() as con` gives, queries go straight to the pool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def __getattr__(self, item):
+        return getattr(self.pool, item)
+
+    def transaction(self):
+        return self
+
+
+class FakeSession:
+    """Stand-in for bot.session. Counts requests and fails them as if offline"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def request(self, method, url, **kwargs):
+        listener = current_listener.get()
+        if listener is not None:
+            listener.http_calls += 1
+        return _OfflineResponse()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def close(self):
+        pass
+
+
+class _OfflineResponse:
+    async def __aenter__(self):
+        raise aiohttp.ClientConnectionError('benchmarks run offline')
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class StubServer:
+    """Serves an aiohttp.web app on a free local port, for code that talks to an outside HTTP API.
+    `url` is set once it is started: `async with StubServer(app) as server`"""
+
+    def __init__(self, app):
+        self.runner = web.AppRunner(app)
+        self.url = None
+
+    async def __aenter__(self):
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+class LagProbe:
+    """Sleeps `interval` at a time and records how much later than that the loop woke it up"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def stop(self):
+        self.task.cancel()
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - start - self.interval)
+
+
+class World:
+    """Synthetic guilds, channels, members and roles as gateway payloads"""
+
+    def __init__(self, guilds=10, members=100, channels=5, roles=5, seed=0):
+        self.random = random.Random(seed)
+        self.bot_user = self.user_payload(snowflake(), 'Benchmark', bot=True)
+        self.guilds = []
+        for i in range(guilds):
+            guild_id = snowflake()
+            guild = {
+                'id': str(guild_id),
+                'name': f'Guild {i}',
+                'owner_id': None,
+                'region': 'us-east',
+                'features': [],
+                'emojis': [],
+                'large': members > 250,
+                'member_count': members + 1,
+                'roles': [self.role_payload(guild_id, '@everyone', 0, permissions=8)],
+                'channels': [],
+                'members': [self.member_payload(guild_id, self.bot_user)],
+                'voice_states': [],
+                'presences': [],
+            }
+            for position in range(1, roles + 1):
+                guild['roles'].append(self.role_payload(snowflake(), f'role {position}', position))
+            for position in range(channels):
+                guild['channels'].append({'id': str(snowflake()), 'type': 0, 'name': f'channel-{position}',
+                                          'position': position, 'permission_overwrites': [], 'nsfw': False})
+            for n in range(members):
+                user = self.user_payload(snowflake(), f'user{i}-{n}')
+                guild['members'].append(self.member_payload(guild_id, user))
+            guild['owner_id'] = guild['members'][1]['user']['id'] if members else self.bot_user['id']
+            self.guilds.append(guild)
+
+    @staticmethod
+    def user_payload(user_id, name, bot=False):
+        return {'id': str(user_id), 'username': name, 'discriminator': '0001', 'avatar': None, 'bot': bot}
+
+    @staticmethod
+    def role_payload(role_id, name, position, permissions=0):
+        return {'id': str(role_id), 'name': name, 'position': position, 'permissions': str(permissions),
+                'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}
+
+    @staticmethod
+    def member_payload(guild_id, user, roles=(), nick=None):
+        return {'guild_id': str(guild_id), 'user': user, 'roles': list(roles), 'nick': nick,
+                'joined_at': EPOCH, 'deaf': False, 'mute': False}
+
+    def random_guild(self):
+        return self.random.choice(self.guilds)
+
+    def random_member(self, guild):
+        # Skip the bot, it is always the first member
+        return self.random.choice(guild['members'][1:])
+
+    def message_payload(self, guild, channel, member, content):
+        return {'id': str(snowflake()), 'channel_id': channel['id'], 'guild_id': guild['id'], 'type': 0,
+                'author': member['user'], 'member': {k: v for k, v in member.items() if k != 'user'},
+                'content': content, 'timestamp': datetime.utcnow().isoformat(), 'edited_timestamp': None,
+                'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+                'attachments': [], 'embeds': [], 'pinned': False}
+
+
+class FakeBot(commands.Bot):
+    """A commands.Bot that never connects. Guilds come from a World, events are fed in with `feed`,
+    REST calls are answered locally and every listener run is timed"""
+
+    def __init__(self, world, *, db_latency=0.0, rest_latency=0.0, **kwargs):
+        kwargs.setdefault('command_prefix', '%')
+        if hasattr(discord, 'Intents'):
+            kwargs.setdefault('intents', discord.Intents.all())
+        super().__init__(**kwargs)
+        self.stats = Stats()
+        self.world = world
+        self.rest_latency = rest_latency
+        self.pool = FakePool(self.stats, db_latency)
+        self.session = FakeSession(self.stats)
+        self.starttime = datetime.utcnow()
+        self.running = set()
+        self.http.request = self.fake_request
+
+    def connect_world(self):
+        """Loads the World's guilds into the cache and marks the bot as ready"""
+        state = self._connection
+        state.user = discord.ClientUser(state=state, data=self.world.bot_user)
+        for guild in self.world.guilds:
+            state._add_guild_from_data(guild)
+        self._ready.set()
+        self.dispatch('ready')
+
+    def feed(self, event, payload):
+        """Sends a gateway event (ex. MESSAGE_CREATE) through discord.py's parser as if it came from the gateway"""
+        self.stats.events += 1
+        self._connection.parsers[event](payload)
+
+    async def drain(self):
+        """Waits for every listener started so far to finish"""
+        while self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+    async def settle(self, quiet=0.25, limit=30):
+        """Waits for startup tasks (the ones cogs create in __init__) to stop touching the pool and the API"""
+        last = None
+        deadline = self.loop.time() + limit
+        while self.loop.time() < deadline:
+            await self.drain()
+            activity = (sum(count for count, _ in self.stats.queries.values()), sum(self.stats.routes.values()))
+            if activity == last:
+                return
+            last = activity
+            await asyncio.sleep(quiet)
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return task
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        name = getattr(coro, '__qualname__', repr(coro))
+        stats = self.stats.listener(name, event_name)
+        token = current_listener.set(stats)
+        start = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            stats.timings.append(time.perf_counter() - start)
+            current_listener.reset(token)
+
+    async def on_error(self, event_method, *args, **kwargs):
+        listener = current_listener.get()
+        if listener is not None:
+            listener.errors += 1
+
+    async def fake_request(self, route, *, files=None, form=None, **kwargs):
+        key = (route.method, route.path)
+        self.stats.routes[key] = self.stats.routes.get(key, 0) + 1
+        listener = current_listener.get()
+        if listener is not None:
+            listener.rest_calls += 1
+        await asyncio.sleep(self.rest_latency)
+
+        if route.method == 'POST' and route.path == '/channels/{channel_id}/messages':
+            payload = kwargs.get('json') or {}
+            return {'id': str(snowflake()), 'channel_id': str(route.channel_id), 'type': 0,
+                    'author': self.world.bot_user, 'content': payload.get('content') or '',
+                    'timestamp': datetime.utcnow().isoformat(), 'edited_timestamp': None, 'tts': False,
+                    'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+                    'embeds': [payload['embed']] if payload.get('embed') else [], 'pinned': False}
+        if route.method == 'GET' and route.path.endswith('s'):
+            return []
+        return {}
+
+    async def is_owner(self, user):
+        return False
@@ -0,0 +1,133 @@
+"""Runs RedditClient and the Reddit cog's post pools against a local stand-in for reddit's json listings.
+Checks pagination, missing subreddits and 429/5xx answers, then times `get_posts` with a slow upstream.
+
+    python -m benchmarks.reddit --posts 500 --latency 0.3
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+import RedditIntegration
+from .fakes import StubServer, percentile
+
+
+def listing_stub(posts, latency):
+    """The stub app and its state. Every 10th post is stickied and every 7th is nsfw, like a real hot listing
+    they have to be filtered out. Statuses put in state['fail'] are answered, one per request, before any listing"""
+    listing = [{'id': f'p{i}', 'url': f'https://i.redd.it/{i}.png', 'stickied': i % 10 == 0, 'over_18': i % 7 == 0}
+               for i in range(posts)]
+    state = {'requests': 0, 'fail': []}
+
+    async def hot(request):
+        state['requests'] += 1
+        await asyncio.sleep(latency)
+        if state['fail']:
+            return web.Response(status=state['fail'].pop(0))
+        if request.match_info['subreddit'] == 'missing':
+            # What reddit does for subreddits that don't exist
+            return web.Response(status=302, headers={'Location': '/subreddits/search.json?q=missing'})
+        limit = int(request.query.get('limit', 25))
+        after = request.query.get('after')
+        start = next(i + 1 for i, post in enumerate(listing) if post['id'] == after) if after else 0
+        page = listing[start:start + limit]
+        next_after = page[-1]['id'] if start + limit < len(listing) else None
+        return web.json_response({'kind': 'Listing', 'data': {
+            'after': next_after, 'children': [{'kind': 't3', 'data': post} for post in page]}})
+
+    app = web.Application()
+    app.router.add_get('/r/{subreddit}/hot.json', hot)
+    return app, listing, state
+
+
+async def expect_error(coro, error):
+    try:
+        await coro
+    except error as e:
+        return e
+    raise AssertionError(f'expected {error.__name__}')
+
+
+async def run(args):
+    app, listing, stub = listing_stub(args.posts, args.latency)
+    async with StubServer(app) as server, aiohttp.ClientSession() as session:
+        client = RedditIntegration.RedditClient(session, base_url=server.url)
+
+        # Pagination, following `after` to the end of the listing
+        seen, after, pages = [], None, 0
+        while True:
+            posts, after = await client.hot('memes', limit=args.page, after=after)
+            seen.extend(post['id'] for post in posts)
+            pages += 1
+            if after is None:
+                break
+        assert seen == [post['id'] for post in listing], 'pages skipped or repeated posts'
+        print(f'pagination: {len(seen)} posts over {pages} pages')
+
+        await expect_error(client.hot('missing'), RedditIntegration.SubredditNotFound)
+        print('missing subreddit: SubredditNotFound')
+        for status in (429, 500, 503):
+            stub['fail'].append(status)
+            error = await expect_error(client.hot('memes'), aiohttp.ClientResponseError)
+            assert error.status == status
+        print('429/500/503: ClientResponseError, which the command reports as reddit being unreachable')
+
+        bot = SimpleNamespace(loop=asyncio.get_event_loop(), session=session)
+        cog = RedditIntegration.RedditIntegration(bot)
+        cog.reddit = client
+        wanted = [post['url'] for post in listing if not post['stickied'] and not post['over_18']]
+
+        # Every post once per channel, in listing order, refilled further down the listing as the pool runs low
+        timings, served = [], []
+        while len(served) < len(wanted):
+            start = time.perf_counter()
+            urls = await cog.get_posts('memes', channel_id=1)
+            timings.append(time.perf_counter() - start)
+            if not urls:
+                # Let a refill that is still going finish before deciding the listing is done
+                if cog.refilling:
+                    await asyncio.gather(*cog.refilling.values())
+                    continue
+                break
+            served.extend(urls)
+        assert served == wanted, 'posts skipped, repeated or out of order'
+        print(f'get_posts: all {len(served)} vetted posts served in order, '
+              f'{stub["requests"]} requests to the stub so far')
+        print(f'get_posts with {args.latency}s upstream latency: p50 {percentile(timings, 50) * 1000:.2f}ms, '
+              f'p99 {percentile(timings, 99) * 1000:.2f}ms, max {max(timings) * 1000:.0f}ms (the first call waits on the stub)')
+
+        # Stale while revalidate: a stale pool is still served while the refill behind it fails
+        pool = cog.pools['memes']
+        pool.fetched_at -= RedditIntegration.POOL_TTL + 1
+        stub['fail'].append(503)
+        start = time.perf_counter()
+        urls = await cog.get_posts('memes', channel_id=2)
+        elapsed = time.perf_counter() - start
+        assert urls and 'memes' in cog.refilling
+        await asyncio.gather(*cog.refilling.values(), return_exceptions=True)
+        assert cog.pools['memes'] is pool and not cog.refilling
+        print(f'stale pool with a failing refill: served {len(urls)} posts from memory in {elapsed * 1000:.2f}ms, '
+              f'pool kept for the next refill')
+        cog.cog_unload()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RedditClient and post pools against a local listing stub')
+    parser.add_argument('--posts', type=int, default=500, help='posts in the canned listing')
+    parser.add_argument('--page', type=int, default=100, help='posts per page when walking the listing')
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds the stub takes per request')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Loads real cogs into a FakeBot, replays scripted event streams and reports how each listener did.
+
+Run from the repository root (the same place the bot runs from, so utils/ and config.py are importable):
+
+    python -m benchmarks.run --scenario message_flood --events 5000
+    python -m benchmarks.run --scenario join_raid --extensions broken.tracker broken.invites --db-latency 0.002
+"""
+import argparse
+import asyncio
+import time
+import traceback
+
+from .fakes import FakeBot, World, percentile
+from .scenarios import SCENARIOS
+
+DEFAULT_EXTENSIONS = ('ServerModeration', 'broken.highlight', 'broken.reminder', 'broken.tracker',
+                      'broken.prefix', 'broken.invites')
+
+
+def load(bot, extensions):
+    for extension in extensions:
+        try:
+            bot.load_extension(extension)
+        except Exception:
+            print(f'Could not load {extension}:')
+            traceback.print_exc()
+
+
+def report(bot, elapsed):
+    stats = bot.stats
+    events = stats.events or 1
+    lines = [f'{stats.events} events in {elapsed:.2f}s ({stats.events / elapsed:.0f} events/s)', '']
+
+    header = f'{"Listener":<44}{"Event":<16}{"Calls":>7}{"Errors":>7}{"p50 ms":>9}{"p99 ms":>9}{"Calls/s":>9}{"DB/call":>9}{"REST/call":>10}'
+    lines.append(header)
+    lines.append('-' * len(header))
+    listeners = sorted(stats.listeners.values(), key=lambda s: sum(s.timings), reverse=True)
+    for s in listeners:
+        calls = len(s.timings)
+        busy = sum(s.timings)
+        lines.append(f'{s.name[:43]:<44}{s.event[:15]:<16}{calls:>7}{s.errors:>7}'
+                     f'{percentile(s.timings, 50) * 1000:>9.3f}{percentile(s.timings, 99) * 1000:>9.3f}'
+                     f'{calls / busy if busy else 0:>9.0f}{s.db_calls / calls:>9.2f}{s.rest_calls / calls:>10.2f}')
+
+    db_calls = sum(s.db_calls for s in listeners)
+    rest_calls = sum(s.rest_calls for s in listeners)
+    http_calls = sum(s.http_calls for s in listeners)
+    lines.append('')
+    lines.append(f'DB round trips per event: {db_calls / events:.2f}, REST calls per event: {rest_calls / events:.2f}, '
+                 f'other HTTP per event: {http_calls / events:.2f}')
+
+    if stats.queries:
+        lines.append('')
+        lines.append('Busiest queries:')
+        for query, (count, total) in sorted(stats.queries.items(), key=lambda q: q[1][0], reverse=True)[:10]:
+            lines.append(f'{count:>8} x {total / count * 1000:.3f}ms  {query[:100]}')
+    if stats.routes:
+        lines.append('')
+        lines.append('REST routes:')
+        for (method, path), count in sorted(stats.routes.items(), key=lambda r: r[1], reverse=True):
+            lines.append(f'{count:>8} x {method} {path}')
+    return '\n'.join(lines)
+
+
+async def run(args):
+    world = World(guilds=args.guilds, members=args.members, channels=args.channels, seed=args.seed)
+    bot = FakeBot(world, db_latency=args.db_latency, rest_latency=args.rest_latency)
+    load(bot, args.extensions)
+    bot.connect_world()
+    await bot.settle()
+    # Startup work isn't what is being measured
+    bot.stats.clear()
+
+    start = time.perf_counter()
+    for event, payload in SCENARIOS[args.scenario](world, args.events):
+        bot.feed(event, payload)
+        # The gateway hands over one event per read, let listeners run in between like they would live
+        await asyncio.sleep(0)
+    await bot.drain()
+    elapsed = time.perf_counter() - start
+
+    print(report(bot, elapsed))
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay synthetic gateway events against real cogs, offline')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='message_flood')
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--extensions', nargs='+', default=DEFAULT_EXTENSIONS)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--db-latency', type=float, default=0.001, help='seconds every query takes')
+    parser.add_argument('--rest-latency', type=float, default=0.05, help='seconds every Discord API call takes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # discord.py 1.x wants the loop to exist before the bot does
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
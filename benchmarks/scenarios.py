@@ -0,0 +1,55 @@
+"""Scripted gateway event streams. Each scenario takes the World and a count and yields (event, payload)"""
+from .fakes import snowflake
+
+WORDS = ('hello', 'music', 'python', 'anyone', 'here', 'meme', 'lol', 'help', 'discord', 'server', 'game', 'tonight')
+
+
+def message_flood(world, count):
+    """Chat messages from random members in random channels across every guild"""
+    for _ in range(count):
+        guild = world.random_guild()
+        channel = world.random.choice(guild['channels'])
+        member = world.random_member(guild)
+        content = ' '.join(world.random.choices(WORDS, k=world.random.randint(1, 12)))
+        yield 'MESSAGE_CREATE', world.message_payload(guild, channel, member, content)
+
+
+def join_raid(world, count):
+    """A burst of brand new accounts joining a single guild"""
+    guild = world.guilds[0]
+    for i in range(count):
+        user = world.user_payload(snowflake(), f'raider{i}')
+        member = world.member_payload(guild['id'], user)
+        guild['members'].append(member)
+        yield 'GUILD_MEMBER_ADD', member
+
+
+def role_churn(world, count):
+    """Members gaining and losing roles"""
+    for _ in range(count):
+        guild = world.random_guild()
+        member = world.random_member(guild)
+        role = world.random.choice(guild['roles'][1:])['id']
+        if role in member['roles']:
+            member['roles'].remove(role)
+        else:
+            member['roles'].append(role)
+        yield 'GUILD_MEMBER_UPDATE', {'guild_id': guild['id'], 'user': member['user'],
+                                      'roles': list(member['roles']), 'nick': member['nick']}
+
+
+def reminder_burst(world, count):
+    """Lots of people setting reminders at once"""
+    for i in range(count):
+        guild = world.random_guild()
+        channel = world.random.choice(guild['channels'])
+        member = world.random_member(guild)
+        yield 'MESSAGE_CREATE', world.message_payload(guild, channel, member, f'%remind in {i % 50 + 2} minutes stretch')
+
+
+SCENARIOS = {
+    'message_flood': message_flood,
+    'join_raid': join_raid,
+    'role_churn': role_churn,
+    'reminder_burst': reminder_burst,
+}
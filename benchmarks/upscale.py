@@ -0,0 +1,95 @@
+"""Drives ImageManipulation.request_upscale against a local stand-in for deepai's waifu2x API
+and measures how late the event loop gets while the uploads are in flight.
+
+    python -m benchmarks.upscale --requests 50 --latency 0.5 --error-rate 0.1
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+import ImageManipulation
+from .fakes import StubServer, LagProbe, percentile
+
+
+def waifu2x_stub(latency, error_rate, seed=0):
+    """The stub app and the counters it keeps. `error_rate` of the requests get a 429 or 5xx back"""
+    rng = random.Random(seed)
+    stats = {'requests': 0, 'errors': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    async def waifu2x(request):
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            form = await request.post()
+            image = form['image'].file.read()
+            await asyncio.sleep(latency)
+            if rng.random() < error_rate:
+                stats['errors'] += 1
+                return web.Response(status=rng.choice((429, 502, 503)))
+            return web.json_response({'output_url': f'https://upscaled.invalid/{len(image)}.png'})
+        finally:
+            stats['in_flight'] -= 1
+
+    app = web.Application()
+    app.router.add_post('/api/waifu2x', waifu2x)
+    return app, stats
+
+
+async def run(args):
+    app, stub = waifu2x_stub(args.latency, args.error_rate, args.seed)
+    async with StubServer(app) as server, aiohttp.ClientSession() as session:
+        ImageManipulation.API_URL = f'{server.url}/api/waifu2x'
+        bot = SimpleNamespace(loop=asyncio.get_event_loop(), session=session)
+        cog = ImageManipulation.ImageManipulation(bot)
+
+        timings = []
+
+        async def one(size):
+            start = time.perf_counter()
+            result = await cog.request_upscale(os.urandom(size))
+            timings.append(time.perf_counter() - start)
+            return result
+
+        probe = LagProbe()
+        probe.start()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(args.size) for _ in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        probe.stop()
+        cog.cog_unload()
+
+    done = sum(result is not None for result in results)
+    print(f'{args.requests} upscales in {elapsed:.2f}s, {done} succeeded, {args.requests - done} gave up')
+    print(f'Stub saw {stub["requests"]} requests ({stub["errors"]} answered with 429/5xx), '
+          f'at most {stub["max_in_flight"]} at once (limit {ImageManipulation.UPSCALE_CONCURRENCY})')
+    print(f'Per upscale: p50 {percentile(timings, 50):.2f}s, p99 {percentile(timings, 99):.2f}s')
+    print(f'Loop lag: p50 {percentile(probe.lags, 50) * 1000:.2f}ms, p99 {percentile(probe.lags, 99) * 1000:.2f}ms, '
+          f'max {max(probe.lags, default=0) * 1000:.2f}ms over {len(probe.lags)} samples')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='request_upscale against a local waifu2x stub')
+    parser.add_argument('--requests', type=int, default=20, help='upscales started at the same time')
+    parser.add_argument('--size', type=int, default=512 * 1024, help='bytes uploaded per upscale')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds the stub takes per request')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='share of requests answered with 429/5xx')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,37 +2,62 @@ import discord
 import requests
 import random
 import io
+import os
+import asyncio
 from typing import Optional
 from discord.ext import commands
 from utils.global_utils import bright_color, last_image, is_image
-import wikipedia
-from chatbot import Chat, register_call
 
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),"chatbotTemplate","chatbottemplate.template")
+
+
+def who_is(query, session_id="general"):
+    import wikipedia
+    try:
+        return wikipedia.summary(query)
+    except Exception:
+        for new_query in wikipedia.search(query):
+            try:
+                return wikipedia.summary(new_query)
+            except Exception:
+                pass
+    return "I don't know about "+query
 
 
 class WikipediaBrain(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.chat = None
+        self.loading = None  # future of the chat being loaded, shared by every first use
+        # Chat keeps conversation state and was never meant to be used from two threads at once
+        self.respond_lock = asyncio.Lock()
+
+    def load_chat(self):
+        # chatbot and wikipedia are slow to import and the template is slow to load, wait until someone uses it
+        from chatbot import Chat, register_call
+        register_call("whoIs")(who_is)
+        return Chat(TEMPLATE_PATH)
+
+    async def get_chat(self):
+        if self.chat is None:
+            if self.loading is None:
+                self.loading = self.bot.loop.run_in_executor(None, self.load_chat)
+            loading = self.loading
+            try:
+                self.chat = await asyncio.shield(loading)
+            except Exception:
+                # Let the next use try again
+                if self.loading is loading:
+                    self.loading = None
+                raise
+        return self.chat
 
-    @register_call("whoIs")
-    def who_is(self,ctx, session_id="general"):
-        try:
-            return wikipedia.summary(query)
-        except Exception:
-            for new_query in wikipedia.search(query):
-                try:
-                    return wikipedia.summary(new_query)
-                except Exception:
-                    pass
-        return "I don't know about "+query
-
-        
-    template_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"chatbotTemplate","chatbottemplate.template")
-    chat=Chat(template_file_path)
-    
     @commands.command(pass_context = True)
-    async def chatbot(ctx,*,message):
-        result = chat.respond(message)
+    async def chatbot(self, ctx,*,message):
+        chat = await self.get_chat()
+        # respond can look things up on wikipedia, which is a blocking request
+        async with self.respond_lock:
+            result = await self.bot.loop.run_in_executor(None, chat.respond, message)
         if(len(result)<=2048):
             embed=discord.Embed(title="ChatBot AI", description = result, color = (0xF48D1))
             await ctx.send(embed=embed)
@@ -2,13 +2,190 @@ import discord
 from discord.ext import commands
 
 from utils.global_utils import is_image
+import io
 import random
+import asyncio
+import aiohttp
 from typing import Union
 
+# Discord's emoji upload limit
+EMOJI_MAX_BYTES = 256 * 1024
+# Anything up to this is downloaded and shrunk to fit, bigger images are refused
+EMOJI_DOWNLOAD_BYTES = 8 * 1024 * 1024
+EMOJI_DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+EMOJI_MAX_PIXELS = 4096 * 4096
+# Sizes tried in order until the emoji fits, 128 is what discord displays at most
+EMOJI_SIZES = (128, 96, 64, 48, 32)
+
+
+class EmojiTooLarge(Exception):
+    pass
+
+
+class UnreadableEmoji(Exception):
+    pass
+
+
+def _encode_emoji(img, size):
+    from PIL import ImageSequence
+    buffer = io.BytesIO()
+    if img.format == 'GIF' and getattr(img, 'is_animated', False):
+        frames = []
+        for frame in ImageSequence.Iterator(img):
+            frame = frame.convert('RGBA')
+            frame.thumbnail((size, size))
+            frames.append(frame)
+        frames[0].save(buffer, 'gif', save_all=True, append_images=frames[1:], optimize=True,
+                       loop=img.info.get('loop', 0), duration=img.info.get('duration', 100), disposal=2)
+    elif img.format == 'JPEG':
+        frame = img.convert('RGB')
+        frame.thumbnail((size, size))
+        frame.save(buffer, 'jpeg', quality=90, optimize=True)
+    else:
+        frame = img.convert('RGBA')
+        frame.thumbnail((size, size))
+        frame.save(buffer, 'png', optimize=True)
+    return buffer.getvalue()
+
+
+def fit_emoji(data):
+    """Shrinks and re-encodes an image until it fits in an emoji slot. Blocking, run it in an executor.
+    Raises EmojiTooLarge or UnreadableEmoji instead of PIL's errors"""
+    if len(data) <= EMOJI_MAX_BYTES:
+        return data
+    from PIL import Image
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > EMOJI_MAX_PIXELS:
+            raise EmojiTooLarge
+        for size in EMOJI_SIZES:
+            encoded = _encode_emoji(img, size)
+            if len(encoded) <= EMOJI_MAX_BYTES:
+                return encoded
+    except Image.DecompressionBombError:
+        raise EmojiTooLarge from None
+    except (OSError, ValueError):
+        raise UnreadableEmoji from None
+    raise EmojiTooLarge
+
+
+def trigrams(name):
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+class EmojiIndex:
+    """Usable emojis of every guild, indexed by lowercased name and by name trigrams"""
+
+    def __init__(self):
+        self.emojis = {}  # emoji id: (emoji, lowercased name)
+        self.by_name = {}  # lowercased name: {emoji ids}
+        self.by_trigram = {}  # trigram: {emoji ids}
+        self.by_guild = {}  # guild id: [emojis sorted by name]
+        self.counts = {}  # guild id: (static emoji count, animated emoji count), including unusable ones
+
+    def __len__(self):
+        return len(self.emojis)
+
+    def add_guild(self, guild):
+        self.remove_guild(guild.id)
+        animated = sum(emoji.animated for emoji in guild.emojis)
+        self.counts[guild.id] = (len(guild.emojis) - animated, animated)
+        emojis = sorted([emoji for emoji in guild.emojis if emoji.require_colons], key=lambda e: e.name)
+        if not emojis:
+            return
+        self.by_guild[guild.id] = emojis
+        for emoji in emojis:
+            name = emoji.name.lower()
+            self.emojis[emoji.id] = (emoji, name)
+            self.by_name.setdefault(name, set()).add(emoji.id)
+            for trigram in trigrams(name):
+                self.by_trigram.setdefault(trigram, set()).add(emoji.id)
+
+    def remove_guild(self, guild_id):
+        self.counts.pop(guild_id, None)
+        for emoji in self.by_guild.pop(guild_id, ()):
+            _, name = self.emojis.pop(emoji.id)
+            self._discard(self.by_name, name, emoji.id)
+            for trigram in trigrams(name):
+                self._discard(self.by_trigram, trigram, emoji.id)
+
+    @staticmethod
+    def _discard(index, key, emoji_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(emoji_id)
+            if not ids:
+                del index[key]
+
+    def rebuild(self, guilds):
+        self.__init__()
+        for guild in guilds:
+            self.add_guild(guild)
+
+    def _sorted(self, ids):
+        emojis = [self.emojis[emoji_id][0] for emoji_id in ids]
+        emojis.sort(key=lambda e: (e.guild_id, e.name))
+        return emojis
+
+    def exact(self, name):
+        """Emojis named `name`, case insensitive"""
+        return self._sorted(self.by_name.get(name.lower(), ()))
+
+    def search(self, name):
+        """Emojis with `name` anywhere in their name, case insensitive"""
+        name = name.lower()
+        if len(name) < 3:
+            # Too short for trigrams, only owners get here
+            return self._sorted(emoji_id for emoji_id, (_, lowered) in self.emojis.items() if name in lowered)
+
+        candidates = None
+        for trigram in sorted(trigrams(name), key=lambda t: len(self.by_trigram.get(t, ()))):
+            ids = self.by_trigram.get(trigram)
+            if not ids:
+                return []
+            candidates = set(ids) if candidates is None else candidates & ids
+        # Sharing every trigram doesn't mean the name contains the whole query
+        return self._sorted(emoji_id for emoji_id in candidates if name in self.emojis[emoji_id][1])
+
+    def slots_used(self, guild):
+        """Number of (static, animated) emojis in the guild"""
+        counts = self.counts.get(guild.id)
+        if counts is None:
+            # Not indexed yet
+            animated = sum(emoji.animated for emoji in guild.emojis)
+            counts = (len(guild.emojis) - animated, animated)
+        return counts
+
+    def guild(self, guild_id):
+        """Usable emojis of a guild sorted by name"""
+        return self.by_guild.get(guild_id, [])
+
 
 class EmojiCog(commands.Cog, name='Emoji'):
     def __init__(self, bot):
         self.bot = bot
+        self.index = EmojiIndex()
+        bot.loop.create_task(self.build_index())
+
+    async def build_index(self):
+        await self.bot.wait_until_ready()
+        self.index.rebuild(self.bot.guilds)
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(self, guild, before, after):
+        self.index.add_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.index.add_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild):
+        self.index.add_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.index.remove_guild(guild.id)
 
     @commands.group(invoke_without_command=True, case_insensitive=True, aliases=['emotes'])
     async def emoji(self, ctx):
@@ -20,9 +197,7 @@ class EmojiCog(commands.Cog, name='Emoji'):
         Also gives its ID and guild"""
         if len(name) < 3 and not await self.bot.is_owner(ctx.author):
             return await ctx.send('Name too short! Please enter at least 3 characters to search')
-        name = name.lower()
-        found = [emoji for guild in self.bot.guilds for emoji in guild.emojis
-                 if name in emoji.name.lower() and emoji.require_colons]
+        found = self.index.search(name)
         if found:
             paginator = commands.Paginator(suffix='', prefix='')
             for emoji in found:
@@ -41,27 +216,50 @@ class EmojiCog(commands.Cog, name='Emoji'):
         if not await is_image(ctx, url, gif=True):
             return await ctx.send('Invalid file type! Must be one of the following: `.png .jpeg .jpg .gif`')
 
+        static_count, animated_count = self.index.slots_used(ctx.guild)
         if url.endswith('.gif'):
-            animated_count = sum([e.animated for e in ctx.guild.emojis])
             if animated_count >= ctx.guild.emoji_limit:
                 return await ctx.send('There are no more animated emoji slots!')
         else:
-            emoji_count = sum([not e.animated for e in ctx.guild.emojis])
-            if emoji_count >= ctx.guild.emoji_limit:
+            if static_count >= ctx.guild.emoji_limit:
                 return await ctx.send('There are no more emoji slots!')
 
-        async with self.bot.session.get(url) as resp:
+        try:
+            data = await self.download_emoji(url)
+        except EmojiTooLarge:
+            return await ctx.send(f'Image is too big! (max {EMOJI_DOWNLOAD_BYTES // (1024 * 1024)}MB)')
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            data = None
+        if data is None:
+            return await ctx.send('Could not fetch the image.')
+
+        try:
+            data = await self.bot.loop.run_in_executor(None, fit_emoji, data)
+        except EmojiTooLarge:
+            return await ctx.send('Image is too big, even after shrinking it!')
+        except UnreadableEmoji:
+            return await ctx.send('Unable to read that image')
+
+        try:
+            await ctx.guild.create_custom_emoji(name=name, image=data, reason=f'Emoji created by {ctx.author} ({ctx.author.id})')
+        except discord.HTTPException as e:
+            await ctx.send(f'An error has occurred:\n```{e}```')
+        else:
+            await ctx.message.add_reaction('\U00002705')
+
+    async def download_emoji(self, url):
+        """Streams the image into memory, stopping as soon as it goes over the download cap"""
+        async with self.bot.session.get(url, timeout=EMOJI_DOWNLOAD_TIMEOUT) as resp:
             if resp.status >= 400:
-                return await ctx.send('Could not fetch the image.')
-            if int(resp.headers['Content-Length']) >= (256 * 1024):
-                return await ctx.send('Image is too big!')
-            data = await resp.read()
-            try:
-                await ctx.guild.create_custom_emoji(name=name, image=data, reason=f'Emoji created by {ctx.author} ({ctx.author.id})')
-            except discord.HTTPException as e:
-                await ctx.send(f'An error has occurred:\n```{e}```')
-            else:
-                await ctx.message.add_reaction('\U00002705')
+                return None
+            if resp.content_length is not None and resp.content_length > EMOJI_DOWNLOAD_BYTES:
+                raise EmojiTooLarge
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                data += chunk
+                if len(data) > EMOJI_DOWNLOAD_BYTES:
+                    raise EmojiTooLarge
+            return bytes(data)
 
     @emoji.command(name='list')
     async def guild_emojis(self, ctx, codepoint: bool = False):
@@ -70,7 +268,7 @@ class EmojiCog(commands.Cog, name='Emoji'):
         if ctx.guild is None:
             await ctx.invoke(self.all_guild_emojis, codepoint)
             return
-        emojis = sorted([emoji for emoji in ctx.guild.emojis if emoji.require_colons], key=lambda e: e.name)
+        emojis = self.index.guild(ctx.guild.id)
         paginator = commands.Paginator(suffix='', prefix='')
         paginator.add_line(f'Emojis of {ctx.guild.name}:')
         if codepoint:
@@ -98,8 +296,9 @@ class EmojiCog(commands.Cog, name='Emoji'):
         Pass in True as a parameter to get codepoints"""
         paginator = commands.Paginator(suffix='', prefix='')
 
-        for guild in sorted(self.bot.guilds, key=lambda g: g.name):
-            emojis = sorted([emoji for emoji in guild.emojis if emoji.require_colons], key=lambda e: e.name)
+        guilds = [self.bot.get_guild(guild_id) for guild_id in self.index.by_guild]
+        for guild in sorted(filter(None, guilds), key=lambda g: g.name):
+            emojis = self.index.guild(guild.id)
 
             if not emojis:
                 continue
@@ -121,9 +320,7 @@ class EmojiCog(commands.Cog, name='Emoji'):
     async def nitro(self, ctx, *, name):
         """Returns a random emoji with the given name
         Only works with emojis the bot can see/use"""
-        name = name.lower()
-        found = [emoji for guild in self.bot.guilds for emoji in guild.emojis
-                 if emoji.name.lower() == name and emoji.require_colons]
+        found = self.index.exact(name)
 
         if found:
             await ctx.send(random.choice(found))
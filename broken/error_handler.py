@@ -1,24 +1,153 @@
 import traceback
-from discord.ext import commands
+from discord.ext import commands, tasks
 import discord
 
 import re
+import sys
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
 
 from utils.global_utils import upload_hastebin
 from utils.errors import BlacklistedUser, TimezoneNotFound
 from .latex import TexRenderError
 
+# Distinct errors kept in memory, the least recently seen one is dropped past this
+MAX_ERRORS = 200
+# Reports waiting to be sent to the owner. When full, new ones are dropped and only show up in the digest
+REPORT_QUEUE_SIZE = 20
+# Seconds between messages to the owner, so a burst of errors can't eat the rate limits commands need
+REPORT_INTERVAL = 2
+DIGEST_MINUTES = 15
+
+
+class ErrorReport:
+    __slots__ = ('fingerprint', 'where', 'summary', 'traceback', 'count', 'reported', 'first_seen', 'last_seen')
+
+    def __init__(self, fingerprint, where, summary, tb):
+        self.fingerprint = fingerprint
+        self.where = where  # command or event it happened in
+        self.summary = summary  # last line of the traceback
+        self.traceback = tb
+        self.count = 0
+        self.reported = 0  # count as of the last digest
+        self.first_seen = self.last_seen = time.time()
+
+
+def fingerprint(where, error):
+    """Errors with the same type raised through the same code are the same error, whatever the message"""
+    frames = traceback.extract_tb(error.__traceback__)
+    signature = '|'.join([where, type(error).__qualname__] + [f'{f.filename}:{f.name}:{f.lineno}' for f in frames])
+    return hashlib.sha1(signature.encode()).hexdigest()[:8]
+
 
 class CommandErrorHandler(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.owner = None
+        self.errors = OrderedDict()  # fingerprint: ErrorReport
+        self.reports = asyncio.Queue(maxsize=REPORT_QUEUE_SIZE)
+        self.dropped = 0
         bot.on_error = self.on_error
-        bot.loop.create_task(self.set_owner())
+        self.reporter = bot.loop.create_task(self.send_reports())
+        self.send_digest.start()
+
+    def cog_unload(self):
+        self.reporter.cancel()
+        self.send_digest.cancel()
 
     async def set_owner(self):
         await self.bot.wait_until_ready()
         self.owner = (await self.bot.application_info()).owner
 
+    def record_error(self, where, error, embed=None):
+        """Counts the error and queues a report for the owner if it's the first time it's been seen"""
+        key = fingerprint(where, error)
+        report = self.errors.get(key)
+        if report is None:
+            tb = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+            summary = traceback.format_exception_only(type(error), error)[-1].strip()
+            report = self.errors[key] = ErrorReport(key, where, summary, tb)
+            if len(self.errors) > MAX_ERRORS:
+                self.errors.popitem(last=False)
+            try:
+                self.reports.put_nowait((report, embed))
+            except asyncio.QueueFull:
+                self.dropped += 1
+        else:
+            self.errors.move_to_end(key)
+        report.count += 1
+        report.last_seen = time.time()
+        return report
+
+    async def send_reports(self):
+        await self.set_owner()
+        while True:
+            report, embed = await self.reports.get()
+            try:
+                if embed is not None:
+                    await self.owner.send(embed=embed)
+                else:
+                    await self.owner.send(f'An error occurred in `{report.where}` (`{report.fingerprint}`)')
+                if len(report.traceback) >= 1980:
+                    url = await upload_hastebin(self.bot, report.traceback)
+                    await self.owner.send(f'Traceback too long. {url}')
+                else:
+                    await self.owner.send(f'```py\n{report.traceback}```')
+            except Exception:
+                pass
+            await asyncio.sleep(REPORT_INTERVAL)
+
+    @tasks.loop(minutes=DIGEST_MINUTES)
+    async def send_digest(self):
+        """Sends a summary of errors that happened again since they were reported"""
+        repeated = [r for r in self.errors.values() if r.count > max(r.reported, 1)]
+        if not repeated and not self.dropped:
+            return
+        lines = [f'Errors in the last {DIGEST_MINUTES} minutes:']
+        for report in sorted(repeated, key=lambda r: r.count - r.reported, reverse=True)[:15]:
+            lines.append(f'`{report.fingerprint}` {report.where}: {report.summary[:100]} '
+                         f'- {report.count - max(report.reported, 1)} more ({report.count} total)')
+        if len(repeated) > 15:
+            lines.append(f'...and {len(repeated) - 15} more')
+        if self.dropped:
+            lines.append(f'{self.dropped} new error reports were dropped because too many were queued, see `errors`')
+        for report in repeated:
+            report.reported = report.count
+        self.dropped = 0
+        try:
+            await self.owner.send('\n'.join(lines)[:2000])
+        except discord.HTTPException:
+            pass
+
+    @send_digest.before_loop
+    async def before_digest(self):
+        await self.bot.wait_until_ready()
+        # Let the first interval pass so there is something to summarise
+        await asyncio.sleep(DIGEST_MINUTES * 60)
+
+    @commands.command(name='errors', hidden=True)
+    @commands.is_owner()
+    async def errors_(self, ctx, fingerprint: str = None):
+        """Lists recent errors by how often they happened, or shows the traceback of one"""
+        if fingerprint is not None:
+            report = self.errors.get(fingerprint)
+            if report is None:
+                return await ctx.send('No error with that fingerprint')
+            if len(report.traceback) >= 1980:
+                return await ctx.send(await upload_hastebin(ctx, report.traceback))
+            return await ctx.send(f'```py\n{report.traceback}```')
+        if not self.errors:
+            return await ctx.send('No errors recorded')
+        paginator = commands.Paginator(prefix='', suffix='')
+        for report in sorted(self.errors.values(), key=lambda r: r.count, reverse=True):
+            paginator.add_line(f'`{report.fingerprint}` **{report.count}x** {report.where}: {report.summary[:100]} '
+                               f'(first {time.strftime("%m-%d %H:%M", time.gmtime(report.first_seen))}, '
+                               f'last {time.strftime("%m-%d %H:%M", time.gmtime(report.last_seen))} UTC)')
+        for page in paginator.pages:
+            await ctx.send(page)
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
         """The event triggered when an error is raised while invoking a command.
@@ -91,24 +220,13 @@ class CommandErrorHandler(commands.Cog):
                                       f'[Jump to message]({ctx.message.jump_url})',
                           color=discord.Color.red())
         e.set_author(name=ctx.author, icon_url=ctx.author.avatar_url)
-
-        await self.owner.send(embed=e)
-        fmt = "".join(tb)
-        if len(fmt) >= 1980:
-            url = await upload_hastebin(ctx, fmt)
-            await self.owner.send(f'Traceback too long. {url}')
-        else:
-            await self.owner.send(f'```py\n{fmt}```')
+        self.record_error(f'command {ctx.command}', error, e)
 
     async def on_error(self, event, *args, **kwargs):
-        await self.bot.wait_until_ready()
-        await self.owner.send(f'An error occurred in event `{event}`')
-        tb = "".join(traceback.format_exc())
-        if len(tb) >= 1980:
-            url = await upload_hastebin(self.bot, tb)
-            await self.owner.send(f'Traceback too long. {url}')
-        else:
-            await self.owner.send(f'```py\n{tb}```')
+        # Called from inside the except block, so the error has to be read before anything is awaited
+        error = sys.exc_info()[1]
+        if error is not None:
+            self.record_error(f'event {event}', error)
 
 
 def setup(bot):
@@ -2,8 +2,8 @@ import discord
 from discord.ext import commands
 
 import datetime
-import asyncio
 from utils.time import human_timedelta
+from .scheduler import job, schedule_jobs, unschedule_jobs
 
 GUILD_ID = 709264610200649738
 VERIFIED_ROLE = 709265266709626881
@@ -12,11 +12,28 @@ BOT_CHANNEL = 709277913471647824
 BF_ROLE = 713953248226050058
 
 
+def next_battlefield(now):
+    """Battlefield starts at 5 to every odd hour, the notification for it is sent then"""
+    if now.hour % 2 == 0 and now >= now.replace(minute=55, second=0, microsecond=0):
+        now += datetime.timedelta(minutes=5)
+    top_hour = now.replace(minute=0, second=0, microsecond=0)
+    if top_hour.hour % 2 == 0:
+        td = datetime.timedelta(minutes=55)
+    else:
+        td = datetime.timedelta(hours=1, minutes=55)
+    return top_hour + td
+
+
+def next_battlefield_warning(now):
+    """One minute before the end of the battlefield that's running or next"""
+    return next_battlefield(now - datetime.timedelta(minutes=4)) + datetime.timedelta(minutes=4)
+
+
 class Gatekeep(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         bot.loop.create_task(self.get_verified_ids())
-        self.twom_task = bot.loop.create_task(self.twom_bf_notification_loop())
+        schedule_jobs(self)
 
     async def get_verified_ids(self):
         query = '''SELECT id FROM gatekeep;'''
@@ -34,7 +51,7 @@ class Gatekeep(commands.Cog):
             ctx.local_handled = True
 
     def cog_unload(self):
-        self.twom_task.cancel()
+        unschedule_jobs(self)
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
@@ -55,35 +72,27 @@ class Gatekeep(commands.Cog):
         if toggle is None:
             toggle = True
 
+        scheduler = self.bot.get_cog('Scheduler')
+        if scheduler is None:
+            return await ctx.send('Battlefield notifications are unavailable right now')
+        for name in ('bf', 'bf.warning'):
+            await scheduler.set_enabled(name, toggle)
         if toggle:
-            if self.twom_task.done():
-                self.twom_task = self.bot.loop.create_task(self.twom_bf_notification_loop())
             await ctx.send(f'Next battlefield notification is in **{human_timedelta(self.calculate_next_interval())}**')
-        else:
-            self.twom_task.cancel()
         await ctx.send(f'Battlefield notifications are now: {"ON" if toggle else "OFF"}')
 
-    async def twom_bf_notification_loop(self):
-        await self.bot.wait_until_ready()
+    @job('bf', at=next_battlefield)
+    async def twom_bf_notification(self):
+        channel = self.bot.get_channel(BOT_CHANNEL)
+        await channel.send(f'<@&{BF_ROLE}> Its time for battlefield!', delete_after=300)
+
+    @job('bf.warning', at=next_battlefield_warning)
+    async def twom_bf_warning(self):
         channel = self.bot.get_channel(BOT_CHANNEL)
-        while not self.bot.is_closed():
-            bf_time = self.calculate_next_interval()
-            seconds = (bf_time - datetime.datetime.utcnow()).total_seconds()
-            await asyncio.sleep(seconds)
-            await channel.send(f'<@&{BF_ROLE}> Its time for battlefield!', delete_after=300)
-            await discord.utils.sleep_until(datetime.datetime.utcnow().replace(minute=59, second=0, microsecond=0))
-            await channel.send(f'<@&{BF_ROLE}> 1 minute left you weebtards', delete_after=60)
+        await channel.send(f'<@&{BF_ROLE}> 1 minute left you weebtards', delete_after=60)
 
     def calculate_next_interval(self):
-        now = datetime.datetime.utcnow()
-        if now.hour % 2 == 0 and now >= now.replace(minute=55, second=0, microsecond=0):
-            now += datetime.timedelta(minutes=5)
-        top_hour = now.replace(minute=0, second=0, microsecond=0)
-        if top_hour.hour % 2 == 0:
-            td = datetime.timedelta(minutes=55)
-        else:
-            td = datetime.timedelta(hours=1, minutes=55)
-        return top_hour + td
+        return next_battlefield(datetime.datetime.utcnow())
 
 
 def setup(bot):
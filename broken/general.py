@@ -4,15 +4,15 @@ from discord.ext import commands
 import io
 import random
 import datetime
-import googletrans
 import unicodedata
-from PIL import Image
 from typing import Optional
 from utils import converters
 from utils.global_utils import last_image, is_image, upload_hastebin, bright_color
+from Webhooks import send_as
 
 
 def make_more_jpeg(content):
+    from PIL import Image
     img = Image.open(content)
     buffer = io.BytesIO()
     img.convert('RGB').save(buffer, "jpeg", quality=random.randrange(1, 8))
@@ -23,7 +23,7 @@ def make_more_jpeg(content):
 class GeneralCog(commands.Cog, name='General'):
     def __init__(self, bot):
         self.bot = bot
-        self.translator = googletrans.Translator()
+        self.translator = None  # Only used if the NLP cog is not loaded
 
     @commands.command(name='avatar', aliases=['ava', 'pfp'])
     async def get_avatar(self, ctx, *, user: converters.CaseInsensitiveMember = None):
@@ -50,9 +50,7 @@ class GeneralCog(commands.Cog, name='General'):
     @commands.command()
     async def quote(self, ctx, user: converters.CaseInsensitiveMember, *, message: commands.clean_content()):
         """Send a message as someone else"""
-        webhook = await ctx.channel.create_webhook(name=user.display_name)
-        await webhook.send(message, avatar_url=user.avatar_url_as(format='png'))
-        await webhook.delete()
+        await send_as(self.bot, ctx.channel, message, user)
         try:
             await ctx.message.delete()
         except (discord.Forbidden, discord.HTTPException):
@@ -126,6 +124,15 @@ class GeneralCog(commands.Cog, name='General'):
 
     @commands.command(name='needsmorejpeg', aliases=['needsmorejpg', 'morejpeg', 'morejpg'])
     async def needs_more_jpeg(self, ctx, url=None):
+        image_cog = self.bot.get_cog('ImageManipulation')
+        if image_cog is not None:
+            url = url or await image_cog.find_last_image(ctx)
+            if url is None:
+                return await ctx.send('Unable to find an image')
+            if not await image_cog.check_image(ctx, url):
+                return await ctx.send('That is not a valid image url')
+            return await image_cog.send_more_jpeg(ctx, url, random.randrange(1, 8))
+
         url = url or await last_image(ctx)
         if url is None:
             return await ctx.send('Unable to find an image')
@@ -166,6 +173,11 @@ class GeneralCog(commands.Cog, name='General'):
     async def translate(self, ctx, *, text: commands.clean_content=None):
         """Translates a message to English using Google translate.
         If no message is given, I will try and find the last message with text"""
+        nlp = self.bot.get_cog('NLP')
+        if nlp is not None:
+            # Share its translation cache and thread pool
+            return await ctx.invoke(nlp.translate, text=text)
+
         if text is None:
             async for message in ctx.channel.history(limit=25, before=ctx.message):
                 if message.content:
@@ -173,6 +185,9 @@ class GeneralCog(commands.Cog, name='General'):
                     break
             if text is None:
                 return await ctx.send('Unable to find text to translate!')
+        import googletrans
+        if self.translator is None:
+            self.translator = googletrans.Translator()
         loop = self.bot.loop
         try:
             res = await loop.run_in_executor(None, self.translator.translate, text)
@@ -1,18 +1,224 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
+import heapq
+import asyncio
 from asyncio import TimeoutError
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import Counter
 
 from utils.global_utils import bright_color
 from utils.converters import CaseInsensitiveMember
 
 
+WAIT_DURATION = timedelta(hours=24)
+MAX_WAITS_PER_USER = 10
+# Members counted between yields to the event loop when counting a guild's members
+COUNT_BATCH = 5000
+
+
+class Waiter:
+    __slots__ = ('id', 'author', 'channel', 'target', 'origin', 'message', 'expires')
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.author = record['author']
+        self.channel = record['channel']  # channel being waited in
+        self.target = record['target']  # user being waited for, None for anyone
+        self.origin = record['origin']  # channel the command was used in
+        self.message = record['message']
+        self.expires = record['expires']
+
+    @property
+    def key(self):
+        return self.channel if self.target is None else (self.channel, self.target)
+
+
+class MemberStats:
+    """Bot and status counts of a guild's members, kept up to date from member events"""
+    __slots__ = ('bots', 'humans', 'statuses')
+
+    def __init__(self, members):
+        self.bots = 0
+        self.humans = 0
+        self.statuses = Counter()
+        for member in members:
+            self.add(member)
+
+    def add(self, member, amount=1):
+        if member.bot:
+            self.bots += amount
+        else:
+            self.humans += amount
+        self.statuses[member.status] += amount
+
+    def remove(self, member):
+        self.add(member, -1)
+
+    def update_status(self, before, after):
+        self.statuses[before] -= 1
+        self.statuses[after] += 1
+
+
+async def count_members(guild):
+    """Counts the guild's members into a new MemberStats, letting other tasks run every COUNT_BATCH members"""
+    stats = MemberStats(())
+    for i, member in enumerate(list(guild.members), 1):
+        stats.add(member)
+        if i % COUNT_BATCH == 0:
+            await asyncio.sleep(0)
+    return stats
+
+
 class GuildCog(commands.Cog, name='Guild'):
     def __init__(self, bot):
         self.bot = bot
+        self.member_stats = {}  # guild_id: MemberStats
+        self.reconcile_member_stats.start()
+        self.waiters = {}  # waiter id: Waiter
+        self.waiter_index = {}  # channel_id or (channel_id, user_id): {waiter id: Waiter}
+        self.waiter_heap = []  # (expires, waiter id), may contain waiters that already fired
+        self.waiter_added = asyncio.Event()
+        self.waiter_task = bot.loop.create_task(self.expire_waiters())
+
+    def cog_unload(self):
+        self.reconcile_member_stats.cancel()
+        self.waiter_task.cancel()
+
+    def get_member_stats(self, guild):
+        """Returns the guild's MemberStats. Every guild is counted once the bot is ready and when it's joined,
+        this only counts here (all at once) if asked before that happened"""
+        stats = self.member_stats.get(guild.id)
+        if stats is None:
+            stats = self.member_stats[guild.id] = MemberStats(guild.members)
+        return stats
+
+    # Counts every guild once the bot is ready (the loop's first run), then recounts every hour because events
+    # can be missed (reconnects, members being chunked in later). count_members yields while counting big servers
+    @tasks.loop(hours=1)
+    async def reconcile_member_stats(self):
+        for guild in list(self.bot.guilds):
+            self.member_stats[guild.id] = await count_members(guild)
+        for guild_id in list(self.member_stats):
+            if self.bot.get_guild(guild_id) is None:
+                del self.member_stats[guild_id]
+
+    @reconcile_member_stats.before_loop
+    async def before_reconcile(self):
+        await self.bot.wait_until_ready()
+
+    # waitfor
+
+    def add_waiter(self, waiter):
+        self.waiters[waiter.id] = waiter
+        self.waiter_index.setdefault(waiter.key, {})[waiter.id] = waiter
+        if not self.waiter_heap or waiter.expires < self.waiter_heap[0][0]:
+            self.waiter_added.set()
+        heapq.heappush(self.waiter_heap, (waiter.expires, waiter.id))
+
+    async def remove_waiter(self, waiter):
+        """Returns False if the waiter was already removed"""
+        if self.waiters.pop(waiter.id, None) is None:
+            return False
+        bucket = self.waiter_index[waiter.key]
+        del bucket[waiter.id]
+        if not bucket:
+            del self.waiter_index[waiter.key]
+        query = '''DELETE FROM waiters WHERE id = $1;'''
+        await self.bot.pool.execute(query, waiter.id)
+        return True
+
+    async def create_waiter(self, ctx, channel, user):
+        query = '''INSERT INTO waiters(author, channel, target, origin, message, expires)
+                   VALUES($1, $2, $3, $4, $5, $6)
+                   RETURNING *;'''
+        record = await self.bot.pool.fetchrow(query, ctx.author.id, channel.id, getattr(user, 'id', None),
+                                              ctx.channel.id, ctx.message.id, datetime.utcnow() + WAIT_DURATION)
+        self.add_waiter(Waiter(record))
+
+    async def react_to_waiter(self, waiter, emoji):
+        channel = self.bot.get_channel(waiter.origin)
+        if channel is None:
+            return
+        try:
+            message = await channel.fetch_message(waiter.message)
+            await message.add_reaction(emoji)
+        except discord.HTTPException:
+            pass
+
+    async def expire_waiters(self):
+        await self.bot.wait_until_ready()
+        records = await self.bot.pool.fetch('''SELECT * FROM waiters;''')
+        for record in records:
+            self.add_waiter(Waiter(record))
+
+        while not self.bot.is_closed():
+            now = datetime.utcnow()
+            while self.waiter_heap and self.waiter_heap[0][0] <= now:
+                _, waiter_id = heapq.heappop(self.waiter_heap)
+                waiter = self.waiters.get(waiter_id)
+                if waiter is not None and await self.remove_waiter(waiter):
+                    self.bot.loop.create_task(self.react_to_waiter(waiter, '<:redTick:602811779474522113>'))
+
+            timeout = (self.waiter_heap[0][0] - now).total_seconds() if self.waiter_heap else None
+            self.waiter_added.clear()
+            try:
+                await asyncio.wait_for(self.waiter_added.wait(), timeout=timeout)
+            except TimeoutError:
+                pass
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.author.bot or not self.waiters:
+            return
+        found = [*self.waiter_index.get(message.channel.id, {}).values(),
+                 *self.waiter_index.get((message.channel.id, message.author.id), {}).values()]
+        for waiter in found:
+            if waiter.author != message.author.id and await self.remove_waiter(waiter):
+                self.bot.loop.create_task(self.notify_waiter(waiter, message))
+
+    async def notify_waiter(self, waiter, msg):
+        await self.react_to_waiter(waiter, '\U00002705')
+        user = self.bot.get_user(waiter.author)
+        if user is None:
+            return
+        try:
+            e = discord.Embed(title=f'You got a reply at: {msg.guild} | #{msg.channel}',
+                              description=f'{msg.author}: {msg.content}\n'
+                                          f'[Jump to message]({msg.jump_url})',
+                              colour=0x0DF33E,
+                              timestamp=datetime.utcnow())
+            await user.send(embed=e)
+        except discord.Forbidden:
+            pass
+
+    @commands.Cog.listener('on_member_join')
+    async def count_member_join(self, member):
+        stats = self.member_stats.get(member.guild.id)
+        if stats is not None:
+            stats.add(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        stats = self.member_stats.get(member.guild.id)
+        if stats is not None:
+            stats.remove(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.status != after.status:
+            stats = self.member_stats.get(after.guild.id)
+            if stats is not None:
+                stats.update_status(before.status, after.status)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.member_stats[guild.id] = await count_members(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.member_stats.pop(guild.id, None)
 
     # Applies commands.guild_only() check for all methods in this cog
     async def cog_check(self, ctx):
@@ -30,8 +236,8 @@ class GuildCog(commands.Cog, name='Guild'):
     @commands.command(name='members', aliases=['memcount', 'membercount'])
     async def member_count(self, ctx):
         """Returns the member count of the guild"""
-        statuses = Counter(m.status for m in ctx.guild.members)
-        bots = Counter(m.bot for m in ctx.guild.members)
+        stats = self.get_member_stats(ctx.guild)
+        statuses = stats.statuses
         formatted_statuses = f'<:status_online:602811779948740627> {statuses.get(discord.Status.online, 0)}\n' \
                              f'<:status_offline:602811780053336069> {statuses.get(discord.Status.offline, 0)}\n' \
                              f'<:status_idle:602811780129095701> {statuses.get(discord.Status.idle, 0)}\n' \
@@ -40,8 +246,8 @@ class GuildCog(commands.Cog, name='Guild'):
         e = discord.Embed(color=bright_color(), timestamp=datetime.utcnow())
         e.set_author(name=f'{ctx.guild}\'s member count',  icon_url=ctx.guild.icon_url)
         e.add_field(name='Total', value=ctx.guild.member_count)
-        e.add_field(name='Humans', value=bots.get(False, 0))
-        e.add_field(name='Bots', value=bots.get(True, 0))
+        e.add_field(name='Humans', value=stats.humans)
+        e.add_field(name='Bots', value=stats.bots)
         e.add_field(name='Status', value=formatted_statuses)
 
         await ctx.send(embed=e)
@@ -124,35 +330,20 @@ class GuildCog(commands.Cog, name='Guild'):
         `Ex. %waitfor` will wait for a message from anyone in the current channel
         `Ex. %waitfor Bob` will wait for a message from Bob in the current channel
         `Ex. %waitfor #general Bob` will wait for a message from Bob in #general"""
-        await ctx.send(f'Waiting for reply from `{user if user is not None else "anyone"}` in {f"`{channel}`" if channel else "this channel"} for up to 24 hours', delete_after=5)
-        await ctx.message.add_reaction('<a:typing:559157048919457801>')
+        if sum(waiter.author == ctx.author.id for waiter in self.waiters.values()) >= MAX_WAITS_PER_USER:
+            return await ctx.send(f'You can only wait for {MAX_WAITS_PER_USER} replies at once', delete_after=5)
         channel = channel or ctx.channel
-        try:
-            msg = await self.bot.wait_for('message',
-                                          check=lambda m: m.channel == channel
-                                                          and m.author != ctx.author
-                                                          and not m.author.bot
-                                                          and (not user or m.author == user),
-                                          timeout=86400)
-        except TimeoutError:
-            try:
-                await ctx.message.add_reaction('<:redTick:602811779474522113>')
-            except discord.HTTPException:
-                pass
-        else:
-            try:
-                await ctx.message.add_reaction('\U00002705')
-            except discord.HTTPException:
-                pass
-            try:
-                e = discord.Embed(title=f'You got a reply at: {ctx.guild} | #{channel}',
-                                  description=f'{msg.author}: {msg.content}\n'
-                                              f'[Jump to message]({msg.jump_url})',
-                                  colour=0x0DF33E,
-                                  timestamp=datetime.utcnow())
-                await ctx.author.send(embed=e)
-            except discord.Forbidden:
-                pass
+        await self.create_waiter(ctx, channel, user)
+        await ctx.send(f'Waiting for reply from `{user if user is not None else "anyone"}` in {f"`{channel}`" if channel != ctx.channel else "this channel"} for up to 24 hours', delete_after=5)
+        await ctx.message.add_reaction('<a:typing:559157048919457801>')
+
+    @commands.command(name='waiting', hidden=True)
+    async def waiter_count(self, ctx):
+        """Shows how many replies are being waited for"""
+        mine = sum(waiter.author == ctx.author.id for waiter in self.waiters.values())
+        targeted = sum(waiter.target is not None for waiter in self.waiters.values())
+        await ctx.send(f'You are waiting for {mine} repl{"y" if mine == 1 else "ies"}\n'
+                       f'Overall: {len(self.waiters)} waits ({targeted} for a specific user) in {len({w.channel for w in self.waiters.values()})} channels')
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
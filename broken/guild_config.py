@@ -4,6 +4,38 @@ from discord.ext import commands
 import traceback
 
 
+# Named for the Queries cog, see QueryProfiler.py
+STATEMENTS = {
+    'settings.config': '''SELECT * FROM
+                          guild_config g FULL OUTER JOIN guild_mod_config m ON g.id = m.id
+                          WHERE g.id=$1 OR m.id=$1''',
+    'settings.human_role': '''INSERT INTO guild_config(id, human_join_role)
+                              VALUES($1, $2)
+                              ON CONFLICT (id) DO UPDATE
+                              SET human_join_role = $2;''',
+    'settings.bot_role': '''INSERT INTO guild_config(id, bot_join_role)
+                            VALUES($1, $2)
+                            ON CONFLICT (id) DO UPDATE
+                            SET bot_join_role = $2;''',
+    'settings.mute_role': '''INSERT INTO guild_mod_config(id, mute_role)
+                             VALUES($1, $2)
+                             ON CONFLICT (id) DO UPDATE
+                             SET mute_role = $2;''',
+    'settings.join_channel': '''INSERT INTO guild_mod_config(id, join_ch)
+                                VALUES($1, $2)
+                                ON CONFLICT (id) DO UPDATE
+                                SET join_ch = $2;''',
+    'settings.leave_channel': '''INSERT INTO guild_mod_config(id, leave_ch)
+                                 VALUES($1, $2)
+                                 ON CONFLICT (id) DO UPDATE
+                                 SET leave_ch = $2;''',
+    'settings.invite_channel': '''INSERT INTO guild_mod_config(id, invite_ch)
+                                  VALUES($1, $2)
+                                  ON CONFLICT (id) DO UPDATE
+                                  SET invite_ch = $2;''',
+}
+
+
 def get_mention(ctx, record, obj):
     if record.get(obj) is None:
         return
@@ -28,9 +60,7 @@ class GuildConfig(commands.Cog, name='Settings'):
     @commands.group(name='config', invoke_without_command=True, case_insensitive=True)
     async def guild_config(self, ctx):
         """Set server config"""
-        query = '''SELECT * FROM
-                   guild_config g FULL OUTER JOIN guild_mod_config m ON g.id = m.id
-                   WHERE g.id=$1 OR m.id=$1'''
+        query = STATEMENTS['settings.config']
         record = await self.bot.pool.fetchrow(query, ctx.guild.id)
         if record is None:
             record = {}
@@ -68,11 +98,7 @@ class GuildConfig(commands.Cog, name='Settings'):
             role_id = role.id
         else:
             role_id = None
-        query = '''INSERT INTO guild_config(id, human_join_role)
-                   VALUES($1, $2)
-                   ON CONFLICT (id) DO UPDATE 
-                   SET human_join_role = $2; 
-                   '''
+        query = STATEMENTS['settings.human_role']
         try:
             await self.bot.pool.execute(query, ctx.guild.id, role_id)
         except:
@@ -91,11 +117,7 @@ class GuildConfig(commands.Cog, name='Settings'):
             role_id = role.id
         else:
             role_id = None
-        query = '''INSERT INTO guild_config(id, bot_join_role)
-                   VALUES($1, $2)
-                   ON CONFLICT (id) DO UPDATE 
-                   SET bot_join_role = $2; 
-                   '''
+        query = STATEMENTS['settings.bot_role']
         try:
             await self.bot.pool.execute(query, ctx.guild.id, role_id)
         except:
@@ -111,11 +133,7 @@ class GuildConfig(commands.Cog, name='Settings'):
             role_id = role.id
         else:
             role_id = None
-        query = '''INSERT INTO guild_mod_config(id, mute_role)
-                   VALUES($1, $2)
-                   ON CONFLICT (id) DO UPDATE 
-                   SET mute_role = $2; 
-                   '''
+        query = STATEMENTS['settings.mute_role']
         try:
             await self.bot.pool.execute(query, ctx.guild.id, role_id)
         except:
@@ -143,11 +161,7 @@ class GuildConfig(commands.Cog, name='Settings'):
         else:
             channel_id = None
             mention = None
-        query = '''INSERT INTO guild_mod_config(id, join_ch)
-                   VALUES($1, $2)
-                   ON CONFLICT (id) DO UPDATE 
-                   SET join_ch = $2; 
-                   '''
+        query = STATEMENTS['settings.join_channel']
         try:
             await self.bot.pool.execute(query, ctx.guild.id, channel_id)
         except:
@@ -165,11 +179,7 @@ class GuildConfig(commands.Cog, name='Settings'):
         else:
             channel_id = None
             mention = None
-        query = '''INSERT INTO guild_mod_config(id, leave_ch)
-                   VALUES($1, $2)
-                   ON CONFLICT (id) DO UPDATE 
-                   SET leave_ch = $2; 
-                   '''
+        query = STATEMENTS['settings.leave_channel']
         try:
             await self.bot.pool.execute(query, ctx.guild.id, channel_id)
         except:
@@ -187,11 +197,7 @@ class GuildConfig(commands.Cog, name='Settings'):
         else:
             channel_id = None
             mention = None
-        query = '''INSERT INTO guild_mod_config(id, join_ch)
-                   VALUES($1, $2)
-                   ON CONFLICT (id) DO UPDATE 
-                   SET invite_ch = $2; 
-                   '''
+        query = STATEMENTS['settings.invite_channel']
         try:
             await self.bot.pool.execute(query, ctx.guild.id, channel_id)
         except:
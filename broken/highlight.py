@@ -9,6 +9,35 @@ from typing import Union
 from asyncpg import UniqueViolationError
 
 from utils.global_utils import confirm_prompt
+from Startup import startup_task
+
+
+# Named for the Queries cog, see QueryProfiler.py
+STATEMENTS = {
+    'highlights.mentions': '''SELECT * FROM mentions''',
+    'highlights.ignores': '''SELECT * FROM hlignores;''',
+    'highlights.words': '''SELECT word
+                           FROM highlights
+                           WHERE guild = $1
+                           AND "user" = $2;''',
+    'highlights.guild': '''SELECT "user", word
+                           FROM highlights
+                           WHERE guild = $1;''',
+    'highlights.all': '''SELECT guild, "user", word
+                         FROM highlights;''',
+    'highlights.add': '''INSERT INTO highlights(guild, "user", word)
+                         VALUES ($1, $2, $3);''',
+    'highlights.remove': '''DELETE FROM highlights
+                            WHERE guild = $1
+                            AND "user" = $2
+                            AND word = $3''',
+    'highlights.guild_users': '''SELECT DISTINCT "user"
+                                 FROM highlights
+                                 WHERE guild = $1;''',
+    'highlights.mentions_off': '''DELETE FROM mentions
+                                  WHERE "user" = $1''',
+    'highlights.mentions_on': '''INSERT INTO mentions VALUES($1)''',
+}
 
 
 class HighlightCog(commands.Cog, name='Highlights'):
@@ -16,15 +45,15 @@ class HighlightCog(commands.Cog, name='Highlights'):
     def __init__(self, bot):
         self.bot = bot
         self.highlights = {}
-        self.bot.loop.create_task(self.populate_cache())
-        self.bot.loop.create_task(self.get_data())
+        startup_task(bot, self.populate_cache())
+        startup_task(bot, self.get_data())
 
     async def get_data(self):
-        mention_query = '''SELECT * FROM mentions'''
+        mention_query = STATEMENTS['highlights.mentions']
         records = await self.bot.pool.fetch(mention_query)
         self.mentions = [record['user'] for record in records]
 
-        ignore_query = '''SELECT * FROM hlignores;'''
+        ignore_query = STATEMENTS['highlights.ignores']
         records = await self.bot.pool.fetch(ignore_query)
         collect_ignores = {}
         for record in records:
@@ -40,10 +69,7 @@ class HighlightCog(commands.Cog, name='Highlights'):
         return re.compile(r'\b(?:' + '|'.join(map(re.escape, words)) + r')s?\b', re.IGNORECASE)
 
     async def update_regex(self, ctx, guild_id=None):
-        query = '''SELECT word
-                   FROM highlights
-                   WHERE guild = $1
-                   AND "user" = $2;'''
+        query = STATEMENTS['highlights.words']
         gid = guild_id or ctx.guild.id
         records = await self.bot.pool.fetch(query, gid, ctx.author.id,)
         words = [record['word'] for record in records]
@@ -66,14 +92,14 @@ class HighlightCog(commands.Cog, name='Highlights'):
 
     async def populate_cache(self):
         await self.bot.wait_until_ready()
+        # One query for every guild instead of one per guild
+        by_guild = {}
+        for record in await self.bot.pool.fetch(STATEMENTS['highlights.all']):
+            by_guild.setdefault(record['guild'], []).append(record)
         for guild in self.bot.guilds:
-            query = '''SELECT "user", word
-                       FROM highlights
-                       WHERE guild = $1;'''
-            records = await self.bot.pool.fetch(query, guild.id)
-            if not records:
-                continue
-            self.highlights[guild.id] = self.create_guild_regex(records)
+            records = by_guild.get(guild.id)
+            if records:
+                self.highlights[guild.id] = self.create_guild_regex(records)
 
     def ignore_check(self, msg, id):
         if msg.author.id == id:
@@ -234,8 +260,7 @@ class HighlightCog(commands.Cog, name='Highlights'):
             await ctx.message.add_reaction('<:redTick:602811779474522113>')
             return await ctx.send('Keywords must be at least 3 characters!')
         try:
-            add_query = '''INSERT INTO highlights(guild, "user", word)
-                           VALUES ($1, $2, $3);'''
+            add_query = STATEMENTS['highlights.add']
             await self.bot.pool.execute(add_query, guild.id, ctx.author.id, keyword)
         except UniqueViolationError:
             await ctx.message.add_reaction('<:redTick:602811779474522113>')
@@ -257,10 +282,7 @@ class HighlightCog(commands.Cog, name='Highlights'):
             delete_after = None
 
         key = keyword.lower()
-        remove_query = '''DELETE FROM highlights
-                          WHERE guild = $1
-                          AND "user" = $2
-                          AND word = $3'''
+        remove_query = STATEMENTS['highlights.remove']
         result = await self.bot.pool.execute(remove_query, guild.id, ctx.author.id, keyword)
         if result == 'DELETE 0':
             await ctx.message.add_reaction('<:redTick:602811779474522113>')
@@ -268,9 +290,7 @@ class HighlightCog(commands.Cog, name='Highlights'):
 
         else:
             await self.update_regex(ctx, guild.id)
-            query = '''SELECT DISTINCT "user" 
-                       FROM highlights
-                       WHERE guild = $1;'''
+            query = STATEMENTS['highlights.guild_users']
             records = await self.bot.pool.fetch(query, guild.id)
 
             guild_records = [record['user'] for record in records]
@@ -289,14 +309,10 @@ class HighlightCog(commands.Cog, name='Highlights'):
         if g is None:
             g = discord.utils.get(self.bot.guilds, name=str(guild))
         if g is not None:
-            query = '''SELECT word
-                       FROM highlights
-                       WHERE guild = $1
-                       AND "user" = $2;'''
+            query = STATEMENTS['highlights.words']
             records = await self.bot.pool.fetch(query, g.id, ctx.author.id)
             words = [(ctx.guild.id, ctx.author.id, record["word"]) for record in records]
-            insert = '''INSERT INTO highlights(guild, "user", word)
-                        VALUES ($1, $2, $3);'''
+            insert = STATEMENTS['highlights.add']
             await self.bot.pool.executemany(insert, words)
             await self.update_regex(ctx)
             await ctx.message.add_reaction('\U00002705')  # React with checkmark
@@ -358,12 +374,11 @@ class HighlightCog(commands.Cog, name='Highlights'):
         else:
             delete_after = None
 
-        query = '''DELETE FROM mentions
-                    WHERE "user" = $1'''
+        query = STATEMENTS['highlights.mentions_off']
 
         deleted = await self.bot.pool.execute(query, ctx.author.id)
         if deleted == 'DELETE 0':
-            toggle = '''INSERT INTO mentions VALUES($1)'''
+            toggle = STATEMENTS['highlights.mentions_on']
             await ctx.send('You will now get a DM when I see you mentioned', delete_after=delete_after)
             await ctx.message.add_reaction('\U00002795')  # React with plus sign
             await self.bot.pool.execute(toggle, ctx.author.id)
@@ -3,8 +3,24 @@ from discord.ext import commands
 
 import aiohttp
 import io
+import os
+import re
+import sys
+import shutil
+import asyncio
+import hashlib
+import tempfile
+from collections import OrderedDict
 
 TEX_API = 'http://rtex.probablyaweb.site/api/v2'
+# Rendered PNGs, named by the hash of the document. Kept in the user's cache dir unless LATEX_CACHE_DIR is set
+CACHE_DIR = os.environ.get('LATEX_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'botcogs', 'latex')
+MAX_CACHED = 5000
+# Local rendering, only used when the API can't be reached and latex + dvipng are installed
+LOCAL_WORKERS = 2
+LOCAL_TIMEOUT = 15
+LOCAL_MEMORY_LIMIT = 512 * 1024 * 1024
 TEMPLATE = r'''
 \documentclass{article}
 
@@ -36,9 +52,121 @@ class TexRenderError(commands.CommandError):
         self.logs = logs
 
 
+def normalise(document):
+    """Whitespace that doesn't change the output is dropped so trivially different inputs share a render"""
+    lines = [re.sub(r'[ \t]+', ' ', line).strip() for line in document.strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+def document_key(document):
+    return hashlib.sha256(normalise(document).encode()).hexdigest()
+
+
+class RenderCache:
+    """PNGs on disk with an LRU index in memory. Only the index is kept in memory, reads go to disk"""
+
+    def __init__(self, directory, max_size=MAX_CACHED):
+        self.directory = directory
+        self.max_size = max_size
+        self.index = OrderedDict()  # key: None, least recently used first
+        os.makedirs(directory, exist_ok=True)
+        files = (entry for entry in os.scandir(directory) if entry.name.endswith('.png'))
+        for entry in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.index[entry.name[:-4]] = None
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get(self, key):
+        if key not in self.index:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            del self.index[key]
+            return None
+        self.index.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        # Written under a temporary name so a half written file is never served
+        temp = self.path(key) + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, self.path(key))
+        self.index[key] = None
+        self.index.move_to_end(key)
+        while len(self.index) > self.max_size:
+            old, _ = self.index.popitem(last=False)
+            try:
+                os.remove(self.path(old))
+            except OSError:
+                pass
+
+
+def limit_resources():
+    """Runs in the latex child process before it starts"""
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (LOCAL_TIMEOUT, LOCAL_TIMEOUT))
+    resource.setrlimit(resource.RLIMIT_AS, (LOCAL_MEMORY_LIMIT, LOCAL_MEMORY_LIMIT))
+
+
+class LocalRenderer:
+    """Renders with a local TeX install, at most LOCAL_WORKERS at a time.
+    Each render runs in its own temporary directory with shell escape off, file access limited to
+    that directory (paranoid openin/openout), CPU and memory limits and a hard timeout"""
+
+    def __init__(self, workers=LOCAL_WORKERS):
+        self.latex = shutil.which('latex')
+        self.dvipng = shutil.which('dvipng')
+        self.workers = asyncio.Semaphore(workers)
+
+    @property
+    def available(self):
+        return self.latex is not None and self.dvipng is not None
+
+    async def run(self, *args, cwd):
+        env = dict(os.environ, openin_any='p', openout_any='p', shell_escape='f')
+        process = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=env,
+                                                       stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.DEVNULL,
+                                                       preexec_fn=limit_resources if sys.platform != 'win32' else None)
+        try:
+            return await asyncio.wait_for(process.wait(), timeout=LOCAL_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise TexRenderError('! Rendering took too long.\n!')
+
+    async def render(self, document):
+        async with self.workers:
+            with tempfile.TemporaryDirectory(prefix='latex-') as directory:
+                with open(os.path.join(directory, 'input.tex'), 'w', encoding='utf-8') as f:
+                    f.write(document)
+                code = await self.run(self.latex, '-no-shell-escape', '-interaction=nonstopmode', '-halt-on-error',
+                                      'input.tex', cwd=directory)
+                if code != 0:
+                    try:
+                        with open(os.path.join(directory, 'input.log'), encoding='utf-8', errors='replace') as f:
+                            raise TexRenderError(f.read())
+                    except OSError:
+                        raise TexRenderError(None)
+                await self.run(self.dvipng, '-q', '-T', 'tight', '-D', '300', '-o', 'output.png', 'input.dvi', cwd=directory)
+                try:
+                    with open(os.path.join(directory, 'output.png'), 'rb') as f:
+                        return f.read()
+                except OSError:
+                    raise TexRenderError(None)
+
+
 class LatexCog(commands.Cog, name='Misc.'):
     def __init__(self, bot):
         self.bot = bot
+        self.cache = RenderCache(CACHE_DIR)
+        self.local = LocalRenderer()
+        self.rendering = {}  # key: task, so identical renders running at the same time share one
 
     @commands.command(aliases=['tex'])
     async def latex(self, ctx, *, latex):
@@ -48,23 +176,47 @@ class LatexCog(commands.Cog, name='Misc.'):
         await self.render(ctx, to_render)
 
     async def render(self, ctx, latex):
+        data = await self.get_png(latex)
+        await ctx.send(file=discord.File(io.BytesIO(data), 'latex.png'))
+
+    async def get_png(self, document):
+        key = document_key(document)
+        data = await self.bot.loop.run_in_executor(None, self.cache.get, key)
+        if data is not None:
+            return data
+        task = self.rendering.get(key)
+        if task is None:
+            task = self.rendering[key] = self.bot.loop.create_task(self.render_and_store(key, document))
+            task.add_done_callback(lambda _: self.rendering.pop(key, None))
+        # Shielded so one caller giving up doesn't cancel the render for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def render_and_store(self, key, document):
         try:
-            payload = {'code': latex, 'format': 'png'}
-            async with self.bot.session.post(TEX_API, data=payload) as r:
-                r.raise_for_status()
-                jdata = await r.json()
-                if jdata['status'] != 'success':
-                    raise TexRenderError(jdata.get('log'))
-                file_url = TEX_API + '/' + jdata['filename']
-
-            async with self.bot.session.get(file_url) as fr:
-                fr.raise_for_status()
-                data = io.BytesIO(await fr.read())
-                await ctx.send(file=discord.File(data, 'latex.png'))
-
-        except aiohttp.client_exceptions.ClientResponseError:
-            raise TexRenderError(None)
-
+            data = await self.render_remote(document)
+        except (aiohttp.ClientConnectionError, aiohttp.ServerTimeoutError, asyncio.TimeoutError):
+            if not self.local.available:
+                raise TexRenderError(None)
+            data = await self.local.render(document)
+        except aiohttp.ClientResponseError as e:
+            if e.status < 500 or not self.local.available:
+                raise TexRenderError(None)
+            data = await self.local.render(document)
+        await self.bot.loop.run_in_executor(None, self.cache.put, key, data)
+        return data
+
+    async def render_remote(self, latex):
+        payload = {'code': latex, 'format': 'png'}
+        async with self.bot.session.post(TEX_API, data=payload) as r:
+            r.raise_for_status()
+            jdata = await r.json()
+            if jdata['status'] != 'success':
+                raise TexRenderError(jdata.get('log'))
+            file_url = TEX_API + '/' + jdata['filename']
+
+        async with self.bot.session.get(file_url) as fr:
+            fr.raise_for_status()
+            return await fr.read()
 
 def setup(bot):
     bot.add_cog(LatexCog(bot))
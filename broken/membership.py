@@ -0,0 +1,97 @@
+from discord.ext import commands
+
+import asyncio
+from array import array
+from bisect import bisect_left
+
+
+class MembershipCog(commands.Cog, name='Membership'):
+    """Keeps a user id -> guild ids index so shared guilds don't need a get_member on every guild.
+    Most users share a single guild with the bot, those are stored as a plain int,
+    everyone else gets a sorted array of guild ids"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.guilds_of = {}  # user id: guild id or array('Q') of guild ids
+        self.built = False
+        bot.loop.create_task(self.build())
+
+    async def build(self):
+        await self.bot.wait_until_ready()
+        self.guilds_of = {}
+        for guild in self.bot.guilds:
+            self.add_guild(guild)
+            await asyncio.sleep(0)
+        self.built = True
+
+    def add(self, user_id, guild_id):
+        current = self.guilds_of.get(user_id)
+        if current is None:
+            self.guilds_of[user_id] = guild_id
+        elif isinstance(current, int):
+            if current != guild_id:
+                self.guilds_of[user_id] = array('Q', sorted((current, guild_id)))
+        else:
+            i = bisect_left(current, guild_id)
+            if i == len(current) or current[i] != guild_id:
+                current.insert(i, guild_id)
+
+    def remove(self, user_id, guild_id):
+        current = self.guilds_of.get(user_id)
+        if current is None:
+            return
+        if isinstance(current, int):
+            if current == guild_id:
+                del self.guilds_of[user_id]
+            return
+        i = bisect_left(current, guild_id)
+        if i < len(current) and current[i] == guild_id:
+            del current[i]
+            if len(current) == 1:
+                self.guilds_of[user_id] = current[0]
+
+    def add_guild(self, guild):
+        for member in guild.members:
+            self.add(member.id, guild.id)
+
+    def remove_guild(self, guild):
+        for member in guild.members:
+            self.remove(member.id, guild.id)
+
+    def guild_ids(self, user_id):
+        """Ids of the guilds the user shares with the bot"""
+        if not self.built:
+            return [guild.id for guild in self.bot.guilds if guild.get_member(user_id) is not None]
+        current = self.guilds_of.get(user_id)
+        if current is None:
+            return []
+        if isinstance(current, int):
+            return [current]
+        return current.tolist()
+
+    def shared_guilds(self, user_id):
+        """Guilds the user shares with the bot"""
+        return [guild for guild in map(self.bot.get_guild, self.guild_ids(user_id)) if guild is not None]
+
+    def shared_count(self, user_id):
+        return len(self.guild_ids(user_id))
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        self.add(member.id, member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.remove(member.id, member.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.add_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.remove_guild(guild)
+
+
+def setup(bot):
+    bot.add_cog(MembershipCog(bot))
@@ -74,10 +74,14 @@ class meta(commands.Cog, name='Meta'):
     async def shared_guilds(self, ctx, member: discord.Member):
         """Returns the number of guilds a member shares with the bot"""
         member = member or ctx.author
-        count = 0
-        for guild in self.bot.guilds:
-            if guild.get_member(member.id):
-                count += 1
+        membership = self.bot.get_cog('Membership')
+        if membership is not None:
+            count = membership.shared_count(member.id)
+        else:
+            count = 0
+            for guild in self.bot.guilds:
+                if guild.get_member(member.id):
+                    count += 1
         await ctx.send(f'I share {count} server{"s" if count > 1 else ""} with {member}')
 
     # Credits to Danny:
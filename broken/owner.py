@@ -5,7 +5,6 @@ import io
 import asyncio
 import datetime
 import textwrap
-import tabulate
 import traceback
 from collections import Counter
 from typing import Optional, Union
@@ -220,6 +219,7 @@ class OwnerCog(commands.Cog, name='Owner'):
             return await ctx.send(f'```\n{results}```')
         headers = list(results[0].keys())
         values = [list(map(repr, v)) for v in results]
+        import tabulate
         table = tabulate.tabulate(values, tablefmt='psql', headers=headers)
         if len(table) > 1000:
             url = await upload_hastebin(ctx, table)
@@ -239,10 +239,14 @@ class OwnerCog(commands.Cog, name='Owner'):
 
     @commands.command(name='guilds')
     async def get_shared_guilds(self, ctx, user: discord.User):
-        shared = []
-        for guild in self.bot.guilds:
-            if guild.get_member(user.id) is not None:
-                shared.append(guild)
+        membership = self.bot.get_cog('Membership')
+        if membership is not None:
+            shared = membership.shared_guilds(user.id)
+        else:
+            shared = []
+            for guild in self.bot.guilds:
+                if guild.get_member(user.id) is not None:
+                    shared.append(guild)
         fmt = "\n".join([f"{guild.name} - {guild.id}" for guild in shared])
         await ctx.send(f'```\nShared guilds with {user}\n{fmt}\n```')
 
@@ -257,7 +261,11 @@ class OwnerCog(commands.Cog, name='Owner'):
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
-        bots = sum([1 for m in guild.members if m.bot])
+        guild_cog = self.bot.get_cog('Guild')
+        if guild_cog is not None:
+            bots = guild_cog.get_member_stats(guild).bots
+        else:
+            bots = sum([1 for m in guild.members if m.bot])
         bot_ratio = (bots / guild.member_count) * 100
         if guild.member_count > 25 and bot_ratio > 70:
             try:
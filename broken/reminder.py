@@ -1,5 +1,5 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 import asyncio
 import traceback
@@ -8,6 +8,26 @@ from textwrap import shorten
 
 from utils.time import UserFriendlyTime, human_timedelta
 from utils.global_utils import get_user_timezone
+from .scheduler import job, schedule_jobs, unschedule_jobs
+
+
+# Named for the Queries cog, see QueryProfiler.py
+STATEMENTS = {
+    'reminders.next': '''SELECT * FROM reminders WHERE "end" <  (CURRENT_DATE + $1::interval) ORDER BY "end" LIMIT 1;''',
+    'reminders.delete': '''DELETE FROM reminders WHERE id=$1;''',
+    'reminders.create': '''INSERT INTO reminders (start, "end", "user", channel, message, content, event)
+                           VALUES ($1, $2, $3, $4, $5, $6, $7);''',
+    'reminders.list': '''SELECT id, "end", content
+                         FROM reminders
+                         WHERE event = 'reminder'
+                         AND "user" = $1
+                         ORDER BY "end" ASC
+                         LIMIT 10;''',
+    'reminders.cancel': '''DELETE FROM reminders
+                           WHERE id = $1
+                           AND "user" = $2
+                           AND event = 'reminder';''',
+}
 
 
 class ReminderCog(commands.Cog, name='Reminders'):
@@ -15,20 +35,22 @@ class ReminderCog(commands.Cog, name='Reminders'):
     def __init__(self, bot):
         self.bot = bot
         self.have_timer = asyncio.Event()
+        # Check for timers on startup, the weekly check only runs a week in
+        self.have_timer.set()
         self.current_timer = None
-        self.weekly_check.start()
+        schedule_jobs(self)
         self.task = bot.loop.create_task(self.timer_task())
 
     def cog_unload(self):
         self.task.cancel()
-        self.weekly_check.cancel()
+        unschedule_jobs(self)
 
     async def get_timer(self):
-        query = 'SELECT * FROM reminders WHERE "end" <  (CURRENT_DATE + $1::interval) ORDER BY "end" LIMIT 1;'
+        query = STATEMENTS['reminders.next']
         return await self.bot.pool.fetchrow(query, datetime.timedelta(days=7))
 
     async def run_timer(self, timer):
-        query = 'DELETE FROM reminders WHERE id=$1;'
+        query = STATEMENTS['reminders.delete']
         await self.bot.pool.execute(query, timer['id'])
 
         self.bot.dispatch(f'{timer["event"]}_complete', timer)
@@ -81,8 +103,7 @@ class ReminderCog(commands.Cog, name='Reminders'):
         if delta <= 60:
             self.bot.loop.create_task(self.short_timer(delta, user.id, channel_id, message_id, content, event))
             return
-        query = """INSERT INTO reminders (start, "end", "user", channel, message, content, event)
-                   VALUES ($1, $2, $3, $4, $5, $6, $7);"""
+        query = STATEMENTS['reminders.create']
         await self.bot.pool.execute(query, now, end, user.id, channel_id, message_id, content, event)
         if delta <= (86400 * 40):  # 40 days
             self.have_timer.set()
@@ -174,12 +195,7 @@ class ReminderCog(commands.Cog, name='Reminders'):
     async def list_reminders(self, ctx):
         """Lists your 10 upcoming reminders
         NOTE: This does not include reminders shorter than 1 minute total"""
-        query = '''SELECT id, "end", content
-                   FROM reminders
-                   WHERE event = 'reminder'
-                   AND "user" = $1
-                   ORDER BY "end" ASC
-                   LIMIT 10;'''
+        query = STATEMENTS['reminders.list']
 
         reminders = await self.bot.pool.fetch(query, ctx.author.id)
         if not reminders:
@@ -203,10 +219,7 @@ class ReminderCog(commands.Cog, name='Reminders'):
     async def cancel_reminder(self, ctx, id: int):
         """Cancels a reminder by ID
         See `%remind list` to get IDs"""
-        query = '''DELETE FROM reminders
-                   WHERE id = $1
-                   AND "user" = $2 
-                   AND event = 'reminder';'''
+        query = STATEMENTS['reminders.cancel']
         result = await self.bot.pool.execute(query, id, ctx.author.id)
 
         if result == 'DELETE 0':
@@ -220,9 +233,9 @@ class ReminderCog(commands.Cog, name='Reminders'):
         await ctx.send(f'Deleted reminder {id}')
 
     # Force a data check once a week
-    # Checks every 6day 23hr 45min
+    # Checks every 6day 23hr 45min, the Scheduler keeps this interval across restarts
     # In case there is a timer coming up next week and no new timers triggered a check
-    @tasks.loop(hours=167.75)
+    @job('reminders.weekly_check', every=167.75 * 3600)
     async def weekly_check(self):
         self.have_timer.set()
 
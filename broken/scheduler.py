@@ -0,0 +1,241 @@
+from discord.ext import commands
+
+import time
+import heapq
+import asyncio
+import datetime
+import itertools
+
+# Longest single sleep, so the wakeup is recalculated against the clock at least this often
+MAX_SLEEP = 60
+
+
+def job(name, *, every=None, at=None, enabled=True):
+    """Marks a cog method as a recurring job for the Scheduler cog.
+    `every` is a number of seconds between runs, `at` is a function that takes the current (naive UTC) datetime
+    and returns the next time the job should run. The cog has to call `schedule_jobs(self)` in its __init__
+
+    Runs of an `every` job are kept on their original interval, a run missed while the bot was down happens once
+    on startup. `at` jobs are wall clock jobs, missed runs are skipped"""
+    if (every is None) == (at is None):
+        raise TypeError('A job needs exactly one of every or at')
+
+    def decorator(func):
+        func.__scheduled_job__ = {'name': name, 'every': every, 'at': at, 'enabled': enabled}
+        return func
+    return decorator
+
+
+def schedule_jobs(cog):
+    """Registers the cog's @job methods. If the Scheduler isn't loaded yet it picks them up when it is"""
+    scheduler = cog.bot.get_cog('Scheduler')
+    if scheduler is not None:
+        scheduler.add_cog_jobs(cog)
+
+
+def unschedule_jobs(cog):
+    scheduler = cog.bot.get_cog('Scheduler')
+    if scheduler is not None:
+        scheduler.remove_cog_jobs(cog)
+
+
+class Job:
+    __slots__ = ('name', 'callback', 'every', 'at', 'enabled', 'next_run', 'generation', 'task',
+                 'runs', 'failures', 'skipped', 'time', 'max_time', 'lateness', 'max_lateness', 'last_run')
+
+    def __init__(self, name, callback, every=None, at=None, enabled=True):
+        self.name = name
+        self.callback = callback
+        self.every = every
+        self.at = at
+        self.enabled = enabled
+        self.next_run = None
+        self.generation = 0  # bumped whenever the job is rescheduled, older heap entries are then ignored
+        self.task = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0  # fires skipped because the previous run was still going
+        self.time = 0
+        self.max_time = 0
+        self.lateness = 0  # how late the last run started, in seconds
+        self.max_lateness = 0
+        self.last_run = None
+
+    def following(self, now):
+        """The run after the current one"""
+        if self.at is not None:
+            return self.at(now)
+        interval = datetime.timedelta(seconds=self.every)
+        if self.next_run is None:
+            return now + interval
+        # Stay on the original interval instead of drifting by however late this run was
+        following = self.next_run + interval
+        if following <= now:
+            following += interval * ((now - following) // interval + 1)
+        return following
+
+
+class Scheduler(commands.Cog, name='Scheduler'):
+    """Runs every recurring job from a single timer heap.
+    Next run times and whether a job is enabled are kept in the scheduled_jobs table"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.jobs = {}  # name: Job
+        self.heap = []  # (next run, sequence, generation, Job)
+        self.sequence = itertools.count()
+        self.changed = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.runner = bot.loop.create_task(self.run())
+        for cog in list(bot.cogs.values()):
+            self.add_cog_jobs(cog)
+
+    def cog_unload(self):
+        self.runner.cancel()
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+
+    async def cog_check(self, ctx):
+        if not await ctx.bot.is_owner(ctx.author):
+            raise commands.NotOwner('Only my owner can use this command.')
+        return True
+
+    def add_cog_jobs(self, cog):
+        for attr in dir(type(cog)):
+            spec = getattr(getattr(type(cog), attr, None), '__scheduled_job__', None)
+            if spec is not None and spec['name'] not in self.jobs:
+                self.add_job(Job(spec['name'], getattr(cog, attr), spec['every'], spec['at'], spec['enabled']))
+
+    def remove_cog_jobs(self, cog):
+        for job in list(self.jobs.values()):
+            if getattr(job.callback, '__self__', None) is cog:
+                self.remove_job(job.name)
+
+    def add_job(self, job):
+        self.jobs[job.name] = job
+        self.bot.loop.create_task(self.restore(job))
+
+    def remove_job(self, name):
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.generation += 1
+            if job.task is not None:
+                job.task.cancel()
+
+    async def restore(self, job):
+        await self.ready.wait()
+        query = '''SELECT next_run, enabled FROM scheduled_jobs WHERE name = $1'''
+        record = await self.bot.pool.fetchrow(query, job.name)
+        now = datetime.datetime.utcnow()
+        if record is not None:
+            job.enabled = record['enabled']
+            if job.every is not None and record['next_run'] is not None:
+                # Overdue runs happen right away, once
+                job.next_run = max(record['next_run'], now)
+        if job.next_run is None:
+            job.next_run = job.following(now)
+        if self.jobs.get(job.name) is job:
+            self.push(job)
+            await self.save(job)
+
+    async def save(self, job):
+        query = '''INSERT INTO scheduled_jobs (name, next_run, enabled)
+                   VALUES ($1, $2, $3)
+                   ON CONFLICT (name) DO UPDATE
+                   SET next_run = EXCLUDED.next_run, enabled = EXCLUDED.enabled;'''
+        await self.bot.pool.execute(query, job.name, job.next_run, job.enabled)
+
+    def push(self, job):
+        job.generation += 1
+        heapq.heappush(self.heap, (job.next_run, next(self.sequence), job.generation, job))
+        self.changed.set()
+
+    async def set_enabled(self, name, enabled):
+        job = self.jobs[name]
+        job.enabled = enabled
+        if enabled and job.next_run is not None:
+            if job.next_run < datetime.datetime.utcnow():
+                job.next_run = job.following(datetime.datetime.utcnow())
+            self.push(job)
+        await self.save(job)
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        self.ready.set()
+        while not self.bot.is_closed():
+            # Drop entries for jobs that were rescheduled, disabled or removed since they were pushed
+            while self.heap and (self.heap[0][2] != self.heap[0][3].generation or not self.heap[0][3].enabled
+                                 or self.jobs.get(self.heap[0][3].name) is not self.heap[0][3]):
+                heapq.heappop(self.heap)
+
+            self.changed.clear()
+            if not self.heap:
+                await self.changed.wait()
+                continue
+
+            when = self.heap[0][0]
+            delay = (when - datetime.datetime.utcnow()).total_seconds()
+            if delay > 0:
+                # Woken early by a change to the heap, or to recheck the clock on long sleeps
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, _, job = heapq.heappop(self.heap)
+            self.fire(job, when)
+
+    def fire(self, job, when):
+        now = datetime.datetime.utcnow()
+        if job.task is not None and not job.task.done():
+            job.skipped += 1
+        else:
+            job.lateness = (now - when).total_seconds()
+            job.max_lateness = max(job.max_lateness, job.lateness)
+            job.task = self.bot.loop.create_task(self.run_job(job))
+        job.next_run = job.following(now)
+        self.push(job)
+        self.bot.loop.create_task(self.save(job))
+
+    async def run_job(self, job):
+        start = time.perf_counter()
+        job.last_run = datetime.datetime.utcnow()
+        try:
+            await job.callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            job.failures += 1
+            await self.bot.on_error(f'job {job.name}')
+        finally:
+            elapsed = time.perf_counter() - start
+            job.runs += 1
+            job.time += elapsed
+            job.max_time = max(job.max_time, elapsed)
+
+    @commands.command(name='jobs', hidden=True)
+    async def jobs_(self, ctx):
+        """Shows every scheduled job, when it runs next and how its runs went"""
+        if not self.jobs:
+            return await ctx.send('No jobs scheduled')
+        now = datetime.datetime.utcnow()
+        paginator = commands.Paginator(prefix='```', suffix='```')
+        paginator.add_line(f'{"Job":<28}{"Next in":>10}{"Runs":>7}{"Fail":>6}{"Skip":>6}{"Avg ms":>9}{"Late ms":>9}')
+        for job in sorted(self.jobs.values(), key=lambda j: j.next_run or now):
+            if not job.enabled:
+                next_in = 'off'
+            elif job.next_run is None:
+                next_in = '-'
+            else:
+                next_in = f'{max(0, (job.next_run - now).total_seconds()) / 60:.0f}m'
+            avg = f'{job.time / job.runs * 1000:.1f}' if job.runs else '-'
+            paginator.add_line(f'{job.name[:27]:<28}{next_in:>10}{job.runs:>7}{job.failures:>6}{job.skipped:>6}'
+                               f'{avg:>9}{job.max_lateness * 1000:>9.0f}')
+        for page in paginator.pages:
+            await ctx.send(page)
+
+
+def setup(bot):
+    bot.add_cog(Scheduler(bot))
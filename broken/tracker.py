@@ -4,34 +4,29 @@ from io import BytesIO
 from discord.ext import commands
 from datetime import datetime
 from asyncpg import UniqueViolationError
+from Startup import startup_task
 
 
 class TrackerCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.bot.loop.create_task(self.add_join_dates())
-        self.bot.loop.create_task(self.add_avatar())
-        self.bot.loop.create_task(self.add_names())
+        startup_task(bot, self.add_join_dates())
+        startup_task(bot, self.add_avatar())
+        startup_task(bot, self.add_names())
 
     async def add_join_dates(self):
         await self.bot.wait_until_ready()
         query = '''SELECT guild, "user" FROM first_join'''
         records = await self.bot.pool.fetch(query)
         data = {(record['guild'], record['user']) for record in records}
-        new = 0
-        for guild in self.bot.guilds:
-            for member in guild.members:
-                if (guild.id, member.id) not in data:
-                    query = '''INSERT INTO first_join(guild, "user", time)
-                           VALUES($1, $2, $3);'''
-                    join_time = member.joined_at or datetime.utcnow()
-                    try:
-                        await self.bot.pool.execute(query, member.guild.id, member.id, join_time)
-                    except Exception:
-                        traceback.print_exc()
-                    else:
-                        new += 1
-        print(f'Added {new} new members\' join date')
+        # One round trip for every missing member instead of one each
+        new = [(guild.id, member.id, member.joined_at or datetime.utcnow())
+               for guild in self.bot.guilds for member in guild.members if (guild.id, member.id) not in data]
+        query = '''INSERT INTO first_join(guild, "user", time)
+                   VALUES($1, $2, $3)
+                   ON CONFLICT DO NOTHING;'''
+        await self.bot.pool.executemany(query, new)
+        print(f'Added {len(new)} new members\' join date')
 
     async def add_avatar(self):
         await self.bot.wait_until_ready()
@@ -50,12 +45,12 @@ class TrackerCog(commands.Cog):
         query = '''SELECT DISTINCT id FROM name_changes'''
         records = await self.bot.pool.fetch(query)
         data = {record['id'] for record in records}
-        new = 0
-        for user in self.bot.users:
-            if user.id not in data:
-                await self.log_username(user)
-                new += 1
-        print(f'Added {new} users\' names')
+        now = datetime.utcnow()
+        new = [(user.id, user.name, user.discriminator, now) for user in self.bot.users if user.id not in data]
+        query = '''INSERT INTO name_changes(id, name, discrim, changed_at)
+                   VALUES($1, $2, $3, $4);'''
+        await self.bot.pool.executemany(query, new)
+        print(f'Added {len(new)} users\' names')
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
@@ -117,13 +112,12 @@ class TrackerCog(commands.Cog):
             type = 'gif' if hash.startswith('a_') else 'png'
             file = discord.File(BytesIO(await user.avatar_url_as(static_format='png').read()),
                                 filename=f'{hash}.{type}')
-            wh = discord.utils.get(await self.bot.get_guild(557306479191916555).webhooks(),
-                                   channel_id=703171905435467956)
-            if wh is not None:
-                msg = await wh.send(content=user.id, file=file, wait=True, username=hash)
+            channel = self.bot.get_channel(703171905435467956)
+            webhooks = self.bot.get_cog('Webhooks')
+            if webhooks is not None:
+                msg = await webhooks.send(channel, content=user.id, file=file, wait=True, username=hash)
             else:
-                self.bot.get_channel(703171905435467956)
-                msg = await self.bot.get_channel(703171905435467956).send(content=user.id, file=file)
+                msg = await channel.send(content=user.id, file=file)
             url = msg.attachments[0].url
             message_id = msg.id
         else:
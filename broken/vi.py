@@ -1,20 +1,77 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
+import re
 import humanize
-from datetime import datetime
+from typing import Optional
+from collections import deque
+from itertools import chain
+from datetime import datetime, timedelta
+from Startup import startup_task, migrate_once
 
 GUILD_ID = 567520394215686144
 FLOATER_ROLE_ID = 567539820545572865
 
+# Sessions kept in memory for each tracked channel, older ones are only in the database
+HISTORY_PER_CHANNEL = 200
+MAX_TRACKED_PER_GUILD = 10
+# Finished sessions waiting to be written, anything past this is dropped if the database is unreachable for long
+MAX_PENDING = 5000
+# The voice channels this cog watched before tracking was configurable. Added once, untracking them later sticks
+LEGACY_TRACKED = '''INSERT INTO voice_tracked (channel_id, guild_id)
+                    VALUES (658169579452760099, 567520394215686144), (631344051442155520, 567520394215686144)
+                    ON CONFLICT (channel_id) DO NOTHING;'''
+
+
+class Ago(commands.Converter):
+    """A time in the past, given as how long ago it was. Ex. 90m, 2h, 1d12h or now"""
+    async def convert(self, ctx, argument):
+        if argument.lower() == 'now':
+            return datetime.utcnow()
+        match = re.fullmatch(r'(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?', argument.lower())
+        if match is None or not any(match.groups()):
+            raise commands.BadArgument(f'Could not understand "{argument}", try something like 90m, 2h or 1d12h')
+        days, hours, minutes = (int(group or 0) for group in match.groups())
+        return datetime.utcnow() - timedelta(days=days, hours=hours, minutes=minutes)
+
+
+class VoiceHistory:
+    """Join/leave sessions of one voice channel"""
+    __slots__ = ('guild_id', 'sessions', 'connected', 'last_join')
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.sessions = deque(maxlen=HISTORY_PER_CHANNEL)  # (user id, joined at, left at), in the order they left
+        self.connected = {}  # user id: joined at, None if they were already there when tracking started
+        self.last_join = None  # (user id, joined at)
+
 
 class ViCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.vc_history = {658169579452760099: {'join': None,
-                                                'leave': None},
-                           631344051442155520: {'join': None,
-                                                'leave': None}}
+        self.tracked = {}  # voice channel id: VoiceHistory
+        self.pending = deque(maxlen=MAX_PENDING)  # (guild id, channel id, user id, joined at, left at)
+        startup_task(bot, self.load_tracked())
+        self.flush_sessions.start()
+
+    def cog_unload(self):
+        self.flush_sessions.cancel()
+        self.bot.loop.create_task(self.flush())
+
+    async def load_tracked(self):
+        await self.bot.wait_until_ready()
+        await migrate_once(self.bot, 'vi.legacy_tracked', LEGACY_TRACKED)
+        query = '''SELECT channel_id, guild_id FROM voice_tracked;'''
+        for record in await self.bot.pool.fetch(query):
+            self.track(record['channel_id'], record['guild_id'])
+
+    def track(self, channel_id, guild_id):
+        history = self.tracked[channel_id] = VoiceHistory(guild_id)
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            for member in channel.members:
+                history.connected[member.id] = None
+        return history
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
@@ -29,39 +86,142 @@ class ViCog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        if member.guild.id != GUILD_ID:
+        if before.channel == after.channel:
             return
+        now = datetime.utcnow()
+        if before.channel is not None:
+            history = self.tracked.get(before.channel.id)
+            if history is not None:
+                session = (member.id, history.connected.pop(member.id, None), now)
+                history.sessions.append(session)
+                self.pending.append((history.guild_id, before.channel.id, *session))
+        if after.channel is not None:
+            history = self.tracked.get(after.channel.id)
+            if history is not None:
+                history.connected[member.id] = now
+                history.last_join = (member.id, now)
 
-        if before.channel and before.channel.id in self.vc_history and after.channel != before.channel:
-            self.vc_history[before.channel.id]['leave'] = (str(member), datetime.utcnow())
-        if after.channel and after.channel.id in self.vc_history and before.channel != after.channel:
-            self.vc_history[after.channel.id]['join'] = (str(member), datetime.utcnow())
+    @tasks.loop(minutes=1)
+    async def flush_sessions(self):
+        try:
+            await self.flush()
+        except Exception:
+            # Keep the loop going, the sessions are retried on the next flush
+            await self.bot.on_error('flush_sessions')
 
-    # noinspection PyTupleAssignmentBalance
-    @commands.command(hidden=True)
-    async def who(self, ctx, *, voicechannel: discord.VoiceChannel = None):
-        if ctx.guild and ctx.guild.id != GUILD_ID:
+    async def flush(self):
+        if not self.pending:
             return
+        sessions = list(self.pending)
+        self.pending.clear()
+        query = '''INSERT INTO voice_sessions (guild_id, channel_id, user_id, joined_at, left_at)
+                   VALUES ($1, $2, $3, $4, $5);'''
+        try:
+            await self.bot.pool.executemany(query, sessions)
+        except Exception:
+            # Put them back in front of anything newer to retry on the next flush, if that's more than
+            # MAX_PENDING the oldest are dropped
+            self.pending = deque(chain(sessions, self.pending), maxlen=MAX_PENDING)
+            raise
+
+    @flush_sessions.before_loop
+    async def before_flush(self):
+        await self.bot.wait_until_ready()
+
+    def member_name(self, guild, user_id):
+        member = guild.get_member(user_id)
+        return str(member) if member is not None else f'<unknown user {user_id}>'
+
+    async def check_voice(self, ctx, voicechannel):
+        """Returns the channel to look at, or None after telling the user why they can't"""
         if ctx.author.voice is not None:
             voicechannel = voicechannel or ctx.author.voice.channel
+        if voicechannel is None:
+            await ctx.send('Please specify a voice channel', delete_after=15)
+            return None
         if ctx.author.id not in (ctx.guild.owner_id, self.bot.owner_id) and (ctx.author.voice is None or ctx.author.voice.channel != voicechannel):
-            return await ctx.send('You are not in that voice channel!', delete_after=15)
+            await ctx.send('You are not in that voice channel!', delete_after=15)
+            return None
+        if voicechannel.id not in self.tracked:
+            await ctx.send('Sorry, I am not monitoring this vc\'s history', delete_after=15)
+            return None
+        return voicechannel
+
+    @commands.command(hidden=True)
+    @commands.guild_only()
+    async def who(self, ctx, *, voicechannel: discord.VoiceChannel = None):
+        """Shows who last joined and left the voice channel"""
+        voicechannel = await self.check_voice(ctx, voicechannel)
+        if voicechannel is None:
+            return
+        history = self.tracked[voicechannel.id]
+        now = datetime.utcnow()
+
+        if history.sessions:
+            user_id, _, leave_time = history.sessions[-1]
+            leave_delta = humanize.naturaldelta(now - leave_time)
+            await ctx.send(f'Last person to leave {voicechannel} was {self.member_name(ctx.guild, user_id)} - {leave_delta} ago', delete_after=30)
+
+        if history.last_join is not None:
+            user_id, join_time = history.last_join
+            join_delta = humanize.naturaldelta(now - join_time)
+            await ctx.send(f'Last person to join {voicechannel} was {self.member_name(ctx.guild, user_id)} - {join_delta} ago', delete_after=30)
+
+    @commands.command(name='vchistory', hidden=True)
+    @commands.guild_only()
+    async def vc_history(self, ctx, start: Ago, end: Optional[Ago] = None, *, voicechannel: discord.VoiceChannel = None):
+        """Shows who was in the voice channel between two times, given as how long ago
+        Example usage: `%vchistory 3h 1h` - who was in your vc between 3 and 1 hours ago"""
+        voicechannel = await self.check_voice(ctx, voicechannel)
+        if voicechannel is None:
+            return
+        end = end or datetime.utcnow()
+        if start > end:
+            start, end = end, start
+        await self.flush()
+
+        query = '''SELECT user_id, joined_at, left_at
+                   FROM voice_sessions
+                   WHERE channel_id = $1 AND left_at > $2 AND (joined_at IS NULL OR joined_at < $3)
+                   ORDER BY left_at
+                   LIMIT 100;'''
+        records = await self.bot.pool.fetch(query, voicechannel.id, start, end)
+        sessions = [(record['user_id'], record['joined_at'], record['left_at']) for record in records]
+        # Still in the channel
+        sessions.extend((user_id, joined, None) for user_id, joined in self.tracked[voicechannel.id].connected.items()
+                        if joined is None or joined < end)
+        if not sessions:
+            return await ctx.send(f'Nobody was in {voicechannel} then')
 
-        if voicechannel is None and ctx.author.voice is None:
-            return await ctx.send('Please specify a voice channel', delete_after=15)
+        def fmt(time):
+            return f'{humanize.naturaldelta(datetime.utcnow() - time)} ago' if time is not None else '?'
 
-        if voicechannel.id not in self.vc_history:
-            return await ctx.send('Sorry, I am not monitoring this vc\'s history', delete_after=15)
+        paginator = commands.Paginator(prefix='', suffix='')
+        paginator.add_line(f'In {voicechannel} between {fmt(start)} and {fmt(end)}:')
+        for user_id, joined, left in sessions:
+            paginator.add_line(f'{self.member_name(ctx.guild, user_id)}: joined {fmt(joined)}, '
+                               f'{"left " + fmt(left) if left is not None else "still there"}')
+        for page in paginator.pages:
+            await ctx.send(page, delete_after=60)
 
-        if self.vc_history[voicechannel.id]['leave'] is not None:
-            last_leave, leave_time = self.vc_history[voicechannel.id]['leave']
-            leave_delta = humanize.naturaldelta(datetime.utcnow() - leave_time)
-            await ctx.send(f'Last person to leave {voicechannel} was {last_leave} - {leave_delta} ago', delete_after=30)
+    @commands.command(name='vctrack', hidden=True)
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
+    async def vc_track(self, ctx, *, voicechannel: discord.VoiceChannel):
+        """Starts keeping a history of who joins and leaves the voice channel, toggles it off if it's already on"""
+        if voicechannel.id in self.tracked:
+            del self.tracked[voicechannel.id]
+            query = '''DELETE FROM voice_tracked WHERE channel_id = $1;'''
+            await self.bot.pool.execute(query, voicechannel.id)
+            return await ctx.send(f'No longer keeping history for {voicechannel}')
 
-        if self.vc_history[voicechannel.id]['join'] is not None:
-            last_join, join_time = self.vc_history[voicechannel.id]['join']
-            join_delta = humanize.naturaldelta(datetime.utcnow() - join_time)
-            await ctx.send(f'Last person to join {voicechannel} was {last_join} - {join_delta} ago', delete_after=30)
+        if sum(history.guild_id == ctx.guild.id for history in self.tracked.values()) >= MAX_TRACKED_PER_GUILD:
+            return await ctx.send(f'I can only keep history for {MAX_TRACKED_PER_GUILD} voice channels per server')
+        query = '''INSERT INTO voice_tracked (channel_id, guild_id) VALUES ($1, $2)
+                   ON CONFLICT (channel_id) DO NOTHING;'''
+        await self.bot.pool.execute(query, voicechannel.id, ctx.guild.id)
+        self.track(voicechannel.id, ctx.guild.id)
+        await ctx.send(f'Now keeping history for {voicechannel}')
 
 
 def setup(bot):
@@ -1,60 +1,133 @@
 import discord
 from discord.ext import commands
+from Startup import startup_task, migrate_once
 
-GUILD_ID = 528403806984077312
-CHANNEL_ID = 528405322168270849
-HAD_ID = 299205173878849537
-NOTIFY_ROLE = 715623011616555669
+DEFAULT_TIMEOUT = 7200
+# The channel this cog was written for, before channels were configurable. Added once, removing it later sticks
+LEGACY_ALERT = '''INSERT INTO conversation_alerts (channel_id, guild_id, timeout, role_id)
+                  VALUES (528405322168270849, 528403806984077312, 7200, 715623011616555669)
+                  ON CONFLICT (channel_id) DO NOTHING;'''
+
+
+class WatchedChannel:
+    __slots__ = ('timeout', 'role', 'last_seen')
+
+    def __init__(self, timeout, role, last_seen=None):
+        self.timeout = timeout  # seconds of silence before a message counts as a new conversation
+        self.role = role  # id of the role to ping
+        self.last_seen = last_seen  # created_at of the last message
+
+
+def last_message_time(channel):
+    """When the last message in the channel was sent, from the snowflake the gateway gave us"""
+    if channel is None or channel.last_message_id is None:
+        return None
+    return discord.utils.snowflake_time(channel.last_message_id)
 
 
 class WASHCog(commands.Cog):
+    """Pings a role when a conversation starts in a watched channel.
+    New conversation = new message where the previous message is over the channel's timeout old
+    If the new message contains a mention, then no notification is sent"""
 
     def __init__(self, bot):
         self.bot = bot
-        self._timeout = 7200
-        bot.loop.create_task(self.set_last_msg())
+        self.watched = {}  # channel id: WatchedChannel
+        startup_task(bot, self.load_watched())
 
-    async def set_last_msg(self):
+    async def load_watched(self):
         await self.bot.wait_until_ready()
-        channel = self.bot.get_guild(GUILD_ID).get_channel(CHANNEL_ID)
-        try:
-            last_msg = await channel.fetch_message(channel.last_message_id)
-        except discord.NotFound:
-            last_msg = await channel.history(limit=1).flatten()
-            self.last_msg = last_msg[0].created_at  # couldn't get last message with ID, use .history
-        else:
-            self.last_msg = last_msg.created_at
+        await migrate_once(self.bot, 'wash.legacy_alert', LEGACY_ALERT)
+        query = '''SELECT channel_id, timeout, role_id FROM conversation_alerts;'''
+        records = await self.bot.pool.fetch(query)
+        for record in records:
+            channel = self.bot.get_channel(record['channel_id'])
+            self.watched[record['channel_id']] = WatchedChannel(record['timeout'], record['role_id'],
+                                                                last_message_time(channel))
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.channel.id != CHANNEL_ID or message.author.bot:
+        watched = self.watched.get(message.channel.id)
+        if watched is None or message.author.bot:
             return
 
-        if abs(message.created_at - self.last_msg).seconds > self._timeout:
-            await self.send_alert(message)
-        self.last_msg = message.created_at
+        last_seen = watched.last_seen
+        watched.last_seen = message.created_at
+        if last_seen is not None and (message.created_at - last_seen).total_seconds() > watched.timeout:
+            await self.send_alert(message, watched)
 
-    async def send_alert(self, message):
+    async def send_alert(self, message, watched):
         if message.mentions:
             return
-        await message.channel.send(f'<@&{NOTIFY_ROLE}> A conversation just started!', delete_after=60)
+        await message.channel.send(f'<@&{watched.role}> A conversation just started!', delete_after=60)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        if self.watched.pop(channel.id, None) is not None:
+            query = '''DELETE FROM conversation_alerts WHERE channel_id = $1;'''
+            await self.bot.pool.execute(query, channel.id)
 
-    # If a new conversation started, then ping
-    # new conversation = new message where the previous message is over `self._timeout` seconds old
+    @commands.group(name='alert', invoke_without_command=True, case_insensitive=True, hidden=True)
+    @commands.guild_only()
+    async def alert(self, ctx):
+        """Lists the channels in this server that send a ping when a conversation starts"""
+        lines = [f'{channel.mention}: <@&{self.watched[channel.id].role}> after {self.watched[channel.id].timeout}s of silence'
+                 for channel in ctx.guild.text_channels if channel.id in self.watched]
+        if not lines:
+            return await ctx.send(f'No channels are being watched, see `{ctx.prefix}help alert add`')
+        await ctx.send('\n'.join(lines), allowed_mentions=discord.AllowedMentions.none())
+
+    @alert.command(name='add', aliases=['set'])
+    @commands.has_permissions(manage_channels=True)
+    async def alert_add(self, ctx, role: discord.Role, time: int = DEFAULT_TIMEOUT, channel: discord.TextChannel = None):
+        """Pings `role` when a new conversation starts in the channel (this one by default)
+        New conversation = new message where the previous message is over `time` seconds old
+
+        Example usage `%alert add @Chatters 300` - pings @Chatters after 5 minutes of silence"""
+        channel = channel or ctx.channel
+        if time < 0:
+            return await ctx.send('Please enter a positive number.')
+        query = '''INSERT INTO conversation_alerts (channel_id, guild_id, timeout, role_id)
+                   VALUES ($1, $2, $3, $4)
+                   ON CONFLICT (channel_id) DO UPDATE
+                   SET timeout = EXCLUDED.timeout, role_id = EXCLUDED.role_id;'''
+        await self.bot.pool.execute(query, channel.id, ctx.guild.id, time, role.id)
+        watched = self.watched.get(channel.id)
+        if watched is None:
+            self.watched[channel.id] = WatchedChannel(time, role.id, last_message_time(channel))
+        else:
+            watched.timeout, watched.role = time, role.id
+        await ctx.send(f'I will now ping {role.name} when there is a new message in {channel.mention} after {time}s of silence')
+
+    @alert.command(name='remove', aliases=['delete'])
+    @commands.has_permissions(manage_channels=True)
+    async def alert_remove(self, ctx, channel: discord.TextChannel = None):
+        """Stops the conversation alerts in the channel (this one by default)"""
+        channel = channel or ctx.channel
+        if self.watched.pop(channel.id, None) is None:
+            return await ctx.send(f'{channel.mention} is not being watched')
+        query = '''DELETE FROM conversation_alerts WHERE channel_id = $1;'''
+        await self.bot.pool.execute(query, channel.id)
+        await ctx.send(f'No longer watching {channel.mention}')
 
     @commands.command(name='setalert', hidden=True)
+    @commands.guild_only()
+    @commands.has_permissions(manage_channels=True)
     async def set_timeout(self, ctx, time: int):
-        """Send a notification if a new conversation started.
-        New conversation = new message where the previous message is over `time` seconds old
-        If the new message contains a mention, then notification will not be sent
+        """Changes how long this channel has to be quiet before a message counts as a new conversation
+
+        Needs Manage Channels, like the alert commands
 
         Example usage `%setalert 300` - sets the time to be 5 minutes
         """
-        if ctx.guild and ctx.guild.id != GUILD_ID:
-            return
+        watched = self.watched.get(ctx.channel.id)
+        if watched is None:
+            return await ctx.send(f'This channel is not being watched, see `{ctx.prefix}help alert add`')
         if time < 0:
-            return await ctx.send(f'Please enter a positive number.')
-        self._timeout = time
+            return await ctx.send('Please enter a positive number.')
+        query = '''UPDATE conversation_alerts SET timeout = $2 WHERE channel_id = $1;'''
+        await self.bot.pool.execute(query, ctx.channel.id, time)
+        watched.timeout = time
         await ctx.send(f'I will now send a ping when there is a new message after {time}s of silence')
 
 
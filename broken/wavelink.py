@@ -11,12 +11,14 @@ import datetime
 import discord
 import humanize
 import itertools
+import json
 import math
 import random
 import re
+import time
 import wavelink
 from async_timeout import timeout
-from discord.ext import commands
+from discord.ext import commands, tasks
 from asyncpg import UniqueViolationError
 
 
@@ -24,6 +26,17 @@ from utils.global_utils import confirm_prompt
 
 RURL = re.compile(r'https?://(?:www\.)?.+')
 
+# Sessions are snapshotted whenever their queue/settings change,
+# the playback position alone is only re-saved this often (seconds)
+POSITION_SAVE_INTERVAL = 60
+
+# How many upcoming tracks are checked ahead of time, and how old (seconds)
+# a resolved track can get before it is looked up again
+PREFETCH_AHEAD = 3
+TRACK_REFRESH_AGE = 1800
+# Start the next track this many ms before the current one ends
+GAPLESS_LEAD = 500
+
 
 class SongTime(commands.Converter):
     async def convert(self, ctx, argument):
@@ -40,14 +53,20 @@ class SongTime(commands.Converter):
 
 
 class Track(wavelink.Track):
-    __slots__ = ('requester', 'channel', 'message')
+    __slots__ = ('requester', 'channel', 'message', 'resolved_at')
 
-    def __init__(self, id_, info, *, ctx=None):
+    def __init__(self, id_, info, *, ctx=None, requester=None, channel=None):
         super(Track, self).__init__(id_, info)
 
-        self.requester = ctx.author
-        self.channel = ctx.channel
-        self.message = ctx.message
+        if ctx is not None:
+            requester, channel, message = ctx.author, ctx.channel, ctx.message
+        else:
+            message = None  # Restored from a saved session
+
+        self.requester = requester
+        self.channel = channel
+        self.message = message
+        self.resolved_at = time.monotonic()
 
     @property
     def is_dead(self):
@@ -61,6 +80,7 @@ class Player(wavelink.Player):
 
         self.queue = asyncio.Queue()
         self.next_event = asyncio.Event()
+        self.prefetch_event = asyncio.Event()
 
         self.volume = 50
         self.controller_message = None
@@ -88,9 +108,11 @@ class Player(wavelink.Player):
         self.repeats = set()
 
         self.eq = 'Flat'
+        self.start_position = 0
 
         self._loop = bot.loop.create_task(self.player_loop())
         self._updater = bot.loop.create_task(self.updater())
+        self._prefetcher = bot.loop.create_task(self.prefetcher())
 
     async def destroy(self):
         try:
@@ -101,12 +123,42 @@ class Player(wavelink.Player):
             self._updater.cancel()
         except asyncio.CancelledError:
             pass
+        try:
+            self._prefetcher.cancel()
+        except asyncio.CancelledError:
+            pass
         return await super().destroy()
 
+    async def hook(self, event):
+        if isinstance(event, wavelink.TrackEnd) and self.current is not None:
+            if event.reason == 'REPLACED' or event.track != self.current.id:
+                # The track that ended was already replaced by an early start of the next one,
+                # so leave our current track alone
+                return
+        if isinstance(event, wavelink.TrackException) and self.current is not None and event.track == self.current.id:
+            # super().hook clears current, so this is the last place the failed track can be marked
+            self.current.dead = True
+        await super().hook(event)
+
     @property
     def entries(self):
         return list(self.queue._queue)
 
+    def snapshot(self):
+        """Returns a compact, JSON serializable copy of this player's state.
+        Tracks are stored by their lavalink ID along with the requester's ID"""
+        if not self.is_connected or self.current is None:
+            return None
+        channel = getattr(self.current, 'channel', None)
+        return {'vc': self.channel_id,
+                'tc': getattr(channel, 'id', None),
+                'cur': [self.current.id, self.current.requester.id],
+                'pos': int(self.position),
+                'q': [[t.id, t.requester.id] for t in self.entries if not (self.looping and t is self.current)],
+                'vol': self.volume,
+                'eq': self.eq,
+                'loop': self.looping}
+
     async def updater(self):
         _second = False
         while not self.bot.is_closed():
@@ -119,16 +171,70 @@ class Player(wavelink.Player):
 
             await asyncio.sleep(10)
 
+    async def refresh_track(self, track):
+        """Looks the track up again so that it is playable.
+        Returns False and drops it from the queue if it can no longer be found"""
+        try:
+            tracks = await self.bot.wavelink.get_tracks(track.uri, retry_on_failure=False)
+        except Exception:
+            tracks = None
+        if isinstance(tracks, wavelink.TrackPlaylist):
+            tracks = tracks.tracks
+
+        if not tracks:
+            track.dead = True
+            try:
+                self.queue._queue.remove(track)
+            except ValueError:
+                pass
+            return False
+
+        track.id = tracks[0].id
+        track.info = tracks[0].info
+        track.dead = False
+        track.resolved_at = time.monotonic()
+        return True
+
+    async def prefetcher(self):
+        """Keeps the next few tracks in the queue resolved so there is no gap when they start.
+        Runs whenever a new track starts or every 30 seconds"""
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await asyncio.wait_for(self.prefetch_event.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                pass
+            self.prefetch_event.clear()
+
+            now = time.monotonic()
+            for track in list(itertools.islice(self.queue._queue, 0, PREFETCH_AHEAD)):
+                if track.is_dead or now - getattr(track, 'resolved_at', now) > TRACK_REFRESH_AGE:
+                    await self.refresh_track(track)
+
+    async def wait_for_track_end(self):
+        """Wait for the current track to end.
+        If something is queued up, return slightly early so it can start without a gap"""
+        while not self.next_event.is_set():
+            track = self.current
+            wait = 5
+            if track is not None and not track.is_stream and not self.paused and not self.queue.empty():
+                remaining = track.length - self.position
+                if remaining <= GAPLESS_LEAD:
+                    return
+                wait = min(wait, (remaining - GAPLESS_LEAD) / 1000)
+            try:
+                await asyncio.wait_for(self.next_event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
     async def player_loop(self):
         await self.bot.wait_until_ready()
 
-        await self.set_eq(self.equalizers.get('FLAT'))
+        await self.set_eq(self.equalizers.get(self.eq.upper(), self.equalizers.get('FLAT')))
         # We can do any pre loop prep here...
         await self.set_volume(self.volume)
 
         while True:
-            self.next_event.clear()
-
             self.inactive = False
 
             try:
@@ -142,20 +248,29 @@ class Player(wavelink.Player):
                 await self.destroy_controller()
                 continue
 
+            if song.is_dead and not await self.refresh_track(song):
+                continue
+
             self.current = song
             self.paused = False
 
             if self.looping:
                 await self.queue.put(song)
 
-            await self.play(song)
+            # Cleared this late because after a gapless early return the previous track is still playing, and its
+            # end can arrive while the queue is waited on or this song is refreshed. That end must not count for this song
+            self.next_event.clear()
+            # Non-zero only for the first song of a restored session
+            await self.play(song, start=self.start_position)
+            self.start_position = 0
+            self.prefetch_event.set()
 
             # Invoke our controller if we aren't already...
             if not self.update:
                 await self.invoke_controller()
 
-            # Wait for TrackEnd event to set our event...
-            await self.next_event.wait()
+            # Wait for TrackEnd event to set our event, or for the song to be nearly over...
+            await self.wait_for_track_end()
 
             # Clear votes...
             self.pauses.clear()
@@ -318,13 +433,20 @@ class Music(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.players = {}
+        # guild_id: (serialized state without position, time saved)
+        self._saved_sessions = {}
         if not hasattr(bot, 'wavelink'):
             self.bot.wavelink = wavelink.Client(bot=bot)
 
         bot.loop.create_task(self.initiate_nodes())
         bot.loop.create_task(self.set_noafks())
+        self.save_sessions.start()
 
     def cog_unload(self):
+        self.save_sessions.cancel()
+        # Snapshot before the players get destroyed below so they can be resumed on load
+        self.bot.loop.create_task(self.write_sessions(self.collect_sessions(force=True)))
+
         if not any([player.is_playing for player in self.bot.wavelink.players.values()]):
             for player in self.bot.wavelink.players.values():
                 self.bot.loop.create_task(player.destroy())
@@ -343,7 +465,8 @@ class Music(commands.Cog):
     async def initiate_nodes(self):
         _main = self.bot.wavelink.get_node('MAIN')
         if _main:
-            return _main.set_hook(self.event_hook)
+            _main.set_hook(self.event_hook)
+            return await self.restore_sessions()
 
         nodes = {'MAIN': {'host': '127.0.0.1',
                           'port': 2333,
@@ -363,10 +486,111 @@ class Music(commands.Cog):
 
             node.set_hook(self.event_hook)
 
+        await self.restore_sessions()
+
+    # Session persistence
+
+    def collect_sessions(self, *, force=False):
+        """Returns a list of (guild_id, state) for every session that changed since it was last saved.
+        A state of None means the session is over and should be deleted"""
+        now = datetime.datetime.utcnow()
+        changed = []
+        for guild_id, player in self.bot.wavelink.players.items():
+            state = player.snapshot()
+            if state is None:
+                # Idle or disconnected, a saved session would resume a track that already finished
+                if self._saved_sessions.pop(guild_id, None) is not None:
+                    changed.append((guild_id, None))
+                continue
+            position = state.pop('pos')
+            key = json.dumps(state, separators=(',', ':'))
+            saved = self._saved_sessions.get(guild_id)
+            if not force and saved is not None and saved[0] == key:
+                if player.paused or (now - saved[1]).total_seconds() < POSITION_SAVE_INTERVAL:
+                    continue
+            self._saved_sessions[guild_id] = (key, now)
+            state['pos'] = position
+            changed.append((guild_id, json.dumps(state, separators=(',', ':'))))
+
+        for guild_id in set(self._saved_sessions) - set(self.bot.wavelink.players):
+            del self._saved_sessions[guild_id]
+            changed.append((guild_id, None))
+        return changed
+
+    async def write_sessions(self, sessions):
+        upsert = '''INSERT INTO music_sessions(guild, state, updated_at)
+                    VALUES($1, $2, $3)
+                    ON CONFLICT (guild) DO UPDATE
+                    SET state = $2, updated_at = $3;'''
+        delete = '''DELETE FROM music_sessions WHERE guild = $1;'''
+        now = datetime.datetime.utcnow()
+        to_save = [(guild_id, state, now) for guild_id, state in sessions if state is not None]
+        to_delete = [(guild_id,) for guild_id, state in sessions if state is None]
+        if to_save:
+            await self.bot.pool.executemany(upsert, to_save)
+        if to_delete:
+            await self.bot.pool.executemany(delete, to_delete)
+
+    @tasks.loop(seconds=15)
+    async def save_sessions(self):
+        sessions = self.collect_sessions()
+        if sessions:
+            await self.write_sessions(sessions)
+
+    @save_sessions.before_loop
+    async def before_save_sessions(self):
+        await self.bot.wait_until_ready()
+
+    async def restore_sessions(self):
+        """Reconnects and resumes every session that was saved before the last shutdown"""
+        await self.bot.wait_until_ready()
+        query = '''SELECT guild, state FROM music_sessions;'''
+        records = await self.bot.pool.fetch(query)
+        stale = []
+        for record in records:
+            try:
+                restored = await self.restore_session(record['guild'], json.loads(record['state']))
+            except Exception:
+                # A broken session should not stop the others from resuming
+                restored = False
+            if restored:
+                # Empty key so the next save always rewrites it, and deletes it once the player is gone
+                self._saved_sessions[record['guild']] = ('', datetime.datetime.utcnow())
+            else:
+                stale.append((record['guild'], None))
+        if stale:
+            await self.write_sessions(stale)
+
+    async def restore_session(self, guild_id, state):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or guild.get_channel(state['vc']) is None:
+            return False
+        if guild_id in self.bot.wavelink.players:
+            # Still alive, the cog was only reloaded
+            return True
+        text_channel = guild.get_channel(state['tc'])
+        if text_channel is None:
+            return False
+
+        player = self.bot.wavelink.get_player(guild_id, cls=Player)
+        player.volume = state['vol']
+        player.eq = state['eq']
+        player.looping = state['loop']
+        player.start_position = state['pos']
+        for track_id, requester_id in [state['cur'], *state['q']]:
+            track = await self.bot.wavelink.build_track(track_id)
+            requester = guild.get_member(requester_id) or guild.me
+            await player.queue.put(Track(track.id, track.info, requester=requester, channel=text_channel))
+
+        await player.connect(state['vc'])
+        return True
+
     def event_hook(self, event):
         """Our event hook. Dispatched when an event occurs on our Node."""
         if isinstance(event, wavelink.TrackEnd):
-            event.player.next_event.set()
+            # current is only left set when the player ignored a replaced track's end
+            if event.player.current is None:
+                event.player.next_event.set()
         elif isinstance(event, wavelink.TrackException):
             try:
                 self.bot.loop.create_task(event.player._channel.send(f'An error occurred while trying to this track. Please try again later', delete_after=10))